@@ -0,0 +1,196 @@
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+
+# Agent calls allowed to run at once, and how many more may wait for a slot
+MAX_INFLIGHT = int(os.environ.get("CHAT_MAX_INFLIGHT", "16"))
+MAX_QUEUE = int(os.environ.get("CHAT_MAX_QUEUE", "64"))
+# Seconds suggested to rejected clients in the Retry-After header
+RETRY_AFTER = int(os.environ.get("CHAT_RETRY_AFTER", "5"))
+# Per-client token buckets: sustained requests per minute and burst size; 0 disables
+RATE_PER_MINUTE = float(os.environ.get("CHAT_RATE_PER_MINUTE", "30"))
+RATE_BURST = int(os.environ.get("CHAT_RATE_BURST", "10"))
+# ip | session: what identifies a client for rate limiting
+RATE_LIMIT_KEY = os.environ.get("CHAT_RATE_LIMIT_KEY", "ip")
+# Behind a reverse proxy the client address comes from X-Forwarded-For
+TRUST_FORWARDED_FOR = os.environ.get("CHAT_TRUST_FORWARDED_FOR", "off") == "on"
+BUCKET_SWEEP_INTERVAL = 60
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint"""
+
+    status = 503
+
+    def __init__(self, retry_after, message="Server is busy, please retry shortly"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooManyRequests(Overloaded):
+    """Raised when a client is over its rate limit"""
+
+    status = 429
+
+    def __init__(self, retry_after, message="Too many requests, please slow down"):
+        super().__init__(retry_after, message)
+
+
+def client_key(remote_addr, forwarded_for=None, session_id=None, key=RATE_LIMIT_KEY,
+               trust_forwarded_for=TRUST_FORWARDED_FOR):
+    """Identify the client a request is charged to.
+
+    Pass only a session_id the server issued: ids a client makes up cost
+    nothing, so charging them would let it rotate past its limit.
+    """
+    if key == "session" and isinstance(session_id, str) and session_id:
+        return "session:" + session_id[:64]
+    if trust_forwarded_for and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return remote_addr or "unknown"
+
+
+class RateLimiter:
+    """Per-client token buckets held in memory.
+
+    Each client may burst up to `burst` requests and then gets `per_minute`
+    a minute. A check is one dict lookup; buckets idle long enough to have
+    refilled completely are no different from new ones, so they are swept
+    every BUCKET_SWEEP_INTERVAL seconds.
+    """
+
+    def __init__(self, per_minute=RATE_PER_MINUTE, burst=RATE_BURST, sweep_interval=BUCKET_SWEEP_INTERVAL,
+                 clock=time.monotonic):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        # client key -> [tokens, last update]
+        self._buckets = {}
+        self._next_sweep = clock() + sweep_interval
+        self.allowed = 0
+        self.rejected = 0
+        self.swept = 0
+
+    def check(self, key, cost=1):
+        """Take `cost` tokens from the client's bucket, or raise TooManyRequests"""
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens < cost:
+                self._buckets[key] = [tokens, now]
+                self.rejected += 1
+                raise TooManyRequests(max(1, math.ceil((cost - tokens) / self.rate)))
+            self._buckets[key] = [tokens - cost, now]
+            self.allowed += 1
+
+    def _sweep(self, now):
+        refill_time = self.burst / self.rate
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated >= refill_time]
+        for key in idle:
+            del self._buckets[key]
+        self.swept += len(idle)
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected,
+                    "swept": self.swept}
+
+
+def make_rate_limiter():
+    """Build the per-client rate limiter, or None when CHAT_RATE_PER_MINUTE is 0"""
+    return RateLimiter() if RATE_PER_MINUTE > 0 and RATE_BURST > 0 else None
+
+
+class ConcurrencyLimit:
+    """Caps in-flight agent calls across the threads of the Flask server.
+
+    Interactive requests are rejected with Overloaded as soon as every
+    slot is taken; batch items may wait up to a timeout for one instead.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT, retry_after=RETRY_AFTER):
+        self.max_inflight = max_inflight
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextlib.contextmanager
+    def slot(self, timeout=None):
+        if timeout:
+            with self._lock:
+                self.waiting += 1
+            try:
+                acquired = self._semaphore.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        else:
+            acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            # The server is saturated, not this client: 503, so it is not throttled alone
+            raise Overloaded(self.retry_after)
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        # waiting counts batch items queued for a slot
+        return {"inflight": self.inflight, "max_inflight": self.max_inflight, "waiting": self.waiting,
+                "rejected": self.rejected}
+
+
+class ConcurrencyGate:
+    """Caps in-flight agent calls and bounds the queue waiting for a slot.
+
+    Requests beyond max_inflight wait for a slot; once max_queue requests are
+    already waiting, new ones are rejected straight away with Overloaded.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT, max_queue=MAX_QUEUE, retry_after=RETRY_AFTER):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.retry_after)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {"inflight": self.inflight, "max_inflight": self.max_inflight, "waiting": self.waiting,
+                "rejected": self.rejected}
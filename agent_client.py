@@ -0,0 +1,539 @@
+import asyncio
+import json
+import os
+import queue
+import select
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+from deadlines import CANCELLATIONS, DISCONNECT_POLL, current_deadline, error_for
+from response_decoder import decode_agent_output, decode_payload
+
+AGENT_NAME = os.environ.get("AGENTCORE_AGENT", "async_shopping_strands")
+# ARN of the deployed runtime, used by the in-process boto3 client
+AGENT_ARN = os.environ.get("AGENTCORE_AGENT_ARN")
+AGENT_REGION = os.environ.get("AGENTCORE_REGION", os.environ.get("AWS_REGION", "us-east-1"))
+# Direct runtime endpoint, e.g. a local runtime or agent_stub.py
+AGENT_ENDPOINT = os.environ.get("AGENTCORE_ENDPOINT")
+# sdk | http | cli | pool; picked from the settings above when unset
+INVOKE_MODE = os.environ.get("AGENTCORE_INVOKE_MODE")
+AGENTCORE_CLI = shlex.split(os.environ.get("AGENTCORE_CLI", "agentcore"))
+INVOKE_TIMEOUT = int(os.environ.get("AGENTCORE_INVOKE_TIMEOUT", "60"))
+POOL_SIZE = int(os.environ.get("AGENTCORE_POOL_SIZE", "10"))
+# off skips hedging, adaptive timeouts and the circuit breaker (invocation_policy.py)
+INVOKE_POLICY = os.environ.get("AGENTCORE_INVOKE_POLICY", "on") != "off"
+# Routes an invocation to a runtime session on the HTTP runtime contract
+SESSION_ID_HEADER = "X-Amzn-Bedrock-AgentCore-Runtime-Session-Id"
+
+
+class AgentInvocationError(Exception):
+    """Raised when the agent runtime rejects or fails an invocation"""
+
+
+def event_text(event):
+    """Extract the text delta carried by one streamed agent event"""
+    if isinstance(event, str):
+        return event
+    if isinstance(event, dict):
+        if isinstance(event.get("data"), str):
+            return event["data"]
+        delta = event.get("event", {}).get("contentBlockDelta", {}).get("delta", {})
+        if isinstance(delta, dict) and isinstance(delta.get("text"), str):
+            return delta["text"]
+    return None
+
+
+def iter_sse_text(lines):
+    """Yield the text deltas from the data: lines of an SSE stream"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r\n")
+        if not line.startswith("data:"):
+            continue
+        data = line[5:]
+        if data.startswith(" "):
+            data = data[1:]
+        try:
+            text = event_text(json.loads(data))
+        except json.JSONDecodeError:
+            text = data
+        if text:
+            yield text
+
+
+async def iterate_in_thread(iterator):
+    """Drive a blocking iterator from asyncio without blocking the event loop"""
+    done = object()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        iterator.close()
+
+
+def kill_process_group(proc):
+    """Kill a subprocess started in its own session, and everything it started"""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            pass
+    proc.kill()
+
+
+class CliAgentClient:
+    """Invokes the agent through the agentcore CLI, one subprocess per call.
+
+    Returns the raw CLI stdout, which still has to be parsed. Each CLI runs
+    in its own process group, so when the request's deadline fires (see
+    deadlines.py) the CLI and whatever it started are killed together.
+    """
+
+    structured = False
+
+    def __init__(self, agent=AGENT_NAME, command=AGENTCORE_CLI, timeout=INVOKE_TIMEOUT):
+        self.agent = agent
+        self.command = list(command)
+        self.timeout = timeout
+
+    def _command(self, prompt, session_id):
+        cmd = self.command + ["invoke", "--agent", self.agent]
+        if session_id:
+            cmd += ["--session-id", session_id]
+        return cmd + [json.dumps({"prompt": prompt})]
+
+    def invoke(self, prompt, credentials, session_id=None):
+        cmd = self._command(prompt, session_id)
+        deadline = current_deadline()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                env=credentials.as_env(), start_new_session=True)
+        start = time.monotonic()
+        try:
+            while True:
+                elapsed = time.monotonic() - start
+                if elapsed >= self.timeout:
+                    raise subprocess.TimeoutExpired(cmd, self.timeout)
+                try:
+                    # Wake up regularly to see whether the request gave up
+                    stdout, stderr = proc.communicate(
+                        timeout=self.timeout - elapsed if deadline is None else DISCONNECT_POLL)
+                    break
+                except subprocess.TimeoutExpired:
+                    reason = deadline.fired() if deadline is not None else None
+                    if reason is not None:
+                        CANCELLATIONS.record(reason, time.monotonic() - start, self.timeout)
+                        raise error_for(reason) from None
+        finally:
+            if proc.returncode is None:
+                kill_process_group(proc)
+                proc.communicate()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        CANCELLATIONS.completed(time.monotonic() - start)
+        return stdout
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        # The CLI only prints its envelope once the agent is done
+        agent_reply = decode_agent_output(self.invoke(prompt, credentials, session_id)).text
+        if agent_reply:
+            yield agent_reply
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        cmd = self._command(prompt, session_id)
+        deadline = current_deadline()
+        timeout = self.timeout if deadline is None else min(self.timeout, deadline.remaining())
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=credentials.as_env(),
+            start_new_session=True)
+        start = time.monotonic()
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            if timeout < self.timeout:
+                CANCELLATIONS.record("deadline", time.monotonic() - start, self.timeout)
+                raise error_for("deadline") from None
+            raise subprocess.TimeoutExpired(cmd, self.timeout) from None
+        except asyncio.CancelledError:
+            # A request that disconnected, rather than a losing hedge
+            reason = deadline.fired() if deadline is not None else None
+            if reason is not None:
+                CANCELLATIONS.record(reason, time.monotonic() - start, self.timeout)
+            raise
+        finally:
+            # Covers timeouts and cancelled requests alike
+            if proc.returncode is None:
+                kill_process_group(proc)
+                await proc.wait()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        CANCELLATIONS.completed(time.monotonic() - start)
+        return stdout.decode("utf-8")
+
+    async def invoke_stream_async(self, prompt, credentials, session_id=None):
+        agent_reply = decode_agent_output(await self.invoke_async(prompt, credentials, session_id)).text
+        if agent_reply:
+            yield agent_reply
+
+
+def connection_dropped(sock):
+    """True when a pooled idle socket was closed by the server, or has unrequested data on it"""
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+# Pooled connections would be shared with the children of a fork, e.g. the
+# workers of a preloading server; each child opens its own
+_HTTP_CLIENTS = weakref.WeakSet()
+
+
+def _after_fork():
+    for client in list(_HTTP_CLIENTS):
+        client._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class HttpAgentClient:
+    """Invokes a runtime endpoint over a pool of keep-alive HTTP connections.
+
+    Returns the decoded JSON payload produced by the agent.
+    """
+
+    structured = True
+
+    def __init__(self, endpoint=AGENT_ENDPOINT, pool_size=POOL_SIZE, timeout=INVOKE_TIMEOUT):
+        # Imported here so the other modes do not pay for http.client and ssl at start-up
+        import http.client
+
+        url = urlsplit(endpoint)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._connection_errors = (http.client.HTTPException, OSError)
+        self._host = url.hostname
+        self._port = url.port
+        self._path = url.path or "/invocations"
+        self._timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._ssl = url.scheme == "https"
+        self._async_pool = []
+        self._async_pool_size = pool_size
+        _HTTP_CLIENTS.add(self)
+
+    def _after_fork(self):
+        self._pool = queue.LifoQueue(maxsize=self._pool.maxsize)
+        self._async_pool = []
+
+    def warm_up(self, credentials=None):
+        """Open a keep-alive connection ahead of the first invocation"""
+        conn = self._connection_class(self._host, self._port, timeout=self._timeout)
+        conn.connect()
+        self._release(conn)
+
+    def _acquire(self):
+        # A connection the server closed while it sat idle is dropped here,
+        # before anything is written to it
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return self._connection_class(self._host, self._port, timeout=self._timeout)
+            if not connection_dropped(conn.sock):
+                return conn
+            conn.close()
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _open(self, body, accept, session_id=None):
+        headers = {"Content-Type": "application/json", "Accept": accept}
+        if session_id:
+            headers[SESSION_ID_HEADER] = session_id
+        conn = self._acquire()
+        try:
+            conn.request("POST", self._path, body, headers)
+            response = conn.getresponse()
+        except self._connection_errors:
+            # Not retried: once the request is on the wire the runtime may
+            # already be running the turn, and a POST is not idempotent
+            conn.close()
+            raise
+        if response.status >= 400:
+            data = response.read()
+            self._done(conn, response)
+            raise AgentInvocationError(f"Agent runtime returned HTTP {response.status}: {data[:200]!r}")
+        return conn, response
+
+    def _done(self, conn, response):
+        # Only fully read responses leave the connection reusable
+        if response.isclosed() and not response.will_close:
+            self._release(conn)
+        else:
+            conn.close()
+
+    def invoke(self, prompt, credentials, session_id=None):
+        conn, response = self._open(json.dumps({"prompt": prompt}).encode("utf-8"), "application/json", session_id)
+        try:
+            return json.loads(response.read())
+        finally:
+            self._done(conn, response)
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        body = json.dumps({"prompt": prompt}).encode("utf-8")
+        conn, response = self._open(body, "text/event-stream, application/json", session_id)
+        try:
+            if (response.getheader("Content-Type") or "").startswith("text/event-stream"):
+                yield from iter_sse_text(response)
+            else:
+                agent_reply = decode_payload(json.loads(response.read())).text
+                if agent_reply:
+                    yield agent_reply
+        finally:
+            self._done(conn, response)
+
+    async def _open_async(self, body, accept, session_id=None):
+        port = self._port or (443 if self._ssl else 80)
+        session_header = f"{SESSION_ID_HEADER}: {session_id}\r\n" if session_id else ""
+        request = (
+            f"POST {self._path} HTTP/1.1\r\n"
+            f"Host: {self._host}:{port}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Accept: {accept}\r\n"
+            f"{session_header}"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("latin-1") + body
+        reader, writer = await self._acquire_async(port)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), self._timeout)
+            if not status_line:
+                raise ConnectionResetError("connection closed by runtime")
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self._timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except BaseException:
+            # Not retried, as in _open; a runtime that stalls or resets while
+            # sending its headers must not leave the connection open
+            writer.close()
+            raise
+        return reader, writer, status, headers
+
+    async def _acquire_async(self, port):
+        # The event loop has seen the server close an idle connection by now,
+        # so a dropped one is discarded before anything is written to it
+        while self._async_pool:
+            reader, writer = self._async_pool.pop()
+            if not (reader.at_eof() or writer.is_closing()):
+                return reader, writer
+            writer.close()
+        return await asyncio.wait_for(asyncio.open_connection(self._host, port, ssl=self._ssl or None), self._timeout)
+
+    async def _iter_body_async(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await asyncio.wait_for(reader.readline(), self._timeout)).split(b";")[0], 16)
+                if size == 0:
+                    # Skip any trailers up to the terminating blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                data = await asyncio.wait_for(reader.readexactly(size + 2), self._timeout)
+                yield data[:-2]
+        elif "content-length" in headers:
+            yield await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), self._timeout)
+        else:
+            yield await asyncio.wait_for(reader.read(), self._timeout)
+
+    def _done_async(self, reader, writer, headers, complete):
+        reusable = (complete and headers.get("connection", "").lower() != "close"
+                    and ("content-length" in headers or "transfer-encoding" in headers))
+        if reusable and len(self._async_pool) < self._async_pool_size:
+            self._async_pool.append((reader, writer))
+        else:
+            writer.close()
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        body = json.dumps({"prompt": prompt}).encode("utf-8")
+        reader, writer, status, headers = await self._open_async(body, "application/json", session_id)
+        complete = False
+        try:
+            data = b"".join([chunk async for chunk in self._iter_body_async(reader, headers)])
+            complete = True
+        finally:
+            self._done_async(reader, writer, headers, complete)
+        if status >= 400:
+            raise AgentInvocationError(f"Agent runtime returned HTTP {status}: {data[:200]!r}")
+        return json.loads(data)
+
+    async def invoke_stream_async(self, prompt, credentials, session_id=None):
+        body = json.dumps({"prompt": prompt}).encode("utf-8")
+        reader, writer, status, headers = await self._open_async(
+            body, "text/event-stream, application/json", session_id)
+        complete = False
+        try:
+            if status >= 400 or not headers.get("content-type", "").startswith("text/event-stream"):
+                data = b"".join([chunk async for chunk in self._iter_body_async(reader, headers)])
+                complete = True
+                if status >= 400:
+                    raise AgentInvocationError(f"Agent runtime returned HTTP {status}: {data[:200]!r}")
+                agent_reply = decode_payload(json.loads(data)).text
+                if agent_reply:
+                    yield agent_reply
+                return
+            buffer = b""
+            async for chunk in self._iter_body_async(reader, headers):
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for text in iter_sse_text(lines):
+                    yield text
+            for text in iter_sse_text([buffer]):
+                yield text
+            complete = True
+        finally:
+            self._done_async(reader, writer, headers, complete)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        while self._async_pool:
+            self._async_pool.pop()[1].close()
+
+
+class SdkAgentClient:
+    """Invokes the deployed runtime in-process through boto3.
+
+    One boto3 client is kept per set of credentials, so its connection pool
+    survives across requests and is only rebuilt after a credential refresh.
+    """
+
+    structured = True
+
+    def __init__(self, agent_arn=AGENT_ARN, region=AGENT_REGION, pool_size=POOL_SIZE, timeout=INVOKE_TIMEOUT):
+        self.agent_arn = agent_arn
+        self.region = region
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_credentials = None
+
+    def _get_client(self, credentials):
+        with self._lock:
+            if self._client is None or self._client_credentials is not credentials:
+                import boto3
+                from botocore.config import Config
+
+                self._client = boto3.client(
+                    "bedrock-agentcore",
+                    region_name=self.region,
+                    aws_access_key_id=credentials.access_key_id,
+                    aws_secret_access_key=credentials.secret_access_key,
+                    aws_session_token=credentials.session_token,
+                    config=Config(
+                        max_pool_connections=self.pool_size,
+                        read_timeout=self.timeout,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 1},
+                    ),
+                )
+                self._client_credentials = credentials
+            return self._client
+
+    def warm_up(self, credentials):
+        """Import boto3 and build the client ahead of the first invocation"""
+        self._get_client(credentials)
+
+    def _invoke_runtime(self, prompt, credentials, accept, session_id):
+        client = self._get_client(credentials)
+        params = {}
+        if session_id:
+            params["runtimeSessionId"] = session_id
+        return client.invoke_agent_runtime(
+            agentRuntimeArn=self.agent_arn,
+            contentType="application/json",
+            accept=accept,
+            payload=json.dumps({"prompt": prompt}).encode("utf-8"),
+            **params,
+        )
+
+    def invoke(self, prompt, credentials, session_id=None):
+        response = self._invoke_runtime(prompt, credentials, "application/json", session_id)
+        return json.loads(response["response"].read())
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        response = self._invoke_runtime(prompt, credentials, "text/event-stream, application/json", session_id)
+        body = response["response"]
+        try:
+            if response.get("contentType", "").startswith("text/event-stream"):
+                yield from iter_sse_text(body.iter_lines())
+            else:
+                agent_reply = decode_payload(json.loads(body.read())).text
+                if agent_reply:
+                    yield agent_reply
+        finally:
+            body.close()
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        # boto3 is blocking; the caller's concurrency cap bounds these threads
+        return await asyncio.to_thread(self.invoke, prompt, credentials, session_id)
+
+    def invoke_stream_async(self, prompt, credentials, session_id=None):
+        return iterate_in_thread(self.invoke_stream(prompt, credentials, session_id))
+
+
+def make_agent_client(mode=None, policy=INVOKE_POLICY, transport=None):
+    """Build the agent client for the configured invocation mode and transport"""
+    from agent_transport import TRANSPORT, FixtureStore, RecordingAgentClient, ReplayAgentClient
+
+    transport = transport or TRANSPORT
+    if transport not in ("live", "record", "replay"):
+        raise ValueError(f"Unknown agent transport: {transport}")
+    mode = mode or INVOKE_MODE or ("sdk" if AGENT_ARN else "http" if AGENT_ENDPOINT else "cli")
+    if transport == "replay":
+        # Recorded fixtures stand in for the runtime, whatever the mode
+        client = ReplayAgentClient(FixtureStore().load())
+    elif mode == "sdk":
+        client = SdkAgentClient()
+    elif mode == "http":
+        client = HttpAgentClient()
+    elif mode == "cli":
+        client = CliAgentClient()
+    elif mode == "pool":
+        from agent_worker import WorkerPoolAgentClient
+
+        client = WorkerPoolAgentClient()
+    else:
+        raise ValueError(f"Unknown agent invocation mode: {mode}")
+    if transport == "record":
+        client = RecordingAgentClient(client, FixtureStore())
+    if policy:
+        from invocation_policy import PolicyAgentClient
+
+        client = PolicyAgentClient(client)
+    return client
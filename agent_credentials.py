@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import weakref
+from collections import namedtuple
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BRITIVE_PROFILE = os.environ.get(
+    "BRITIVE_PROFILE",
+    "aws_standalone_app_513826297540/513826297540 (aws_standalone_app_513826297540_environment)/AWS Admin Full Access",
+)
+BRITIVE_TENANT = os.environ.get("BRITIVE_TENANT", "agentic-ai")
+
+# Refresh this many seconds before the session credentials expire
+REFRESH_MARGIN = int(os.environ.get("CREDENTIALS_REFRESH_MARGIN", "300"))
+# Lifetime assumed when the checkout output carries no Expiration field
+DEFAULT_TTL = int(os.environ.get("CREDENTIALS_DEFAULT_TTL", "3600"))
+# After a failed refresh ahead of expiry, wait this many seconds before the
+# next attempt, doubling with each further failure up to the maximum
+REFRESH_BACKOFF = float(os.environ.get("CREDENTIALS_REFRESH_BACKOFF", "5"))
+REFRESH_BACKOFF_MAX = float(os.environ.get("CREDENTIALS_REFRESH_BACKOFF_MAX", "60"))
+# File shared by the worker processes of one server, so only one of them runs
+# the checkout; unset keeps credentials in each process only
+CREDENTIALS_CACHE = os.environ.get("CREDENTIALS_CACHE", "")
+
+
+class AwsCredentials(namedtuple("AwsCredentials", "access_key_id secret_access_key session_token expiration")):
+    """Immutable AWS session credentials; expiration is a Unix timestamp"""
+
+    __slots__ = ()
+
+    def as_env(self, base=None):
+        """Return a copy of the environment with these credentials set"""
+        env = dict(os.environ if base is None else base)
+        env['AWS_ACCESS_KEY_ID'] = self.access_key_id
+        env['AWS_SECRET_ACCESS_KEY'] = self.secret_access_key
+        env['AWS_SESSION_TOKEN'] = self.session_token
+        return env
+
+
+def parse_expiration(value, now):
+    """Convert the checkout Expiration field to a Unix timestamp"""
+    if not value:
+        return now + DEFAULT_TTL
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return now + DEFAULT_TTL
+
+
+def checkout_credentials(timeout=30):
+    """Check out AWS credentials with pybritive"""
+    creds_json = subprocess.check_output([
+        "pybritive", "checkout",
+        BRITIVE_PROFILE,
+        "-t", BRITIVE_TENANT
+    ], text=True, timeout=timeout)
+    creds = json.loads(creds_json)
+    return AwsCredentials(
+        creds['AccessKeyId'],
+        creds['SecretAccessKey'],
+        creds['SessionToken'],
+        parse_expiration(creds.get('Expiration'), time.time()),
+    )
+
+
+class SharedCredentialCache:
+    """Checks out credentials once for all processes sharing a cache file.
+
+    Called in place of the checkout function. Under an exclusive lock on
+    `path`.lock it returns the credentials another process already saved if
+    they are still outside the refresh margin, and otherwise checks out new
+    ones and saves them for the others. Workers that reach the refresh
+    margin together therefore wait for one checkout instead of each running
+    their own.
+    """
+
+    def __init__(self, fetch=checkout_credentials, path=CREDENTIALS_CACHE, refresh_margin=REFRESH_MARGIN,
+                 clock=time.time):
+        self._fetch = fetch
+        self.path = path
+        self._refresh_margin = refresh_margin
+        self._clock = clock
+        self.checkouts = 0
+        self.shared = 0
+
+    def __call__(self):
+        import fcntl
+
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                creds = self._load()
+                if creds is not None and self._clock() < creds.expiration - self._refresh_margin:
+                    self.shared += 1
+                    return creds
+                creds = self._fetch()
+                self._save(creds)
+                self.checkouts += 1
+                return creds
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return AwsCredentials(*json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _save(self, creds):
+        # Written under a temporary name and renamed, readable by this user only
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(list(creds), f)
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        return {"checkouts": self.checkouts, "shared": self.shared}
+
+
+def shared_checkout(fetch=checkout_credentials):
+    """The checkout function, shared through CREDENTIALS_CACHE when it is set"""
+    return SharedCredentialCache(fetch) if CREDENTIALS_CACHE else fetch
+
+
+# Providers whose refresh state is reset in forked children
+_PROVIDERS = weakref.WeakSet()
+
+
+def _after_fork():
+    for provider in list(_PROVIDERS):
+        provider._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class CredentialProvider:
+    """Caches checked-out credentials and refreshes them ahead of expiry.
+
+    get() returns the cached credentials while they are valid. Once they are
+    inside the refresh margin a single background refresh is started and the
+    current credentials keep being served until it lands. A failed refresh
+    is retried after a growing backoff rather than on the next call, while
+    the current credentials are still served. Callers only block when there
+    are no usable credentials at all, and then they all wait on the same
+    checkout.
+    """
+
+    def __init__(self, fetch=checkout_credentials, refresh_margin=REFRESH_MARGIN, clock=time.time,
+                 backoff=REFRESH_BACKOFF, max_backoff=REFRESH_BACKOFF_MAX):
+        self._fetch = fetch
+        self._refresh_margin = refresh_margin
+        self._clock = clock
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._creds = None
+        self._refreshing = False
+        self._generation = 0
+        self._error = None
+        # Consecutive failed refreshes, and when the next refresh ahead may start
+        self._failures = 0
+        self._retry_at = 0.0
+        self.refresh_count = 0
+        self.refresh_failures = 0
+        _PROVIDERS.add(self)
+
+    def get(self, timeout=None):
+        """Return valid credentials, checking out new ones if needed.
+
+        timeout bounds the wait for a checkout another caller is running.
+        """
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                creds = self._creds
+                now = self._clock()
+                if creds is not None and now < creds.expiration:
+                    self._refresh_ahead(creds, now)
+                    return creds
+                if not self._refreshing:
+                    self._refreshing = True
+                    break
+                # Another caller is already checking out; wait for its result
+                generation = self._generation
+                if not self._cond.wait(None if give_up is None else max(0.0, give_up - time.monotonic())):
+                    raise TimeoutError("Timed out waiting for AWS credentials")
+                if self._generation != generation and self._error is not None:
+                    raise self._error
+        return self._refresh()
+
+    def cached(self):
+        """Return the cached credentials if still valid, or None, without blocking"""
+        with self._cond:
+            creds = self._creds
+            now = self._clock()
+            if creds is None or now >= creds.expiration:
+                return None
+            self._refresh_ahead(creds, now)
+            return creds
+
+    def stats(self):
+        stats = {"refreshes": self.refresh_count, "refresh_failures": self.refresh_failures}
+        if hasattr(self._fetch, "stats"):
+            # Checkouts run by this process, and credentials it took from the shared cache
+            stats.update(self._fetch.stats())
+        return stats
+
+    def invalidate(self):
+        """Drop the cached credentials so the next get() checks out again"""
+        with self._cond:
+            self._creds = None
+
+    def _refresh_ahead(self, creds, now):
+        # Called with the lock held
+        if now >= creds.expiration - self._refresh_margin and not self._refreshing and now >= self._retry_at:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            creds = self._fetch()
+        except Exception as e:
+            with self._cond:
+                self._refreshing = False
+                self._error = e
+                self._failures += 1
+                self.refresh_failures += 1
+                delay = min(self._max_backoff, self._backoff * 2 ** (self._failures - 1))
+                self._retry_at = self._clock() + delay
+                self._generation += 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._creds = creds
+            self._refreshing = False
+            self._error = None
+            self._failures = 0
+            self._retry_at = 0.0
+            self._generation += 1
+            self.refresh_count += 1
+            self._cond.notify_all()
+        return creds
+
+    def _after_fork(self):
+        # A refresh running in the parent, e.g. a gunicorn master refreshing
+        # ahead while it forks workers, has no thread in the child to finish it
+        self._cond = threading.Condition()
+        self._refreshing = False
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception:
+            # Keep serving the current credentials until they actually expire;
+            # the next attempt waits out the backoff
+            logger.exception("Background credential refresh failed")
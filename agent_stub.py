@@ -0,0 +1,146 @@
+"""Local stand-in for the AgentCore runtime, for offline testing and benchmarks.
+
+    python agent_stub.py serve [--port 8080] [--delay 0.05] [--chunk-delay 0.02] [--cold-start 0.5]
+        Serves the runtime contract (POST /invocations, GET /ping). Requests
+        that accept text/event-stream get the reply streamed as SSE. The
+        first request of each runtime session, and every request without
+        one, waits an extra --cold-start seconds like a fresh runtime does.
+
+    python agent_stub.py invoke --agent NAME [--session-id ID] '{"prompt": "..."}'
+        Mimics `agentcore invoke`: posts the payload to the stub server and
+        prints the CLI-style envelope. Point AGENTCORE_CLI at
+        "python agent_stub.py" to drive the CLI path against the stub.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent_client import SESSION_ID_HEADER
+
+STUB_URL = os.environ.get("AGENTCORE_STUB_URL", "http://127.0.0.1:8080/invocations")
+
+SAMPLE_REPLY = (
+    "Here are some great options for you:\\ \\ "
+    "1. **Sony WF-1000XM4** - $98.00\\ Excellent noise cancellation and 8-hour battery life.\\ \\ "
+    "2. **Jabra Elite 85t** - $89.99\\ Comfortable fit with adjustable ANC.\\ \\ "
+    "3. **Anker Soundcore Liberty 4** - $79.99\\ Great value with spatial audio.\\ \\ "
+    "Would you like me to compare any of these in more detail?"
+)
+
+
+def agent_payload(prompt, reply=SAMPLE_REPLY):
+    """Build the payload the shopping agent returns for a prompt"""
+    return {"result": {"role": "assistant", "content": [{"text": reply}]}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay = 0.0
+    chunk_delay = 0.0
+    cold_start = 0.0
+    # Runtime session ids seen so far, shared by the server's handlers
+    sessions = frozenset()
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/ping":
+            self._send(200, b'{"status": "Healthy"}')
+        else:
+            self._send(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            prompt = json.loads(self.rfile.read(length)).get("prompt", "")
+        except json.JSONDecodeError:
+            self._send(400, b'{"error": "invalid payload"}')
+            return
+        if self.path != "/invocations":
+            self._send(404, b'{"error": "not found"}')
+            return
+        session_id = self.headers.get(SESSION_ID_HEADER)
+        if self.cold_start and session_id not in self.sessions:
+            time.sleep(self.cold_start)
+        if session_id:
+            self.sessions.add(session_id)
+        if self.delay:
+            time.sleep(self.delay)
+        if "text/event-stream" in self.headers.get("Accept", ""):
+            self._stream(SAMPLE_REPLY)
+        else:
+            self._send(200, json.dumps(agent_payload(prompt)).encode("utf-8"))
+
+    def _stream(self, reply, chunk_size=16):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(reply), chunk_size):
+            event = f"data: {json.dumps(reply[i:i + chunk_size])}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host="127.0.0.1", port=8080, delay=0.0, chunk_delay=0.0, cold_start=0.0):
+    """Create (but do not start) a stub runtime server"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "delay": delay, "chunk_delay": chunk_delay, "cold_start": cold_start, "sessions": set()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def cli_invoke(payload, url=STUB_URL, session_id=None):
+    """Post a payload to the stub and print it the way `agentcore invoke` does"""
+    headers = {"Content-Type": "application/json"}
+    if session_id:
+        headers[SESSION_ID_HEADER] = session_id
+    request = urllib.request.Request(url, data=payload.encode("utf-8"), headers=headers)
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+    print(json.dumps({"response": [repr(body)]}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--delay", type=float, default=0.0, help="seconds to wait before replying")
+    serve.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    serve.add_argument("--cold-start", type=float, default=0.0,
+                       help="extra seconds for the first request of a runtime session")
+    invoke = commands.add_parser("invoke")
+    invoke.add_argument("--agent")
+    invoke.add_argument("--session-id")
+    invoke.add_argument("payload")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = make_server(args.host, args.port, args.delay, args.chunk_delay, args.cold_start)
+        print(f"Agent stub listening on http://{args.host}:{args.port}/invocations", file=sys.stderr)
+        server.serve_forever()
+    else:
+        cli_invoke(args.payload, session_id=args.session_id)
+
+
+if __name__ == '__main__':
+    main()
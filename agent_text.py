@@ -0,0 +1,126 @@
+import re
+
+
+# One token per backslash run, with the context the original sequential
+# rewrites looked at. Applied in priority order, those rewrites were:
+#   "\ \ " -> blank line, "\<whitespace>1." -> list item, ":\\" and ":\ " -> ":"
+#   + newline, "\ " -> newline, \n \t \' \" -> unescaped, "\\" -> "\",
+#   and finally a trailing backslash is dropped.
+_CLEANUP_TOKEN = re.compile(r"""
+    \\(?P<run>\\*)
+    (?:
+        (?P<escape>[nt'"])                          # escaped character
+        # A paragraph break ending a run turns the backslash before it
+        # into a list marker over the blank line
+      | (?<=\\\\)\ \\\ (?:\s|\\\ \\\ )*(?P<held_item>\d+\.)
+      | (?!\ \\\ )(?:\s|\\\ \\\ )+(?P<item>\d+\.)   # list marker
+      | (?P<paragraph>\ \\\ )                       # paragraph break
+      | (?P<space>\ )                               # line break
+    )?
+""", re.VERBOSE)
+
+_ESCAPES = {'n': '\n', 't': '\t', "'": "'", '"': '"'}
+
+# The common single-backslash tokens, which never depend on their context
+_SIMPLE_TOKENS = {
+    '\\ ': '\n',
+    '\\ \\ ': '\n\n',
+    **{'\\' + char: replacement for char, replacement in _ESCAPES.items()},
+}
+
+
+def _translate_token(match):
+    text = _SIMPLE_TOKENS.get(match.group())
+    if text is not None:
+        return text
+
+    run, escape, held_item, item, paragraph, space = match.groups()
+    free = len(run) + 1
+    # "late" rewrites ran after ":\\", which may steal their backslash
+    late = None
+    if held_item is not None:
+        free, end = free - 2, '\n' + held_item
+    elif item is not None:
+        free, end = free - 1, '\n' + item
+    elif paragraph is not None:
+        free, end = free - 1, '\n\n'
+    elif space is not None:
+        end, late = '\n', ' '
+    elif escape is not None:
+        end, late = _ESCAPES[escape], escape
+    else:
+        end = ''
+
+    # The colon itself is left in place; ":\\" only turns the backslashes into a newline
+    start = match.start()
+    if free >= 2 and start and match.string[start - 1] == ':':
+        prefix = '\n'
+        free -= 2
+        if late is not None:
+            if free == 0:
+                end = late
+            else:
+                free -= 1
+    else:
+        prefix = ''
+        if late is not None:
+            free -= 1
+
+    # Leftover backslashes collapse pairwise
+    text = prefix + '\\' * ((free + 1) // 2) + end
+    if not end and match.end() == len(match.string) and text.endswith('\\'):
+        text = text[:-1]
+    return text
+
+
+def clean_agent_text(text):
+    """Clean up escape sequences and formatting in agent responses"""
+    if '\\' not in text:
+        return text
+    return _CLEANUP_TOKEN.sub(_translate_token, text)
+
+
+# Whitespace and digits that may still grow into a "\ 12." list marker
+_PENDING_LIST_MARKER = re.compile(r'[\s\d]*')
+
+
+class StreamingCleaner:
+    """Runs clean_agent_text over a reply that arrives in chunks.
+
+    Escape sequences can be split across chunks, so each feed() only cleans
+    the longest prefix that cannot be part of an unfinished sequence and
+    holds the rest back. The concatenated output matches cleaning the full
+    reply in one go.
+    """
+
+    def __init__(self):
+        self._pending = ''
+
+    def _safe_cut(self, text):
+        cut = len(text)
+        while cut > 0:
+            # Every rewrite starts at a backslash or a colon and spans at most four characters
+            start = max(0, cut - 3)
+            unsafe = max(text.rfind('\\', start, cut), text.rfind(':', start, cut))
+            if unsafe != -1:
+                cut = unsafe
+                continue
+            # ...except a backslash followed by whitespace and digits, which is open-ended
+            backslash = text.rfind('\\', 0, cut)
+            if backslash != -1 and _PENDING_LIST_MARKER.fullmatch(text, backslash + 1, cut):
+                cut = backslash
+                continue
+            return cut
+        return 0
+
+    def feed(self, chunk):
+        """Add a chunk and return the cleaned text that is now final"""
+        text = self._pending + chunk
+        cut = self._safe_cut(text)
+        self._pending = text[cut:]
+        return clean_agent_text(text[:cut]) if cut else ''
+
+    def finish(self):
+        """Return the cleaned remainder once the reply is complete"""
+        text, self._pending = self._pending, ''
+        return clean_agent_text(text) if text else ''
@@ -0,0 +1,326 @@
+"""Record and replay agent invocations for offline load testing.
+
+AGENTCORE_TRANSPORT picks what sits behind the agent client:
+
+- live (default): the configured client talks to the runtime.
+- record: the live client is wrapped, and every invocation's prompt, raw
+  output (or streamed chunks with their timing), latency and error are
+  appended to the AGENTCORE_FIXTURES file as JSON lines.
+- replay: no runtime, agentcore CLI or pybritive is needed. Invocations are
+  answered from the fixtures with their recorded latency, or with latencies
+  drawn from all recorded ones (AGENTCORE_REPLAY_LATENCY=sampled), times
+  AGENTCORE_REPLAY_SCALE. Prompts that were never recorded get a fixture
+  picked by hashing the prompt, so synthetic load still sees real replies.
+
+    python agent_transport.py summary [agent_fixtures.jsonl]
+        Prints the number of fixtures and their latency distribution.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+
+from agent_client import AgentInvocationError
+from agent_credentials import AwsCredentials, shared_checkout
+from deadlines import CANCELLATIONS, DISCONNECT_POLL, current_deadline, error_for
+from response_cache import normalize_prompt
+from response_decoder import decode_agent_output, decode_payload
+
+# live | record | replay
+TRANSPORT = os.environ.get("AGENTCORE_TRANSPORT", "live")
+FIXTURES_PATH = os.environ.get("AGENTCORE_FIXTURES", "agent_fixtures.jsonl")
+# recorded: each fixture's own latency; sampled: drawn from all recorded latencies
+REPLAY_LATENCY = os.environ.get("AGENTCORE_REPLAY_LATENCY", "recorded")
+# 0 replays instantly, 2 twice as slow as recorded
+REPLAY_SCALE = float(os.environ.get("AGENTCORE_REPLAY_SCALE", "1"))
+
+
+def offline_credentials():
+    """Placeholder credentials for replay, which never reaches AWS"""
+    return AwsCredentials("replay", "replay", "replay", time.time() + 365 * 24 * 3600)
+
+
+def credential_fetcher(transport=TRANSPORT):
+    """How credentials are checked out: pybritive, unless replaying"""
+    return offline_credentials if transport == "replay" else shared_checkout()
+
+
+class FixtureStore:
+    """Recorded invocations in a JSON-lines file, indexed by normalized prompt"""
+
+    def __init__(self, path=FIXTURES_PATH):
+        self.path = path
+        self.fixtures = []
+        self._by_prompt = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self.add(json.loads(line))
+        if not self.fixtures:
+            raise ValueError(f"No fixtures recorded in {self.path}")
+        if len({fixture["structured"] for fixture in self.fixtures}) > 1:
+            raise ValueError(f"{self.path} mixes fixtures from in-process and CLI clients")
+        return self
+
+    def add(self, fixture):
+        self.fixtures.append(fixture)
+        self._by_prompt.setdefault(normalize_prompt(fixture["prompt"]), []).append(fixture)
+
+    @property
+    def structured(self):
+        return self.fixtures[0]["structured"]
+
+    def append(self, fixture):
+        """Save a new fixture; one line per write, so concurrent recorders do not interleave"""
+        line = json.dumps(fixture) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self.add(fixture)
+
+    def find(self, prompt):
+        """Return the fixtures recorded for a prompt, or None"""
+        return self._by_prompt.get(normalize_prompt(prompt))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _error_text(error):
+    return f"{type(error).__name__}: {error}"
+
+
+class RecordingAgentClient:
+    """Wraps a live agent client and records every invocation to a FixtureStore"""
+
+    def __init__(self, inner, store):
+        self.inner = inner
+        self.store = store
+        self.structured = inner.structured
+        self.recorded = 0
+
+    def __getattr__(self, name):
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _record(self, prompt, session_id, start, **fields):
+        self.store.append({"prompt": prompt, "session": bool(session_id), "structured": self.structured,
+                           "latency": round(time.perf_counter() - start, 6), **fields})
+        self.recorded += 1
+
+    def invoke(self, prompt, credentials, session_id=None):
+        start = time.perf_counter()
+        try:
+            output = self.inner.invoke(prompt, credentials, session_id)
+        except Exception as e:
+            self._record(prompt, session_id, start, error=_error_text(e))
+            raise
+        self._record(prompt, session_id, start, output=output)
+        return output
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        start = time.perf_counter()
+        try:
+            output = await self.inner.invoke_async(prompt, credentials, session_id)
+        except Exception as e:
+            self._record(prompt, session_id, start, error=_error_text(e))
+            raise
+        self._record(prompt, session_id, start, output=output)
+        return output
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        start = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in self.inner.invoke_stream(prompt, credentials, session_id):
+                chunks.append([round(time.perf_counter() - start, 6), chunk])
+                yield chunk
+        except Exception as e:
+            self._record(prompt, session_id, start, chunks=chunks, error=_error_text(e))
+            raise
+        self._record(prompt, session_id, start, chunks=chunks)
+
+    async def invoke_stream_async(self, prompt, credentials, session_id=None):
+        start = time.perf_counter()
+        chunks = []
+        try:
+            async for chunk in self.inner.invoke_stream_async(prompt, credentials, session_id):
+                chunks.append([round(time.perf_counter() - start, 6), chunk])
+                yield chunk
+        except Exception as e:
+            self._record(prompt, session_id, start, chunks=chunks, error=_error_text(e))
+            raise
+        self._record(prompt, session_id, start, chunks=chunks)
+
+    def close(self):
+        self.store.close()
+        if hasattr(self.inner, "close"):
+            self.inner.close()
+
+    def transport_stats(self):
+        return {"mode": "record", "recorded": self.recorded}
+
+
+def _sleep_until(until, start):
+    """Sleep until the perf_counter() time `until`, unless the request gives up first"""
+    deadline = current_deadline()
+    while True:
+        left = until - time.perf_counter()
+        if left <= 0:
+            return
+        reason = deadline.fired() if deadline is not None else None
+        if reason is not None:
+            CANCELLATIONS.record(reason, time.perf_counter() - start)
+            raise error_for(reason)
+        time.sleep(left if deadline is None else min(left, DISCONNECT_POLL))
+
+
+async def _async_sleep_until(until, start):
+    try:
+        await asyncio.sleep(max(0.0, until - time.perf_counter()))
+    except asyncio.CancelledError:
+        deadline = current_deadline()
+        reason = deadline.fired() if deadline is not None else None
+        if reason is not None:
+            CANCELLATIONS.record(reason, time.perf_counter() - start)
+        raise
+
+
+class ReplayAgentClient:
+    """Answers invocations from recorded fixtures, at recorded or scaled latency.
+
+    Waits end early when the request's deadline fires, as a killed CLI call would.
+    """
+
+    def __init__(self, store, latency=REPLAY_LATENCY, scale=REPLAY_SCALE, rng=None):
+        if latency not in ("recorded", "sampled"):
+            raise ValueError(f"Unknown replay latency mode: {latency}")
+        self.store = store
+        self.structured = store.structured
+        self.latency = latency
+        self.scale = scale
+        self._rng = rng or random.Random()
+        self._latencies = [fixture["latency"] for fixture in store.fixtures]
+        # Prompts recorded more than once cycle through their recordings
+        self._turns = itertools.count()
+        self.replayed = 0
+        self.unmatched = 0
+
+    def _pick(self, prompt):
+        """Return (fixture, factor): the fixture to replay and how to stretch its timeline"""
+        self.replayed += 1
+        recorded = self.store.find(prompt)
+        if recorded:
+            fixture = recorded[next(self._turns) % len(recorded)]
+        else:
+            self.unmatched += 1
+            fixtures = self.store.fixtures
+            fixture = fixtures[zlib.crc32(normalize_prompt(prompt).encode("utf-8")) % len(fixtures)]
+        if self.latency == "sampled" and fixture["latency"] > 0:
+            return fixture, self.scale * self._rng.choice(self._latencies) / fixture["latency"]
+        return fixture, self.scale
+
+    def _output(self, fixture):
+        if "error" in fixture:
+            raise AgentInvocationError(fixture["error"])
+        if "output" in fixture:
+            return fixture["output"]
+        # Recorded as a stream; hand back the joined text in a payload both decoders read
+        payload = {"text": "".join(chunk for _, chunk in fixture["chunks"])}
+        return payload if self.structured else json.dumps(payload)
+
+    def _chunks(self, fixture):
+        if "chunks" in fixture:
+            return fixture["chunks"]
+        if "output" in fixture:
+            output = fixture["output"]
+            text = decode_payload(output).text if self.structured else decode_agent_output(output).text
+            return [[fixture["latency"], text]] if text else []
+        return []
+
+    def invoke(self, prompt, credentials, session_id=None):
+        fixture, factor = self._pick(prompt)
+        start = time.perf_counter()
+        _sleep_until(start + fixture["latency"] * factor, start)
+        CANCELLATIONS.completed(time.perf_counter() - start)
+        return self._output(fixture)
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        fixture, factor = self._pick(prompt)
+        start = time.perf_counter()
+        await _async_sleep_until(start + fixture["latency"] * factor, start)
+        CANCELLATIONS.completed(time.perf_counter() - start)
+        return self._output(fixture)
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        fixture, factor = self._pick(prompt)
+        start = time.perf_counter()
+        for offset, chunk in self._chunks(fixture):
+            _sleep_until(start + offset * factor, start)
+            yield chunk
+        if "error" in fixture:
+            _sleep_until(start + fixture["latency"] * factor, start)
+            raise AgentInvocationError(fixture["error"])
+        CANCELLATIONS.completed(time.perf_counter() - start)
+
+    async def invoke_stream_async(self, prompt, credentials, session_id=None):
+        fixture, factor = self._pick(prompt)
+        start = time.perf_counter()
+        for offset, chunk in self._chunks(fixture):
+            await _async_sleep_until(start + offset * factor, start)
+            yield chunk
+        if "error" in fixture:
+            await _async_sleep_until(start + fixture["latency"] * factor, start)
+            raise AgentInvocationError(fixture["error"])
+        CANCELLATIONS.completed(time.perf_counter() - start)
+
+    def transport_stats(self):
+        return {"mode": "replay", "fixtures": len(self.store.fixtures), "replayed": self.replayed,
+                "unmatched": self.unmatched}
+
+
+def summary(path):
+    store = FixtureStore(path).load()
+    latencies = sorted(fixture["latency"] for fixture in store.fixtures)
+    errors = sum("error" in fixture for fixture in store.fixtures)
+    streams = sum("chunks" in fixture for fixture in store.fixtures)
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+
+    print(f"{len(store.fixtures)} fixtures ({len(store._by_prompt)} prompts, {streams} streamed, {errors} failed)")
+    print(f"latency p50 {percentile(50):.3f}s  p95 {percentile(95):.3f}s  p99 {percentile(99):.3f}s  "
+          f"max {latencies[-1]:.3f}s")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary_parser = sub.add_parser("summary", help="describe a fixtures file")
+    summary_parser.add_argument("path", nargs="?", default=FIXTURES_PATH)
+    args = parser.parse_args(argv)
+    try:
+        summary(args.path)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
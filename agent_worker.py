@@ -0,0 +1,418 @@
+"""Warm pool of long-lived agent invoker processes.
+
+    python agent_worker.py
+        Runs one worker: it builds its agent client once, then answers
+        JSON-lines requests on stdin with JSON lines on stdout.
+
+WorkerPoolAgentClient keeps AGENTCORE_POOL_WORKERS of these processes
+running and hands each request to an idle one, so the interpreter start-up
+and SDK import cost is paid once per worker instead of once per message.
+Workers are pinged while idle, replaced after a crash or timeout, and
+recycled after AGENTCORE_POOL_MAX_REQUESTS requests to contain leaks.
+Workers normally reach the runtime in-process (sdk or http). With the cli
+client each call still starts an agentcore CLI, so the pool only bounds
+and cancels those calls, and replies carry the CLI output for the parent
+to decode.
+
+A call whose request gives up (see deadlines.py) is cancelled in its worker,
+and the request does not wait for the worker to finish. A worker that has
+not stopped the call within AGENTCORE_POOL_CANCEL_GRACE seconds is killed
+and replaced, which drops its connection to the runtime.
+
+Protocol, one JSON object per line:
+    -> {"id": 1, "op": "invoke" | "stream" | "ping", "prompt": "...", "credentials": [...],
+        "session_id": "..."}
+    -> {"id": 1, "op": "cancel", "reason": "disconnect"}
+    <- {"ready": true}                      once, after start-up
+    <- {"id": 1, "payload": {...}}          reply to invoke (the CLI output string for cli)
+    <- {"id": 1, "chunk": "..."} ... {"id": 1, "done": true}
+    <- {"id": 1, "pong": true}
+    <- {"id": 1, "error": "...", "cancelled": "disconnect"}   cancelled only once stopped by a cancel
+"""
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from agent_client import (AGENT_ARN, AGENT_ENDPOINT, INVOKE_TIMEOUT, AgentInvocationError, iterate_in_thread,
+                          make_agent_client)
+from agent_credentials import AwsCredentials
+from deadlines import CANCELLATIONS, DISCONNECT_POLL, Deadline, RequestCancelled, current_deadline, deadline_scope
+
+logger = logging.getLogger(__name__)
+
+# Client each worker uses to reach the runtime: sdk | http | cli
+WORKER_MODE = os.environ.get("AGENTCORE_WORKER_MODE") or ("sdk" if AGENT_ARN else "http" if AGENT_ENDPOINT else "cli")
+POOL_WORKERS = int(os.environ.get("AGENTCORE_POOL_WORKERS", "4"))
+# Requests allowed to wait for an idle worker before new ones are rejected
+POOL_QUEUE = int(os.environ.get("AGENTCORE_POOL_QUEUE", "32"))
+POOL_MAX_REQUESTS = int(os.environ.get("AGENTCORE_POOL_MAX_REQUESTS", "500"))
+POOL_HEALTH_INTERVAL = float(os.environ.get("AGENTCORE_POOL_HEALTH_INTERVAL", "30"))
+# Seconds a worker gets to stop a cancelled call before it is replaced
+POOL_CANCEL_GRACE = float(os.environ.get("AGENTCORE_POOL_CANCEL_GRACE", "2"))
+WORKER_COMMAND = [sys.executable, os.path.abspath(__file__)]
+
+
+def serve_worker(mode=WORKER_MODE, stdin=None, stdout=None):
+    """Answer JSON-lines requests until stdin closes"""
+    stdin = stdin or sys.stdin
+    out = stdout or sys.stdout
+    # Keep stray prints from libraries off the protocol stream
+    sys.stdout = sys.stderr
+
+    def write(message):
+        out.write(json.dumps(message) + "\n")
+        out.flush()
+
+    # The pool's parent applies the invocation policy, and any recording,
+    # to the pool as a whole
+    client = make_agent_client(mode, policy=False, transport="live")
+    write({"ready": True})
+
+    # Cancels are read while a call runs, so they are taken off stdin by a thread
+    requests = queue.Queue()
+    lock = threading.Lock()
+    # Request id -> the deadline of the call running for it, or the reason
+    # it was cancelled before it started. Ids only ever grow.
+    deadlines = {}
+    started = [0]
+
+    def read():
+        for line in stdin:
+            message = json.loads(line)
+            if message.get("op") != "cancel":
+                requests.put(message)
+                continue
+            request_id, reason = message.get("id"), message.get("reason") or "disconnect"
+            with lock:
+                deadline = deadlines.get(request_id)
+                if deadline is None and request_id > started[0]:
+                    deadlines[request_id] = reason
+            if isinstance(deadline, Deadline):
+                deadline.cancel(reason)
+        requests.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    credentials = None
+    for message in iter(requests.get, None):
+        request_id = message.get("id")
+        op = message.get("op", "invoke")
+        if op == "ping":
+            write({"id": request_id, "pong": True})
+            continue
+        if message.get("credentials"):
+            received = AwsCredentials(*message["credentials"])
+            # Same object across requests, so the SDK client is reused
+            if received != credentials:
+                credentials = received
+        deadline = Deadline(math.inf)
+        with lock:
+            started[0] = request_id
+            cancelled = deadlines.setdefault(request_id, deadline)
+        if cancelled is not deadline:
+            deadline.cancel(cancelled)
+        try:
+            with deadline_scope(deadline):
+                deadline.check()
+                session_id = message.get("session_id")
+                if op == "stream":
+                    for chunk in client.invoke_stream(message["prompt"], credentials, session_id):
+                        write({"id": request_id, "chunk": chunk})
+                    write({"id": request_id, "done": True})
+                else:
+                    write({"id": request_id, "payload": client.invoke(message["prompt"], credentials, session_id)})
+        except RequestCancelled as e:
+            write({"id": request_id, "error": f"{type(e).__name__}: {e}", "cancelled": deadline.reason})
+        except Exception as e:
+            write({"id": request_id, "error": f"{type(e).__name__}: {e}"})
+        finally:
+            with lock:
+                del deadlines[request_id]
+
+
+class WorkerFailed(Exception):
+    """Raised when a worker process dies or stops answering"""
+
+
+class _Worker:
+    def __init__(self, command, timeout):
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self.served = 0
+        self._lines = queue.Queue()
+        self._ids = itertools.count(1)
+        threading.Thread(target=self._read, daemon=True).start()
+        if not self.receive(None, timeout).get("ready"):
+            self.kill()
+            raise WorkerFailed("worker did not start")
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, message):
+        message["id"] = next(self._ids)
+        try:
+            self.proc.stdin.write(json.dumps(message) + "\n")
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise WorkerFailed(f"worker exited: {e}") from e
+        return message["id"]
+
+    def cancel(self, request_id, reason):
+        try:
+            self.proc.stdin.write(json.dumps({"id": request_id, "op": "cancel", "reason": reason}) + "\n")
+            self.proc.stdin.flush()
+        except OSError:
+            pass
+
+    def receive(self, request_id, timeout, deadline=None, budget=True):
+        """The next reply to `request_id`; raises RequestCancelled once `deadline` fires"""
+        give_up = time.monotonic() + timeout
+        while True:
+            wait = max(0.0, give_up - time.monotonic())
+            try:
+                line = self._lines.get(timeout=wait if deadline is None else min(wait, DISCONNECT_POLL))
+            except queue.Empty:
+                if time.monotonic() >= give_up:
+                    raise WorkerFailed(f"worker did not answer within {timeout}s") from None
+                deadline.check(budget)
+                continue
+            if line is None:
+                raise WorkerFailed(f"worker exited with code {self.proc.wait()}")
+            reply = json.loads(line)
+            if reply.get("id") == request_id:
+                return reply
+
+    def stop(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+class WorkerPoolAgentClient:
+    """Dispatches invocations to a pool of warm worker processes.
+
+    Idle workers sit in a FIFO queue, so work is spread round-robin over
+    whichever workers are free and a request never lands on a busy one.
+    Payloads are structured unless the workers use the cli client.
+    """
+
+    # The workers inherit AGENTCORE_WORKER_MODE, so they use this same mode
+    structured = WORKER_MODE != "cli"
+
+    def __init__(self, size=POOL_WORKERS, queue_depth=POOL_QUEUE, max_requests=POOL_MAX_REQUESTS,
+                 timeout=INVOKE_TIMEOUT, health_interval=POOL_HEALTH_INTERVAL, command=WORKER_COMMAND):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.command = command
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._closed = threading.Event()
+        self.busy = 0
+        self.waiting = 0
+        self.served = 0
+        self.restarts = 0
+        self.recycled = 0
+        self.rejected = 0
+        for _ in range(size):
+            self._idle.put(_Worker(command, timeout))
+        if health_interval:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True).start()
+
+    def _acquire(self, deadline=None):
+        with self._lock:
+            if self.waiting >= self.queue_depth and self._idle.empty():
+                self.rejected += 1
+                raise AgentInvocationError("Agent worker pool is saturated, try again shortly")
+            self.waiting += 1
+        try:
+            give_up = time.monotonic() + self.timeout
+            while True:
+                wait = max(0.0, give_up - time.monotonic())
+                try:
+                    worker = self._idle.get(timeout=wait if deadline is None else min(wait, DISCONNECT_POLL))
+                    break
+                except queue.Empty:
+                    if time.monotonic() >= give_up:
+                        raise AgentInvocationError("Timed out waiting for an idle agent worker") from None
+                    deadline.check()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.busy += 1
+        return worker
+
+    def _release(self, worker, healthy=True):
+        worker.served += 1
+        with self._lock:
+            self.busy -= 1
+            self.served += 1
+        if healthy and worker.alive() and worker.served < self.max_requests:
+            self._idle.put(worker)
+        else:
+            # Spawning takes a while; do it off the request path
+            threading.Thread(target=self._replace, args=(worker, healthy), daemon=True).start()
+
+    def _replace(self, worker, healthy):
+        if healthy and worker.alive():
+            worker.stop()
+            self.recycled += 1
+        else:
+            if worker.alive():
+                worker.kill()
+            self.restarts += 1
+        while not self._closed.is_set():
+            try:
+                self._idle.put(_Worker(self.command, self.timeout))
+                return
+            except (OSError, WorkerFailed):
+                logger.exception("Could not start agent worker, retrying")
+                time.sleep(1)
+
+    def _exchange(self, message):
+        """Run one request on a worker and yield its replies until the last one.
+
+        Once the request's deadline fires the worker is asked to stop the
+        call, and the request goes on without waiting for it.
+        """
+        deadline = current_deadline()
+        worker = self._acquire(deadline)
+        healthy = False
+        request_id = None
+        start = time.monotonic()
+        streamed = False
+        try:
+            request_id = worker.send(message)
+            while True:
+                # Once a stream has started only disconnects stop it
+                reply = worker.receive(request_id, self.timeout, deadline, budget=not streamed)
+                if "error" in reply:
+                    healthy = True
+                    raise AgentInvocationError(reply["error"])
+                final = "chunk" not in reply
+                healthy = final
+                if final:
+                    CANCELLATIONS.completed(time.monotonic() - start)
+                streamed = True
+                yield reply
+                if final:
+                    return
+        except RequestCancelled as e:
+            CANCELLATIONS.record(e.reason, time.monotonic() - start, self.timeout)
+            self._cancel(worker, request_id, e.reason)
+            worker = None
+            raise
+        except GeneratorExit:
+            if not healthy and request_id is not None:
+                # A stream abandoned mid-way: stop it rather than replace the worker
+                reason = deadline.fired() if deadline is not None else None
+                self._cancel(worker, request_id, reason or "disconnect")
+                worker = None
+            raise
+        except WorkerFailed as e:
+            raise AgentInvocationError(str(e)) from e
+        finally:
+            if worker is not None:
+                self._release(worker, healthy)
+
+    def _cancel(self, worker, request_id, reason):
+        """Ask a worker to stop a call, and settle it off the request path"""
+        worker.cancel(request_id, reason)
+        threading.Thread(target=self._settle, args=(worker, request_id), daemon=True).start()
+
+    def _settle(self, worker, request_id):
+        # A CLI call stops within DISCONNECT_POLL; one that does not stop in
+        # time has its worker replaced, which drops the connection it runs on
+        give_up = time.monotonic() + POOL_CANCEL_GRACE
+        try:
+            while "chunk" in worker.receive(request_id, max(0.0, give_up - time.monotonic())):
+                pass
+        except WorkerFailed:
+            self._release(worker, healthy=False)
+            return
+        self._release(worker)
+
+    def _message(self, op, prompt, credentials, session_id):
+        return {"op": op, "prompt": prompt, "credentials": list(credentials) if credentials else None,
+                "session_id": session_id}
+
+    def invoke(self, prompt, credentials, session_id=None):
+        replies = self._exchange(self._message("invoke", prompt, credentials, session_id))
+        try:
+            return next(replies)["payload"]
+        finally:
+            replies.close()
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        for reply in self._exchange(self._message("stream", prompt, credentials, session_id)):
+            if "chunk" in reply:
+                yield reply["chunk"]
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        return await asyncio.to_thread(self.invoke, prompt, credentials, session_id)
+
+    def invoke_stream_async(self, prompt, credentials, session_id=None):
+        return iterate_in_thread(self.invoke_stream(prompt, credentials, session_id))
+
+    def _health_loop(self, interval):
+        while not self._closed.wait(interval):
+            # Only idle workers are checked; busy ones prove themselves by answering
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    worker.receive(worker.send({"op": "ping"}), 5)
+                except WorkerFailed:
+                    logger.warning("Agent worker failed its health check, replacing it")
+                    threading.Thread(target=self._replace, args=(worker, False), daemon=True).start()
+                else:
+                    self._idle.put(worker)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.size,
+                "busy": self.busy,
+                "idle": self._idle.qsize(),
+                "waiting": self.waiting,
+                "utilization": self.busy / self.size if self.size else 0.0,
+                "served": self.served,
+                "restarts": self.restarts,
+                "recycled": self.recycled,
+                "rejected": self.rejected,
+            }
+
+    def close(self):
+        self._closed.set()
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+if __name__ == '__main__':
+    serve_worker()
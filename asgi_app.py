@@ -0,0 +1,598 @@
+"""Async (ASGI) serving mode for the chat backend.
+
+Agent invocations are awaited instead of holding a thread per request, and a
+ConcurrencyGate bounds how many run at once and how many may queue. When the
+queue is full the request fails fast with 503 and Retry-After, and when the
+client is over its rate limit with 429. A chat whose client disconnects is cancelled, and
+so is its agent call once no other request shares it. Replies and streams
+are gzip/brotli compressed for clients that accept it. /chat/ws carries a
+whole conversation over one WebSocket (see chat_socket).
+
+    uvicorn shopping_agentcore_chat_app:asgi_app
+"""
+import asyncio
+import contextlib
+import functools
+import json
+import math
+import urllib.parse
+
+from admission import ConcurrencyGate, Overloaded
+from chat_batch import NDJSON_CONTENT_TYPE, InvalidBatch, ndjson_results_async, parse_batch, run_batch_async
+from chat_socket import HEARTBEAT, MAX_CHATS, SOCKETS, WEBSOCKET, parse_frame, socket_frame
+from chat_stream import body_events, parse_sse_event, sse_event, stream_reply_events_async
+from coalescing import AsyncSingleFlight
+from compression import StreamCompressor, choose_encoding, compress_body
+from deadlines import Deadline, RequestCancelled, deadline_scope, error_for, remaining_time
+from history_store import InvalidHistoryRequest, parse_history_request
+from intent_router import passthrough_requested
+from metrics import CONTENT_TYPE, REGISTRY, REQUESTS, RequestTiming, count_error
+from response_cache import bypass_requested
+from sessions import SESSION_HEADER, runtime_session_id
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+async def get_credentials(credential_provider):
+    """Return credentials, only using a thread when a checkout is needed.
+
+    A checkout only gets what is left of the request's time budget.
+    """
+    creds = credential_provider.cached()
+    if creds is None:
+        remaining = remaining_time()
+        try:
+            creds = await asyncio.wait_for(asyncio.to_thread(credential_provider.get, timeout=remaining), remaining)
+        except asyncio.TimeoutError:
+            raise error_for("deadline") from None
+    return creds
+
+
+def header(scope, name):
+    """Return a request header value as text, or None"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def read_json(receive):
+    """Read the request body and decode it as a JSON object, or return None"""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body"):
+            break
+    try:
+        payload = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+async def until_disconnect(receive, deadline, awaitable):
+    """Await `awaitable` under `deadline`, cancelling it if the client disconnects first"""
+    with deadline_scope(deadline):
+        task = asyncio.ensure_future(awaitable)
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        deadline.cancel()
+        task.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if deadline.reason != "disconnect" or not task.cancelled():
+            raise
+        raise error_for("disconnect") from None
+    finally:
+        watcher.cancel()
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, data, status=200, headers=()):
+    await send_response(send, status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+
+async def send_compressed(send, scope, body, content_type, headers=()):
+    """send_response for a whole reply, compressed when the client accepts it and it is large enough"""
+    body, encoding = compress_body(body, header(scope, b"accept-encoding"))
+    headers = [*headers, (b"vary", b"accept-encoding")]
+    if encoding is not None:
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+    await send_response(send, 200, body, content_type, headers)
+
+
+class StreamSender:
+    """Sends a streamed 200 response, compressed and flushed chunk by chunk when the client accepts it"""
+
+    def __init__(self, scope, send):
+        self.encoding = choose_encoding(header(scope, b"accept-encoding"))
+        self._compressor = None
+        self._send = send
+
+    async def start(self, content_type, headers=()):
+        headers = [(b"content-type", content_type.encode("latin-1")), *headers, (b"vary", b"accept-encoding")]
+        if self.encoding is not None:
+            self._compressor = StreamCompressor(self.encoding)
+            headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        await self._send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    async def chunk(self, text):
+        body = text.encode("utf-8") if self._compressor is None else self._compressor.compress(text)
+        await self._send({"type": "http.response.body", "body": body, "more_body": True})
+
+    async def finish(self):
+        body = b"" if self._compressor is None else self._compressor.finish()
+        await self._send({"type": "http.response.body", "body": body})
+
+
+class SocketSender:
+    """Sends frames on an accepted WebSocket one at a time, until the connection is gone"""
+
+    def __init__(self, send):
+        self._send = send
+        self._lock = asyncio.Lock()
+        self.closed = False
+
+    async def frame(self, kind, **fields):
+        if self.closed:
+            return
+        async with self._lock:
+            try:
+                await self._send({"type": "websocket.send", "text": socket_frame(kind, **fields)})
+            except OSError:
+                # The client went away (uvicorn raises ClientDisconnected); the receive loop sees it too
+                self.closed = True
+                return
+        SOCKETS.sent(heartbeat=kind == "heartbeat")
+
+    async def heartbeats(self, interval=HEARTBEAT):
+        while not self.closed:
+            await asyncio.sleep(interval)
+            await self.frame("heartbeat")
+
+
+async def send_overloaded(send, error):
+    await send_json(send, {"response": str(error), "error": True}, status=error.status,
+                    headers=[(b"retry-after", str(error.retry_after).encode("latin-1"))])
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def create_asgi_app(backend, gate=None, inflight=None):
+    """Build an ASGI app serving the chat page, /chat, /chat/stream, /chat/ws, /chat/batch, /history, /cache, /stats
+    and /metrics for a chat_core.ChatBackend"""
+    gate = gate or ConcurrencyGate()
+    inflight = inflight or AsyncSingleFlight()
+    credential_provider = backend.credential_provider
+    agent_client = backend.agent_client
+    response_cache = backend.response_cache
+    history = backend.history
+    session_header = SESSION_HEADER.lower().encode("latin-1")
+
+    def admit(scope, payload):
+        client = scope.get("client")
+        backend.admit(payload, client[0] if client else None, header(scope, b"x-forwarded-for"))
+
+    def session_headers(session):
+        return [] if session is None else [(session_header, session.id.encode("latin-1"))]
+
+    def local_reply(scope, payload, timing, session):
+        return backend.local_reply(payload['prompt'], timing, session,
+                                   bypass_requested(payload, header(scope, b"cache-control")),
+                                   passthrough_requested(payload))
+
+    async def invoke_chat(user_prompt, timing, session):
+        async with contextlib.AsyncExitStack() as stack:
+            # Time spent waiting for a concurrency slot
+            with timing.stage("queue"):
+                await stack.enter_async_context(gate.slot())
+            with timing.stage("credentials"):
+                creds = await get_credentials(credential_provider)
+            with timing.stage("invoke") as invoke_stage:
+                response = await agent_client.invoke_async(user_prompt, creds, runtime_session_id(session))
+        return backend.agent_reply(user_prompt, response, timing, session, invoke_stage.seconds)
+
+    async def chat(scope, receive, send):
+        REQUESTS.inc("/chat")
+        timing = RequestTiming()
+        payload = await read_json(receive)
+        try:
+            admit(scope, payload)
+            session = backend.chat_session(payload)
+            result = await until_disconnect(receive, Deadline(), chat_reply(scope, payload, timing, session))
+        except Overloaded as e:
+            count_error(e)
+            await send_overloaded(send, e)
+            return
+        except RequestCancelled as e:
+            # Nobody is left to answer
+            count_error(e)
+            return
+        if not result.get('error'):
+            backend.remember(session, payload['prompt'], result['response'])
+        await send_compressed(send, scope, json.dumps(result).encode("utf-8"), "application/json",
+                              [(b"server-timing", timing.finish().encode("latin-1")), *session_headers(session)])
+
+    async def answer_prompt(user_prompt, timing, session=None, bypass_cache=False, passthrough=False):
+        # Routed and cached replies are answered without taking a concurrency slot
+        reply = backend.local_reply(user_prompt, timing, session, bypass_cache, passthrough)
+        if reply is not None:
+            return reply
+        return await inflight.do(user_prompt, functools.partial(invoke_chat, user_prompt, timing, session),
+                                 runtime_session_id(session))
+
+    async def chat_reply(scope, payload, timing, session):
+        invalid = backend.invalid_request(payload)
+        if invalid is not None:
+            return {"response": invalid, "error": True}
+
+        user_prompt = payload['prompt']
+        try:
+            bypass_cache = bypass_requested(payload, header(scope, b"cache-control"))
+            return await answer_prompt(user_prompt, timing, session, bypass_cache, passthrough_requested(payload))
+        except Overloaded:
+            raise
+        except Exception as e:
+            count_error(e)
+            return {"response": f"Error: {str(e)}", "error": True}
+
+    async def chat_stream(scope, receive, send):
+        REQUESTS.inc("/chat/stream")
+        payload = await read_json(receive)
+        try:
+            admit(scope, payload)
+        except Overloaded as e:
+            count_error(e)
+            await send_overloaded(send, e)
+            return
+        invalid = backend.invalid_request(payload)
+        if invalid is not None:
+            await send_response(send, 200, sse_event({"response": invalid, "error": True}, "error").encode("utf-8"),
+                                "text/event-stream")
+            return
+
+        user_prompt = payload['prompt']
+        session = backend.chat_session(payload)
+        timing = RequestTiming()
+        reply = local_reply(scope, payload, timing, session)
+        if reply is not None:
+            backend.remember(session, user_prompt, reply['response'])
+            body = "".join(body_events(reply)).encode("utf-8")
+            await send_compressed(send, scope, body, "text/event-stream",
+                                  [(b"cache-control", b"no-cache"), *session_headers(session)])
+            return
+
+        # The budget covers the wait for the first event
+        deadline = Deadline()
+        with deadline_scope(deadline):
+            events = inflight.stream(user_prompt, functools.partial(stream_events, user_prompt, session, timing),
+                                     runtime_session_id(session))
+        try:
+            await until_disconnect(receive, deadline, send_stream(scope, send, events, session, timing))
+        except RequestCancelled as e:
+            count_error(e)
+
+    async def send_stream(scope, send, events, session, timing):
+        # Closed however this ends, so a disconnected client stops waiting on the shared producer
+        async with contextlib.aclosing(events):
+            # The shared producer only emits once it holds a slot, so overload surfaces here
+            try:
+                first = await events.__anext__()
+            except Overloaded as e:
+                count_error(e)
+                await send_overloaded(send, e)
+                return
+            except RequestCancelled as e:
+                count_error(e)
+                body = sse_event({"response": f"Error: {str(e)}", "error": True}, "error").encode("utf-8")
+                await send_response(send, 200, body, "text/event-stream")
+                return
+
+            # Stages up to the first event; a request that joined another's stream only has this one
+            timing.mark("first_event")
+            stream = StreamSender(scope, send)
+            await stream.start("text/event-stream", [
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                (b"server-timing", timing.header().encode("latin-1")),
+                *session_headers(session),
+            ])
+            await stream.chunk(first)
+            async for event in events:
+                await stream.chunk(event)
+            await stream.finish()
+
+    async def stream_events(user_prompt, session, timing):
+        def on_reply(agent_reply):
+            backend.streamed_reply(user_prompt, agent_reply, session, timing.elapsed() - invoke_start)
+
+        async with gate.slot():
+            timing.mark("queue")
+            try:
+                with timing.stage("credentials"):
+                    creds = await get_credentials(credential_provider)
+            except Exception as e:
+                count_error(e)
+                yield sse_event({"response": f"Error: {str(e)}", "error": True}, "error")
+                return
+            invoke_start = timing.elapsed()
+            first = True
+            async for event in stream_reply_events_async(agent_client, user_prompt, creds, on_reply, count_error,
+                                                         runtime_session_id(session)):
+                if first:
+                    timing.record("agent_first_byte", timing.elapsed() - invoke_start)
+                    first = False
+                yield event
+        timing.mark("stream_total")
+
+    async def chat_socket(scope, receive, send):
+        if (await receive())["type"] != "websocket.connect":
+            return
+        if not WEBSOCKET:
+            # Refused during the handshake, so the page falls back to POST /chat/stream
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({"type": "websocket.accept"})
+        SOCKETS.opened()
+        sender = SocketSender(send)
+        # Chat id -> (task, deadline) of the chats in flight on this connection
+        chats = {}
+        heartbeats = asyncio.ensure_future(sender.heartbeats())
+        try:
+            await sender.frame("ready", heartbeat=HEARTBEAT, max_chats=MAX_CHATS)
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                await socket_message(scope, sender, chats, parse_frame(message))
+        finally:
+            sender.closed = True
+            heartbeats.cancel()
+            # Nobody is left to answer: stop the agent calls nobody else shares
+            for task, deadline in chats.values():
+                deadline.cancel()
+                task.cancel()
+            SOCKETS.closed()
+
+    async def socket_message(scope, sender, chats, frame):
+        kind = frame.get("type") if frame is not None else None
+        SOCKETS.received(chat=kind == "chat")
+        chat_id = frame.get("id") if frame is not None else None
+        if not isinstance(chat_id, (str, int)):
+            chat_id = None
+        if kind == "cancel":
+            if chat_id in chats:
+                SOCKETS.cancel()
+                task, deadline = chats.pop(chat_id)
+                deadline.cancel()
+                task.cancel()
+            return
+        if kind != "chat":
+            await sender.frame("error", id=chat_id, response="Invalid request format", error=True)
+            return
+        if chat_id is None or chat_id in chats:
+            await sender.frame("error", id=chat_id, response="Each chat needs an id not already in flight",
+                               error=True)
+            return
+        if len(chats) >= MAX_CHATS:
+            await sender.frame("error", id=chat_id, error=True,
+                               response=f"At most {MAX_CHATS} chats may be in flight on one connection")
+            return
+        # The budget covers the wait for the first event, as for /chat/stream
+        deadline = Deadline()
+        task = asyncio.ensure_future(socket_chat(scope, sender, chat_id, frame, deadline))
+        chats[chat_id] = (task, deadline)
+
+        def finished(task):
+            # A cancelled chat's id may already be in use again
+            if chats.get(chat_id, (None,))[0] is task:
+                del chats[chat_id]
+
+        task.add_done_callback(finished)
+
+    async def socket_chat(scope, sender, chat_id, payload, deadline):
+        REQUESTS.inc("/chat/ws")
+        try:
+            admit(scope, payload)
+        except Overloaded as e:
+            count_error(e)
+            await sender.frame("error", id=chat_id, response=str(e), error=True, retry_after=e.retry_after)
+            return
+        invalid = backend.invalid_request(payload)
+        if invalid is not None:
+            await sender.frame("error", id=chat_id, response=invalid, error=True)
+            return
+
+        user_prompt = payload['prompt']
+
+        session = backend.chat_session(payload)
+        session_id = None if session is None else session.id
+        timing = RequestTiming()
+        reply = local_reply(scope, payload, timing, session)
+        if reply is not None:
+            backend.remember(session, user_prompt, reply['response'])
+            await sender.frame("delta", id=chat_id, delta=reply['response'],
+                               **{key: value for key, value in reply.items() if key != "response"})
+            await sender.frame("done", id=chat_id, session_id=session_id)
+            return
+
+        if gate.inflight >= gate.max_inflight:
+            # Progress the page can show while the chat waits for an agent slot
+            await sender.frame("status", id=chat_id, status="queued", waiting=gate.waiting + 1)
+        # Shared with identical /chat/stream and /chat/ws chats in flight
+        with deadline_scope(deadline):
+            events = inflight.stream(user_prompt, functools.partial(stream_events, user_prompt, session, timing),
+                                     runtime_session_id(session))
+        first = True
+        async with contextlib.aclosing(events):
+            try:
+                async for event in events:
+                    if first:
+                        timing.mark("first_event")
+                        first = False
+                    name, data = parse_sse_event(event)
+                    if name == "done":
+                        break
+                    await sender.frame("error" if name == "error" else "delta", id=chat_id, **data)
+                    if name == "error":
+                        return
+            except Overloaded as e:
+                count_error(e)
+                await sender.frame("error", id=chat_id, response=str(e), error=True, retry_after=e.retry_after)
+                return
+            except RequestCancelled as e:
+                count_error(e)
+                await sender.frame("error", id=chat_id, response=f"Error: {str(e)}", error=True)
+                return
+        # The stages /chat/stream sends in its Server-Timing header
+        await sender.frame("done", id=chat_id, session_id=session_id, server_timing=timing.header())
+
+    async def chat_batch(scope, receive, send):
+        REQUESTS.inc("/chat/batch")
+        payload = await read_json(receive)
+        try:
+            prompts, parallelism = parse_batch(payload)
+        except InvalidBatch as e:
+            await send_json(send, {"response": str(e), "error": True}, status=400)
+            return
+
+        # A batch is charged as one request; its parallelism bounds the rest
+        try:
+            admit(scope, payload)
+        except Overloaded as e:
+            count_error(e)
+            await send_overloaded(send, e)
+            return
+
+        # Check credentials out once up front; every item then reuses them
+        try:
+            await get_credentials(credential_provider)
+        except Exception as e:
+            count_error(e)
+            await send_json(send, {"response": f"Error: {str(e)}", "error": True}, status=503)
+            return
+
+        bypass_cache = bypass_requested(payload, header(scope, b"cache-control"))
+        passthrough = passthrough_requested(payload)
+
+        async def answer(user_prompt):
+            # Each item gets the time budget of a single chat
+            with deadline_scope(Deadline()):
+                return await answer_prompt(user_prompt, RequestTiming(), bypass_cache=bypass_cache,
+                                           passthrough=passthrough)
+
+        # A client that disconnects cancels the items still running, and their agent calls
+        try:
+            await until_disconnect(receive, Deadline(math.inf), send_batch(scope, send, prompts, answer, parallelism))
+        except RequestCancelled as e:
+            count_error(e)
+
+    async def send_batch(scope, send, prompts, answer, parallelism):
+        stream = StreamSender(scope, send)
+        await stream.start(NDJSON_CONTENT_TYPE, [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")])
+        # Each result is sent as soon as it is ready, not in request order
+        async for line in ndjson_results_async(run_batch_async(prompts, answer, parallelism)):
+            await stream.chunk(line)
+        await stream.finish()
+
+    async def chat_history(scope, send):
+        if history is None:
+            await send_json(send, {"response": "Chat history is disabled", "error": True}, status=404)
+            return
+        args = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        try:
+            session_id, before, limit = parse_history_request(args)
+        except InvalidHistoryRequest as e:
+            await send_json(send, {"response": str(e), "error": True}, status=400)
+            return
+        # The latest page may wait briefly for queued writes, so keep it off the loop
+        await send_json(send, await asyncio.to_thread(history.page, session_id, before, limit))
+
+    async def cache(scope, receive, send):
+        if response_cache is None:
+            await send_json(send, {"response": "Response cache is disabled", "error": True}, status=404)
+            return
+        if scope["method"] == "DELETE":
+            # Drop one prompt's entry, or everything when no prompt is given
+            payload = await read_json(receive) or {}
+            response_cache.invalidate(payload.get('prompt'))
+        await send_json(send, response_cache.stats())
+
+    async def index(scope, send):
+        status, body, headers = index_page.select(header(scope, b"accept-encoding"), header(scope, b"if-none-match"))
+        raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+        if status == 200:
+            raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+    def collect_stats():
+        return backend.stats(gate.stats(), inflight.stats())
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await lifespan(receive, send)
+            return
+        if scope["type"] == "websocket":
+            if scope["path"] == "/chat/ws":
+                await chat_socket(scope, receive, send)
+            else:
+                await send({"type": "websocket.close", "code": 1008})
+            return
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+        if path == "/" and method in ("GET", "HEAD"):
+            await index(scope, send)
+        elif path == "/chat" and method == "POST":
+            await chat(scope, receive, send)
+        elif path == "/chat/stream" and method == "POST":
+            await chat_stream(scope, receive, send)
+        elif path == "/chat/batch" and method == "POST":
+            await chat_batch(scope, receive, send)
+        elif path == "/history" and method == "GET":
+            await chat_history(scope, send)
+        elif path == "/cache" and method in ("GET", "DELETE"):
+            await cache(scope, receive, send)
+        elif path == "/stats" and method == "GET":
+            await send_json(send, collect_stats())
+        elif path == "/metrics" and method == "GET":
+            await send_response(send, 200, REGISTRY.render(collect_stats()).encode("utf-8"), CONTENT_TYPE)
+        else:
+            await send_json(send, {"response": "Not found", "error": True}, status=404)
+
+    app.backend = backend
+    app.gate = gate
+    app.inflight = inflight
+    return app
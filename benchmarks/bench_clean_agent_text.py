@@ -0,0 +1,92 @@
+"""Throughput of clean_agent_text against the original sequential version.
+
+Checks the golden corpus first (every output must match the original
+implementation byte for byte), then reports MB/s and the peak memory
+allocated per call, as a multiple of the input size, for small, typical
+and 1 MB replies, with and without escape sequences.
+
+    python benchmarks/bench_clean_agent_text.py [--repeat 5]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+from agent_text import clean_agent_text  # noqa: E402
+from legacy_cleaning import legacy_clean_agent_text  # noqa: E402
+
+GOLDEN = HERE / "golden" / "clean_agent_text.json"
+
+ESCAPED_SEGMENT = (
+    "Here are some great options for you:\\ \\ "
+    "1. **Sony WF-1000XM4** - $98.00\\ Excellent noise cancellation and 8-hour battery life.\\ \\ "
+    "2. **Jabra Elite 85t** - $89.99\\ Comfortable fit, it\\'s rated \\\"best value\\\".\\n"
+)
+PLAIN_SEGMENT = (
+    "Here are some great options for you:\n\n"
+    "1. **Sony WF-1000XM4** - $98.00\nExcellent noise cancellation and 8-hour battery life.\n\n"
+    "2. **Jabra Elite 85t** - $89.99\nComfortable fit, it's rated \"best value\".\n"
+)
+SIZES = [("small", 200), ("typical", 4 * 1024), ("1 MB", 1024 * 1024)]
+
+
+def check_golden():
+    corpus = json.loads(GOLDEN.read_text(encoding="utf-8"))
+    failures = [case["name"] for case in corpus if clean_agent_text(case["input"]) != case["expected"]]
+    if failures:
+        print(f"golden corpus: {len(failures)} of {len(corpus)} cases differ: {', '.join(failures[:10])}")
+        return False
+    print(f"golden corpus: all {len(corpus)} cases match")
+    return True
+
+
+def make_text(segment, size):
+    return (segment * (size // len(segment) + 1))[:size]
+
+
+def throughput(func, text, repeat):
+    loops = max(1, 2_000_000 // max(len(text), 1))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(text)
+        best = min(best, (time.perf_counter() - start) / loops)
+    return len(text.encode("utf-8")) / best / 1e6, best
+
+
+def peak_allocation(func, text):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / max(len(text), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if not check_golden():
+        sys.exit(1)
+
+    print(f"{'reply':<18}{'impl':<10}{'MB/s':>10}{'per call':>14}{'peak alloc':>14}")
+    for kind, segment in (("escaped", ESCAPED_SEGMENT), ("plain", PLAIN_SEGMENT)):
+        for label, size in SIZES:
+            text = make_text(segment, size)
+            for name, func in (("legacy", legacy_clean_agent_text), ("compiled", clean_agent_text)):
+                mb_s, seconds = throughput(func, text, args.repeat)
+                print(f"{kind + ' ' + label:<18}{name:<10}{mb_s:>10.1f}{seconds * 1e6:>11.1f} us"
+                      f"{peak_allocation(func, text):>12.1f} x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Bytes on the wire and CPU cost of compressing chat replies, by reply size.
+
+For each reply size, builds a product-comparison reply like the agent's and
+measures:
+
+- the /chat JSON body sent as it is, gzipped and (with the brotli package)
+  brotli-compressed, with the CPU time per response
+- the same reply streamed as SSE deltas of --delta characters, compressed
+  with a flush after every event as /chat/stream sends it
+
+The transfer column is the time the body takes at --kbps, a slow mobile
+link; compression pays off where it saves more than it costs in CPU.
+
+    python benchmarks/bench_compression.py [--sizes 256,1024,4096,16384,65536] [--kbps 1600]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from chat_stream import sse_event  # noqa: E402
+from compression import MIN_BYTES, StreamCompressor, brotli, compress  # noqa: E402
+
+PRODUCTS = ["Sony WH-1000XM5", "Bose QuietComfort Ultra", "Apple AirPods Pro 2", "Sennheiser Momentum 4",
+            "Jabra Elite 10", "Samsung Galaxy Buds2 Pro", "Anker Soundcore Liberty 4", "Beats Studio Pro"]
+FEATURES = ["noise cancelling", "battery life", "call quality", "comfort", "multipoint pairing", "spatial audio",
+            "water resistance", "app support"]
+
+
+def sample_reply(size, rng):
+    """A markdown product comparison of about `size` characters"""
+    parts = []
+    while sum(map(len, parts)) < size:
+        product, feature = rng.choice(PRODUCTS), rng.choice(FEATURES)
+        parts.append(f"- **{product}** (${rng.randrange(49, 449)}.99): {feature} rated "
+                     f"{rng.randrange(60, 100) / 10:.1f}/10 by {rng.randrange(200, 20000)} reviewers, "
+                     f"{rng.randrange(6, 40)} hours per charge.\n")
+    return "".join(parts)[:size]
+
+
+def timed(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.process_time() - start) / repeat
+
+
+def compress_events(events, encoding):
+    compressor = StreamCompressor(encoding)
+    return [compressor.compress(event) for event in events] + [compressor.finish()]
+
+
+def row(name, raw, wire, seconds, kbps):
+    transfer = wire * 8 / (kbps * 1000)
+    print(f"  {name:<22}{wire:>9} B {wire / raw:>7.1%}   cpu {seconds * 1e6:9.1f} us   "
+          f"transfer {transfer * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="256,1024,4096,16384,65536", help="reply sizes in characters")
+    parser.add_argument("--delta", type=int, default=24, help="characters per streamed delta")
+    parser.add_argument("--kbps", type=float, default=1600, help="link speed for the transfer column")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    rng = random.Random(0)
+    print(f"CHAT_COMPRESS_MIN_BYTES={MIN_BYTES}; encodings: {', '.join(encodings)}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        reply = sample_reply(size, rng)
+        body = json.dumps({"response": reply}).encode("utf-8")
+        print(f"\nreply {size} chars, /chat body {len(body)} B")
+        row("identity", len(body), len(body), 0.0, args.kbps)
+        for encoding in encodings:
+            compressed, seconds = timed(lambda: compress(body, encoding), args.repeat)
+            row(encoding, len(body), len(compressed), seconds, args.kbps)
+
+        events = [sse_event({"delta": reply[i:i + args.delta]}) for i in range(0, len(reply), args.delta)]
+        events.append(sse_event({}, "done"))
+        raw = sum(len(event.encode("utf-8")) for event in events)
+        print(f"stream of {len(events)} events, {raw} B")
+        row("identity", raw, raw, 0.0, args.kbps)
+        for encoding in encodings:
+            blocks, seconds = timed(lambda: compress_events(events, encoding), max(1, args.repeat // 10))
+            row(f"{encoding} (flushed)", raw, sum(map(len, blocks)), seconds, args.kbps)
+
+
+if __name__ == '__main__':
+    main()
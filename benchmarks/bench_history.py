@@ -0,0 +1,100 @@
+"""Time chat history writes and page reads against a large store.
+
+Fills a scratch SQLite database with --messages rows spread over
+--conversations conversations, then times:
+
+- record(), the only cost a chat request pays, and how the background
+  writer batches what it queues
+- the latest page of random conversations, as a reloaded tab reads it
+- pages deep into the longest conversation, following the cursor back
+
+    python benchmarks/bench_history.py [--messages 2000000] [--conversations 50000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from history_store import HistoryStore  # noqa: E402
+
+REPLY = "Here are some great options for you: " * 8
+
+
+def conversation_id(i):
+    return f"conversation-{i:012d}"
+
+
+def fill(store, messages, conversations):
+    # Bulk rows go straight in; only the timed records go through the queue
+    start = time.perf_counter()
+    db = store._writer
+    db.execute("BEGIN")
+    db.executemany(
+        "INSERT INTO messages (conversation, role, content, error, created) VALUES (?, ?, ?, 0, ?)",
+        ((conversation_id(i % conversations), "user" if i % 2 == 0 else "agent", REPLY, 1e9 + i)
+         for i in range(messages)))
+    db.execute("COMMIT")
+    return time.perf_counter() - start
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<26}{len(timings):>7} x   mean {statistics.mean(timings) * 1e6:9.1f} us   "
+          f"p50 {statistics.median(timings) * 1e6:9.1f} us   p99 {p99 * 1e6:9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--conversations", type=int, default=50_000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--records", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(os.path.join(tmp, "history.sqlite3"))
+        seconds = fill(store, args.messages, args.conversations)
+        print(f"filled {args.messages} messages in {seconds:.1f}s "
+              f"({os.path.getsize(store.path) / 1e6:.0f} MB)\n")
+
+        records = []
+        for i in range(args.records):
+            start = time.perf_counter()
+            store.record(conversation_id(i % args.conversations), "user", REPLY)
+            records.append(time.perf_counter() - start)
+        store.sync(timeout=60)
+        report("record (request path)", records)
+        stats = store.stats()
+        print(f"{'':<26}{stats['written']} written in {stats['batches']} transactions")
+
+        rng = random.Random(0)
+        latest = []
+        for _ in range(args.reads):
+            conversation = conversation_id(rng.randrange(args.conversations))
+            start = time.perf_counter()
+            store.page(conversation)
+            latest.append(time.perf_counter() - start)
+        report("latest page", latest)
+
+        deep, cursor = [], None
+        while len(deep) < args.reads:
+            start = time.perf_counter()
+            page = store.page(conversation_id(0), cursor)
+            deep.append(time.perf_counter() - start)
+            cursor = page["before"]
+            if cursor is None:
+                break
+        report("older pages (cursor)", deep)
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Latency and accuracy of the local intent router.
+
+Times IntentRouter.route() on messages it answers (greetings, thanks,
+goodbyes, help questions), on shopping questions it must pass through, and
+on long prompts, and checks that each sample is classified as expected.
+With --fixtures, also reports the share of recorded prompts it would
+answer locally. Fails (exit 1) on a misrouted sample or when the p99
+latency of any group exceeds --budget-us.
+
+    python benchmarks/bench_intent_router.py [--repeat 20000] [--budget-us 1000] [--fixtures agent_fixtures.jsonl]
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from intent_router import IntentRouter, classify  # noqa: E402
+
+ANSWERED = {
+    "hi": "greeting", "Hello!": "greeting", "hey there": "greeting", "Good morning": "greeting",
+    "thanks": "thanks", "Thank you so much!": "thanks", "ok thanks": "thanks", "great, thanks!": "thanks",
+    "bye": "goodbye", "see you later": "goodbye", "Goodbye!": "goodbye",
+    "help": "help", "What can you do?": "help", "Hi, what can you help me with?": "help", "who are you?": "help",
+}
+PASSED = [
+    "hi, any earbuds under $100?", "thanks, now show me laptops", "Best wireless earbuds under $100?",
+    "help me find a laptop for college", "what can you tell me about the iPhone 15", "hello kitty backpack",
+    "thank you cards", "bye bye birdie dvd", "Compare AirPods Pro and Sony WF-1000XM5",
+]
+LONG = ["I'm looking for a lightweight laptop with at least 16GB of RAM, a good keyboard and all-day battery "
+        "life for under $1200. Which would you recommend, and how do they compare on reviews? " * 4]
+
+
+def percentile(timings, q):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * q / 100))]
+
+
+def time_group(router, messages, repeat):
+    """Seconds per route() call, one sample per call"""
+    timings = []
+    for _ in range(max(1, repeat // len(messages))):
+        for message in messages:
+            start = time.perf_counter()
+            router.route(message)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20000, help="route() calls per group")
+    parser.add_argument("--budget-us", type=float, default=1000, help="allowed p99 latency per call")
+    parser.add_argument("--fixtures", help="report the share of these recorded prompts answered locally")
+    args = parser.parse_args()
+
+    misrouted = [(message, intent, classify(message)) for message, intent in ANSWERED.items()
+                 if classify(message) != intent]
+    misrouted += [(message, None, classify(message)) for message in PASSED if classify(message) is not None]
+    for message, expected, got in misrouted:
+        print(f"misrouted: {message!r} expected {expected}, got {got}")
+
+    router = IntentRouter()
+    over_budget = False
+    for name, messages in (("answered", list(ANSWERED)), ("passed", PASSED), ("long", LONG)):
+        timings = time_group(router, messages, args.repeat)
+        p50, p99 = percentile(timings, 50) * 1e6, percentile(timings, 99) * 1e6
+        over_budget |= p99 > args.budget_us
+        print(f"{name:<10} p50 {p50:8.2f} us   p99 {p99:8.2f} us   max {max(timings) * 1e6:8.2f} us")
+
+    if args.fixtures:
+        from agent_transport import FixtureStore
+
+        prompts = [fixture["prompt"] for fixture in FixtureStore(args.fixtures).load().fixtures]
+        intents = Counter(classify(prompt) for prompt in prompts)
+        answered = len(prompts) - intents.pop(None, 0)
+        print(f"\n{answered} of {len(prompts)} recorded prompts answered locally "
+              f"({answered / max(1, len(prompts)):.1%}): {dict(intents)}")
+
+    if misrouted or over_budget:
+        print(f"\nfailed: {len(misrouted)} misrouted" + (f", p99 over {args.budget_us:.0f} us" if over_budget else ""))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare the agentcore CLI subprocess path, the warm worker pool and the
+in-process HTTP client.
+
+All paths hit the same local agent_stub.py server, so the difference is the
+per-call overhead: interpreter startup, imports, a new connection and stdout
+serialization for the CLI, a JSON-lines hop to an already running worker for
+the pool, and a pooled keep-alive connection in-process.
+
+    python benchmarks/bench_invoke.py [--calls 20] [--delay 0.0]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent_client import CliAgentClient, HttpAgentClient  # noqa: E402
+from agent_credentials import AwsCredentials  # noqa: E402
+from agent_stub import make_server  # noqa: E402
+from agent_worker import WorkerPoolAgentClient  # noqa: E402
+
+
+def time_calls(client, calls, credentials):
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        client.invoke(f"best wireless earbuds under $100 #{i}", credentials)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<10} mean {statistics.mean(timings) * 1000:8.2f} ms   "
+          f"p50 {statistics.median(timings) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.0, help="simulated agent latency in seconds")
+    args = parser.parse_args()
+
+    server = make_server(port=0, delay=args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/invocations"
+    os.environ["AGENTCORE_STUB_URL"] = url
+    # Pool workers reach the stub through their own in-process HTTP client
+    os.environ["AGENTCORE_ENDPOINT"] = url
+
+    credentials = AwsCredentials("stub", "stub", "stub", time.time() + 3600)
+    cli = CliAgentClient(command=[sys.executable, str(ROOT / "agent_stub.py")])
+    pool = WorkerPoolAgentClient(size=2, command=[sys.executable, str(ROOT / "agent_worker.py")])
+    http = HttpAgentClient(url)
+
+    # Warm up every path before measuring
+    cli.invoke("warm up", credentials)
+    pool.invoke("warm up", credentials)
+    http.invoke("warm up", credentials)
+
+    report("cli", time_calls(cli, args.calls, credentials))
+    report("pool", time_calls(pool, args.calls, credentials))
+    report("in-process", time_calls(http, args.calls, credentials))
+
+    pool.close()
+    http.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""Per-stage latency and allocations of the reply parsing hot path, with a
+regression gate.
+
+The corpus holds realistic `agentcore invoke` outputs from 200 B to 4 MB in
+each envelope the decoder handles: a direct JSON payload, the CLI's
+{"response": ["b'...'"]} bytes-literal envelope, the same envelope embedded
+in CLI log output, and a plain-text reply. Every reply is an escaped
+multi-paragraph product list, so the cleaning stage has real work to do.
+
+Stages are decode_agent_output, clean_agent_text and both together. Times
+are divided by a fixed calibration workload before being compared with
+benchmarks/baselines/parsing.json, so the baseline carries across machines.
+The run fails (exit 1) when a stage's geometric mean over all cases is more
+than --threshold times its baseline, when any single case is more than
+--case-threshold times slower on re-measurement, or when a case's peak
+allocation grows by more than --threshold. Single cases get the looser
+limit because one timing on a shared machine can easily be 30% off.
+
+    python benchmarks/bench_parsing.py [--quick] [--threshold 1.3]
+    python benchmarks/bench_parsing.py --update-baseline
+"""
+import argparse
+import json
+import math
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from agent_text import clean_agent_text  # noqa: E402
+from response_decoder import decode_agent_output  # noqa: E402
+
+BASELINE = HERE / "baselines" / "parsing.json"
+
+PRODUCT_SEGMENT = (
+    "1. **Sony WF-1000XM4** - $98.00\\ Excellent noise cancellation and 8-hour battery life.\\ \\ "
+    "2. **Jabra Elite 85t** - $89.99\\ Comfortable fit, it\\'s rated \\\"best value\\\" by reviewers.\\ \\ "
+    "3. **Anker Soundcore Liberty 4** - $79.99\\ Great value with spatial audio:\\ - LDAC\\ - 9h battery\\ \\ "
+)
+REPLY_HEAD = "Here are some great options for you:\\ \\ "
+REPLY_TAIL = "Would you like me to compare any of these in more detail?"
+CLI_PREFIX = "Invoking agent async_shopping_strands...\nSession: 4f1c2a\n"
+SIZES = [("200B", 200), ("2KB", 2 * 1024), ("20KB", 20 * 1024), ("200KB", 200 * 1024),
+         ("2MB", 2 * 1024 * 1024), ("4MB", 4 * 1024 * 1024)]
+QUICK_SIZES = SIZES[:4]
+# Slowdowns smaller than this are treated as timer noise
+NOISE_FLOOR = 5e-6
+
+
+def product_reply(size):
+    """An escaped product-list reply of roughly `size` characters"""
+    body_size = max(0, size - len(REPLY_HEAD) - len(REPLY_TAIL))
+    body = (PRODUCT_SEGMENT * (body_size // len(PRODUCT_SEGMENT) + 1))[:body_size]
+    # Never cut a list item off in the middle of an escape sequence
+    return REPLY_HEAD + body.rstrip("\\") + REPLY_TAIL
+
+
+def direct_json(reply):
+    return json.dumps({"result": {"role": "assistant", "content": [{"text": reply}]}})
+
+
+def bytes_literal(reply):
+    return json.dumps({"response": [repr(direct_json(reply).encode("utf-8"))]})
+
+
+def embedded_bytes_literal(reply):
+    return CLI_PREFIX + bytes_literal(reply) + "\n"
+
+
+def plain_text(reply):
+    # Replies this long are not accepted as plain text, so larger sizes
+    # measure what rejecting them costs
+    return reply.replace("\\'", "'").replace('\\"', "'")
+
+
+ENVELOPES = [
+    ("direct_json", direct_json),
+    ("bytes_literal", bytes_literal),
+    ("embedded", embedded_bytes_literal),
+    ("plain_text", plain_text),
+]
+
+
+def make_output(wrap, size):
+    """Wrap a product reply so the whole output comes to roughly `size` bytes"""
+    reply_size = size
+    for _ in range(3):
+        output = wrap(product_reply(reply_size))
+        # Envelopes escape the reply, so scale it by how much they grew it
+        reply_size = max(1, int(reply_size * size / len(output)))
+    return wrap(product_reply(reply_size))
+
+
+def decode_stage(output):
+    return decode_agent_output(output).text
+
+
+def clean_stage(reply):
+    return clean_agent_text(reply) if reply else reply
+
+
+def full_stage(output):
+    return clean_stage(decode_stage(output))
+
+
+def time_call(func, arg, repeat):
+    """Best seconds per call over `repeat` samples of at least ~50 ms each"""
+    start = time.perf_counter()
+    func(arg)
+    once = max(time.perf_counter() - start, 1e-7)
+    loops = max(1, int(0.05 / once))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(arg)
+        samples.append((time.perf_counter() - start) / loops)
+    # The minimum is the run least disturbed by other load on the machine
+    return min(samples)
+
+
+def peak_allocation(func, arg):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def calibrate(repeat):
+    """Seconds for a fixed JSON and string workload, used to normalize timings"""
+    sample = json.dumps({"text": product_reply(64 * 1024)})
+
+    def workload(text):
+        json.loads(text)["text"].replace("\\ ", "\n").split("\n")
+
+    return time_call(workload, sample, max(repeat, 7))
+
+
+def cases(sizes):
+    """Yield (name, func, arg, input bytes) for every envelope, size and stage"""
+    for envelope, wrap in ENVELOPES:
+        for label, size in sizes:
+            output = make_output(wrap, size)
+            reply = decode_stage(output)
+            stages = [("decode", decode_stage, output), ("total", full_stage, output)]
+            if reply:
+                stages.insert(1, ("clean", clean_stage, reply))
+            for stage, func, arg in stages:
+                yield f"{envelope}/{label}/{stage}", func, arg, len(output.encode("utf-8"))
+
+
+def run(sizes, repeat):
+    results = {}
+    for name, func, arg, size in cases(sizes):
+        results[name] = {
+            "bytes": size,
+            "seconds": time_call(func, arg, repeat),
+            "peak_bytes": peak_allocation(func, arg),
+            "case": (func, arg),
+        }
+    return results
+
+
+def is_slower(seconds, calibration, base, threshold):
+    ratio = seconds / calibration / base["normalized"]
+    return ratio > threshold and seconds - base["normalized"] * calibration > NOISE_FLOOR
+
+
+def report(results, calibration, baseline, threshold, case_threshold):
+    """Print every case; return its ratio to baseline and the cases to re-check"""
+    ratios = {}
+    flagged = []
+    print(f"{'case':<34}{'input':>10}{'per call':>14}{'MB/s':>10}{'peak alloc':>12}{'vs base':>10}")
+    for name, result in results.items():
+        seconds = result["seconds"]
+        mb_s = result["bytes"] / seconds / 1e6
+        alloc = result["peak_bytes"] / result["bytes"]
+        line = (f"{name:<34}{result['bytes']:>10}{seconds * 1e6:>11.1f} us{mb_s:>10.1f}"
+                f"{alloc:>11.2f}x")
+        base = baseline.get(name)
+        if base:
+            ratios[name] = seconds / calibration / base["normalized"]
+            line += f"{ratios[name]:>9.2f}x"
+            if (is_slower(seconds, calibration, base, case_threshold)
+                    or result["peak_bytes"] > base["peak_bytes"] * threshold + 4096):
+                flagged.append(name)
+        print(line)
+    return ratios, flagged
+
+
+def stage_regressions(ratios, threshold):
+    """Compare the geometric mean ratio of each stage with the threshold"""
+    by_stage = {}
+    for name, ratio in ratios.items():
+        by_stage.setdefault(name.rsplit("/", 1)[1], []).append(ratio)
+    regressions = []
+    print()
+    for stage, values in by_stage.items():
+        mean = math.exp(sum(math.log(value) for value in values) / len(values))
+        print(f"{stage:<8} geometric mean {mean:.2f}x baseline over {len(values)} cases")
+        if mean > threshold:
+            regressions.append(f"{stage}: {mean:.2f}x slower than baseline on average")
+    return regressions
+
+
+def confirm(names, results, baseline, threshold, case_threshold, repeat):
+    """Re-measure flagged cases so one noisy sample cannot fail the run"""
+    confirmed = []
+    for name in names:
+        func, arg = results[name]["case"]
+        base = baseline[name]
+        peak = peak_allocation(func, arg)
+        if peak > base["peak_bytes"] * threshold + 4096:
+            confirmed.append(f"{name}: peak allocation {peak} B, baseline {base['peak_bytes']} B")
+            continue
+        ratios = []
+        for _ in range(2):
+            calibration = calibrate(repeat)
+            seconds = time_call(func, arg, repeat * 2)
+            ratios.append(seconds / calibration / base["normalized"])
+            if not is_slower(seconds, calibration, base, case_threshold):
+                break
+        else:
+            confirmed.append(f"{name}: {min(ratios):.2f}x slower than baseline")
+    return confirmed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="only sizes up to 200 KB")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="allowed slowdown of a stage on average, and allowed allocation growth")
+    parser.add_argument("--case-threshold", type=float, default=2.0, help="allowed slowdown of any single case")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    calibration = calibrate(args.repeat)
+    results = run(QUICK_SIZES if args.quick else SIZES, args.repeat)
+
+    baseline = json.loads(BASELINE.read_text(encoding="utf-8")) if BASELINE.exists() else {}
+    if args.update_baseline:
+        # Merge, so a --quick run keeps the large-size entries
+        baseline.update({name: {"normalized": result["seconds"] / calibration, "peak_bytes": result["peak_bytes"]}
+                         for name, result in results.items()})
+        BASELINE.parent.mkdir(exist_ok=True)
+        BASELINE.write_text(json.dumps(baseline, indent=1, sort_keys=True) + "\n", encoding="utf-8")
+        report(results, calibration, {}, args.threshold, args.case_threshold)
+        print(f"baseline written to {BASELINE.relative_to(HERE.parent)}")
+        return
+    if not baseline:
+        report(results, calibration, {}, args.threshold, args.case_threshold)
+        print("\nno baseline to compare against")
+        return
+
+    ratios, flagged = report(results, calibration, baseline, args.threshold, args.case_threshold)
+    regressions = stage_regressions(ratios, args.threshold)
+    regressions += confirm(flagged, results, baseline, args.threshold, args.case_threshold, args.repeat)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nno regressions")
+
+
+if __name__ == '__main__':
+    main()
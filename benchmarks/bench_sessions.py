@@ -0,0 +1,84 @@
+"""Compare follow-up latency with and without runtime session affinity.
+
+Each simulated conversation sends --turns messages through a SessionRegistry
+and the in-process HTTP client to the local agent_stub.py server, which
+charges --cold-start extra seconds for the first request of a runtime
+session (and for every request without one), the way a fresh AgentCore
+runtime session pays for start-up and re-establishing context. With
+affinity only the first turn of a conversation is cold; without it every
+turn is.
+
+    python benchmarks/bench_sessions.py [--conversations 10] [--turns 4] [--cold-start 0.2]
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent_client import HttpAgentClient  # noqa: E402
+from agent_credentials import AwsCredentials  # noqa: E402
+from agent_stub import make_server  # noqa: E402
+from sessions import SessionRegistry, is_warm, runtime_session_id  # noqa: E402
+
+
+def run_conversations(client, credentials, registry, conversations, turns):
+    """Return {"cold": [...], "warm": [...]} seconds per turn"""
+    timings = {"cold": [], "warm": []}
+    for i in range(conversations):
+        browser_session = None
+        for turn in range(turns):
+            session = registry.resolve(browser_session) if registry else None
+            browser_session = session and session.id
+            start = time.perf_counter()
+            client.invoke(f"conversation {i}, question {turn}", credentials, runtime_session_id(session))
+            seconds = time.perf_counter() - start
+            timings["warm" if is_warm(session) else "cold"].append(seconds)
+            if session is not None:
+                registry.record_turn(session, seconds)
+    return timings
+
+
+def report(name, timings):
+    if not timings:
+        return
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<22}{len(timings):>5} turns   mean {statistics.mean(timings) * 1000:8.2f} ms   "
+          f"p50 {statistics.median(timings) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=4, help="messages per conversation")
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated agent latency in seconds")
+    parser.add_argument("--cold-start", type=float, default=0.2,
+                        help="simulated extra latency of a new runtime session in seconds")
+    args = parser.parse_args()
+
+    server = make_server(port=0, delay=args.delay, cold_start=args.cold_start)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = HttpAgentClient(f"http://127.0.0.1:{server.server_address[1]}/invocations")
+    credentials = AwsCredentials("stub", "stub", "stub", time.time() + 3600)
+
+    affine = run_conversations(client, credentials, SessionRegistry(), args.conversations, args.turns)
+    unaffine = run_conversations(client, credentials, None, args.conversations, args.turns)
+
+    report("affinity, first turn", affine["cold"])
+    report("affinity, follow-up", affine["warm"])
+    report("no affinity", unaffine["cold"])
+    conversation = sum(affine["cold"] + affine["warm"]) / args.conversations
+    baseline = sum(unaffine["cold"]) / args.conversations
+    print(f"\nper conversation: {conversation * 1000:.1f} ms with affinity, {baseline * 1000:.1f} ms without")
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
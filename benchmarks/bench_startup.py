@@ -0,0 +1,128 @@
+"""Cold-start time of the chat app, from import to the first successful /chat.
+
+Each run is a fresh interpreter that imports the app module, builds the app
+with create_app() (including warm-up) and posts one /chat through the Flask
+test client to agent_stub.py over HTTP. Credentials come from a prepared
+CREDENTIALS_CACHE file, the way a recycled gunicorn worker finds them.
+Runs alternate between CHAT_WARM_UP=on and off, so the table shows where
+warm-up moves the work.
+
+Times are divided by the start-up time of a bare interpreter before being
+compared with benchmarks/baselines/startup.json, so the baseline carries
+across machines. The run fails (exit 1) when the median time to the first
+chat with warm-up is more than --threshold times its baseline.
+
+    python benchmarks/bench_startup.py [--runs 7] [--module shopping_agent_using_cloudscape]
+    python benchmarks/bench_startup.py --update-baseline
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(ROOT))
+
+BASELINE = HERE / "baselines" / "startup.json"
+PHASES = ("import", "create_app", "first_chat", "total")
+PROMPT = "Best wireless earbuds under $100?"
+
+
+def child(module):
+    """Run in the fresh interpreter: time each phase and print them as JSON"""
+    start = time.perf_counter()
+    app_module = importlib.import_module(module)
+    imported = time.perf_counter()
+    app = app_module.create_app()
+    created = time.perf_counter()
+    response = app.test_client().post("/chat", json={"prompt": PROMPT})
+    answered = time.perf_counter()
+    body = response.get_json()
+    if response.status_code != 200 or body.get("error"):
+        sys.exit(f"/chat failed: {response.status_code} {body}")
+    print(json.dumps({"import": imported - start, "create_app": created - imported,
+                      "first_chat": answered - created, "total": answered - start}))
+
+
+def interpreter_seconds(runs):
+    """Median wall time to start and stop a bare interpreter"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run(module, env, runs):
+    """Phase timings of `runs` cold starts, each in a new process"""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, __file__, "--child", module], env=env, cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return {phase: statistics.median(result[phase] for result in results) for phase in PHASES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="shopping_agentcore_chat_app")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=1.3, help="allowed slowdown of the first chat")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    from agent_credentials import AwsCredentials
+    from agent_stub import make_server
+
+    server = make_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        credentials = Path(tmp, "credentials.json")
+        credentials.write_text(json.dumps(list(AwsCredentials("bench", "bench", "bench", time.time() + 86400))))
+        env = dict(os.environ, AGENTCORE_INVOKE_MODE="http", AGENTCORE_TRANSPORT="live",
+                   AGENTCORE_ENDPOINT=f"http://127.0.0.1:{server.server_address[1]}/invocations",
+                   CREDENTIALS_CACHE=str(credentials), CHAT_HISTORY_PATH=str(Path(tmp, "history.sqlite3")),
+                   CHAT_RATE_PER_MINUTE="0")
+        calibration = interpreter_seconds(args.runs)
+        results = {warm_up: run(args.module, dict(env, CHAT_WARM_UP=warm_up), args.runs) for warm_up in ("on", "off")}
+    server.shutdown()
+
+    print(f"{args.module}, median of {args.runs} runs; bare interpreter {calibration * 1000:.1f} ms")
+    print(f"{'warm-up':<10}" + "".join(f"{phase:>14}" for phase in PHASES))
+    for warm_up, phases in results.items():
+        print(f"{warm_up:<10}" + "".join(f"{phases[phase] * 1000:11.1f} ms" for phase in PHASES))
+
+    key = f"{args.module}/total"
+    normalized = results["on"]["total"] / calibration
+    baseline = json.loads(BASELINE.read_text(encoding="utf-8")) if BASELINE.exists() else {}
+    if args.update_baseline:
+        baseline[key] = {"normalized": normalized}
+        BASELINE.parent.mkdir(exist_ok=True)
+        BASELINE.write_text(json.dumps(baseline, indent=1, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"baseline written to {BASELINE.relative_to(ROOT)}")
+        return
+    if key not in baseline:
+        print("\nno baseline to compare against")
+        return
+    ratio = normalized / baseline[key]["normalized"]
+    print(f"\nimport to first chat: {ratio:.2f}x baseline")
+    if ratio > args.threshold:
+        print(f"regression: more than {args.threshold:.2f}x slower than baseline")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
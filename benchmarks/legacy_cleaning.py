@@ -0,0 +1,37 @@
+"""The original sequential clean_agent_text, kept as the reference for the
+golden corpus and as the baseline in the cleaning benchmarks."""
+import re
+
+
+def legacy_clean_agent_text(text):
+    """Clean up escape sequences and formatting in agent responses"""
+    
+    # Handle backslash-space patterns that should be line breaks
+    # Replace "\ \ " with double line breaks (paragraph breaks)
+    text = text.replace('\\ \\ ', '\n\n')
+    
+    # Handle numbered lists - backslash before number
+    text = re.sub(r'\\\s+(\d+\.)', r'\n\1', text)
+    
+    # Handle colon followed by backslash (typically before lists)
+    text = text.replace(':\\\\', ':\n')
+    text = text.replace(':\\ ', ':\n')
+    
+    # Handle single backslash-space (general line break)
+    text = text.replace('\\ ', '\n')
+    
+    # Clean up escape sequences
+    text = text.replace('\\n\\n', '\n\n')  # Double newlines
+    text = text.replace('\\n', '\n')       # Single newlines
+    text = text.replace("\\'", "'")        # Escaped single quotes
+    text = text.replace('\\"', '"')        # Escaped double quotes
+    text = text.replace('\\t', '\t')       # Tabs
+    
+    # Handle any remaining double backslashes
+    text = text.replace('\\\\', '\\')
+    
+    # Remove trailing backslash if present
+    if text.endswith('\\'):
+        text = text[:-1]
+    
+    return text
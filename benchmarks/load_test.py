@@ -0,0 +1,196 @@
+"""Load-test a running chat server with the prompts of recorded fixtures.
+
+Start the app against recorded invocations, so no runtime, agentcore CLI
+or pybritive is involved, and with rate limiting off (every request comes
+from one address):
+
+    AGENTCORE_TRANSPORT=replay CHAT_RATE_PER_MINUTE=0 python shopping_agentcore_chat_app.py
+
+then run --clients concurrent clients sending --requests requests in total:
+
+    python benchmarks/load_test.py [--url http://127.0.0.1:5000] [--clients 8] [--requests 200] [--stream]
+
+Latencies are end to end; with --stream, time to the first event is
+reported as well. AGENTCORE_REPLAY_SCALE on the server speeds the agent up
+or slows it down.
+
+With --websocket (against the ASGI app), each client opens one connection
+to /chat/ws and sends all of its chats over it, instead of one HTTP request
+(and connection) per chat; time to the first delta is reported.
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent_transport import FIXTURES_PATH, FixtureStore  # noqa: E402
+
+
+def send(url, prompt, stream):
+    """Return (status, seconds to first byte, total seconds, failed)"""
+    body = json.dumps({"prompt": prompt}).encode("utf-8")
+    request = urllib.request.Request(url + ("/chat/stream" if stream else "/chat"), data=body,
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            first = response.read(1)
+            first_byte = time.perf_counter() - start
+            rest = first + response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        return e.code, None, time.perf_counter() - start, True
+    failed = b"event: error" in rest if stream else bool(json.loads(rest).get("error"))
+    return status, first_byte, time.perf_counter() - start, failed
+
+
+class SocketClient:
+    """A minimal blocking WebSocket client, enough to chat over /chat/ws"""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.sock = socket.create_connection((parts.hostname, parts.port or 80))
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.sock.sendall((f"GET /chat/ws HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+                          .encode("ascii"))
+        self.file = self.sock.makefile("rb")
+        status = self.file.readline()
+        if b" 101 " not in status:
+            raise OSError(f"WebSocket upgrade refused: {status.decode('latin-1').strip()}")
+        while self.file.readline() not in (b"\r\n", b""):
+            pass
+        self.chats = 0
+        self.receive()  # ready
+
+    def send_frame(self, opcode, payload):
+        # Client frames are masked (RFC 6455)
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, 0x80 | length])
+        elif length < 65536:
+            header = bytes([0x80 | opcode, 0x80 | 126]) + length.to_bytes(2, "big")
+        else:
+            header = bytes([0x80 | opcode, 0x80 | 127]) + length.to_bytes(8, "big")
+        mask = os.urandom(4)
+        self.sock.sendall(header + mask + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+
+    def receive(self):
+        """The next text frame, decoded; pings are answered on the way"""
+        while True:
+            first, second = self.file.read(2)
+            length = second & 0x7F
+            if length == 126:
+                length = int.from_bytes(self.file.read(2), "big")
+            elif length == 127:
+                length = int.from_bytes(self.file.read(8), "big")
+            payload = self.file.read(length)
+            opcode = first & 0x0F
+            if opcode == 0x8:
+                raise OSError("WebSocket closed by the server")
+            if opcode == 0x9:
+                self.send_frame(0xA, payload)
+            elif opcode == 0x1:
+                return json.loads(payload)
+
+    def close(self):
+        self.send_frame(0x8, (1000).to_bytes(2, "big"))
+        self.sock.close()
+
+    def chat(self, prompt):
+        """Return (seconds to first delta, total seconds, failed)"""
+        self.chats += 1
+        chat_id = str(self.chats)
+        start = time.perf_counter()
+        self.send_frame(0x1, json.dumps({"type": "chat", "id": chat_id, "prompt": prompt}).encode("utf-8"))
+        first_delta = None
+        while True:
+            frame = self.receive()
+            if frame.get("id") != chat_id:
+                continue
+            if frame["type"] == "delta" and first_delta is None:
+                first_delta = time.perf_counter() - start
+            elif frame["type"] in ("done", "error"):
+                return first_delta, time.perf_counter() - start, frame["type"] == "error"
+
+
+def report(name, timings):
+    if not timings:
+        return
+    timings = sorted(timings)
+
+    def percentile(q):
+        return timings[min(len(timings) - 1, int(len(timings) * q / 100))] * 1000
+
+    print(f"{name:<14} mean {statistics.mean(timings) * 1000:8.1f} ms   p50 {percentile(50):8.1f} ms   "
+          f"p95 {percentile(95):8.1f} ms   p99 {percentile(99):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="prompts are taken from these fixtures")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--websocket", action="store_true", help="chat over one /chat/ws connection per client")
+    args = parser.parse_args()
+
+    prompts = [fixture["prompt"] for fixture in FixtureStore(args.fixtures).load().fixtures]
+    lock = threading.Lock()
+    sent = 0
+    results = []
+
+    def client():
+        nonlocal sent
+        connection = None
+        while True:
+            with lock:
+                if sent >= args.requests:
+                    break
+                prompt = prompts[sent % len(prompts)]
+                sent += 1
+            if args.websocket:
+                connection = connection or SocketClient(args.url)
+                result = ("ws", *connection.chat(prompt))
+            else:
+                result = send(args.url, prompt, args.stream)
+            with lock:
+                results.append(result)
+        if connection is not None:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _, _, _ in results)
+    failed = sum(failed for _, _, _, failed in results)
+    print(f"{len(results)} requests from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(results) / elapsed:.1f} req/s), {failed} failed, status {dict(statuses)}")
+    # urllib closes its connection after every request
+    print(f"connections opened: {min(args.clients, len(results)) if args.websocket else len(results)}")
+    report("total", [total for _, _, total, _ in results])
+    if args.stream or args.websocket:
+        report("first event", [first for _, first, _, _ in results if first is not None])
+
+
+if __name__ == '__main__':
+    main()
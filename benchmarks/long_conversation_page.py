@@ -0,0 +1,121 @@
+"""Write a test page that loads a long conversation into the virtualized message list.
+
+The page fills the list with --messages messages (short questions and long
+product-list replies, as in a long shopping session) in one go, shows how
+many of them are actually in the DOM, and has a button that streams a
+reply token by token while the list stays pinned to the bottom. Open it on
+a phone, or with CPU throttling in the browser's dev tools, and scroll.
+
+    python benchmarks/long_conversation_page.py [--messages 5000] [-o long_conversation.html]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from virtual_list import VIRTUAL_LIST_JS  # noqa: E402
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Long conversation - virtualized message list</title>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+        #chatbox {
+            border: 1px solid #ccc; padding: 15px; height: 70vh; overflow-y: scroll;
+            background-color: #fafafa; border-radius: 4px; margin-bottom: 15px;
+        }
+        .message { margin-bottom: 15px; padding: 10px; border-radius: 6px; white-space: pre-wrap; }
+        .user { background-color: #e3f2fd; border-left: 4px solid #2196f3; }
+        .agent { background-color: #e8f5e8; border-left: 4px solid #4caf50; }
+        .fresh { animation: slideIn 0.3s ease-out; }
+        @keyframes slideIn { from { opacity: 0; transform: translateY(10px); } to { opacity: 1; transform: none; } }
+        #status { font-size: 13px; color: #555; }
+    </style>
+</head>
+<body>
+    <div id="chatbox"></div>
+    <button id="stream">Stream a reply</button>
+    <span id="status"></span>
+    <script>__VIRTUAL_LIST_JS__</script>
+    <script>
+        const COUNT = __MESSAGES__;
+        const PRODUCTS = ['Sony WF-1000XM4', 'Jabra Elite 85t', 'Anker Soundcore Liberty 4', 'Apple AirPods Pro',
+                          'Bose QuietComfort Earbuds II', 'Samsung Galaxy Buds2 Pro', 'Beats Fit Pro'];
+
+        function reply(i) {
+            const lines = ['Here are some great options for you:', ''];
+            for (let n = 0; n < 3 + i % 8; n++) {
+                const product = PRODUCTS[(i + n) % PRODUCTS.length];
+                lines.push(`${n + 1}. **${product}** - $${(49 + (i * 7 + n * 13) % 200).toFixed(2)}`);
+                lines.push('Excellent noise cancellation, comfortable fit and a long battery life.');
+            }
+            return lines.join('\\n');
+        }
+
+        function createMessage(message) {
+            const div = document.createElement('div');
+            div.className = `message ${message.isUser ? 'user' : 'agent'}`;
+            const label = document.createElement('b');
+            label.textContent = message.isUser ? 'You: ' : 'Agent: ';
+            div.append(label, message.content);
+            return div;
+        }
+
+        const chatbox = document.getElementById('chatbox');
+        const list = new VirtualMessageList(chatbox, createMessage);
+        const start = performance.now();
+        for (let i = 0; i < COUNT; i++) {
+            const isUser = i % 2 === 0;
+            list.append({ content: isUser ? `Question ${i / 2 + 1}: what are the best earbuds under $${100 + i % 150}?`
+                                           : reply(i), isUser }, false);
+        }
+        requestAnimationFrame(() => requestAnimationFrame(() => {
+            document.getElementById('status').dataset.loaded = `loaded in ${(performance.now() - start).toFixed(0)} ms`;
+        }));
+
+        setInterval(() => {
+            const status = document.getElementById('status');
+            status.textContent = `${list.length} messages, ${chatbox.querySelectorAll('.message').length} in the DOM`
+                + (status.dataset.loaded ? `, ${status.dataset.loaded}` : '');
+        }, 500);
+
+        document.getElementById('stream').onclick = () => {
+            const index = list.append({ content: '', isUser: false });
+            const words = reply(list.length).split(' ');
+            let text = '';
+            const timer = setInterval(() => {
+                if (!words.length) {
+                    clearInterval(timer);
+                    return;
+                }
+                text += words.shift() + ' ';
+                list.update(index, { content: text });
+            }, 16);
+        };
+    </script>
+</body>
+</html>
+"""
+
+
+def render_page(messages):
+    return PAGE.replace("__VIRTUAL_LIST_JS__", VIRTUAL_LIST_JS).replace("__MESSAGES__", str(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("-o", "--output", default="long_conversation.html")
+    args = parser.parse_args()
+
+    Path(args.output).write_text(render_page(args.messages), encoding="utf-8")
+    print(f"wrote {args.output} with {args.messages} messages")
+
+
+if __name__ == '__main__':
+    main()
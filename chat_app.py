@@ -0,0 +1,345 @@
+"""Flask app factory shared by both chat UIs.
+
+create_chat_app() builds the chat backend (credentials, agent client, cache,
+sessions, history, admission; see chat_core) and a Flask app serving it;
+the UI modules only supply their page. Importing this module imports Flask and the backend
+modules, since every app needs them, but constructs nothing: no credentials
+are checked out and no client, cache or connection is created until
+create_chat_app() runs. Only the ASGI app (and uvicorn) is imported lazily,
+when create_chat_asgi() asks for it.
+
+The app is warmed up before it is returned: credentials are checked out
+and the agent client readied (the boto3 client built, or a keep-alive
+connection opened), so the first chat after a cold start or a worker
+recycle does not wait for them. CHAT_WARM_UP=off skips this.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from itertools import chain
+
+from flask import Flask, Response, jsonify, render_template_string, request, stream_with_context
+
+from admission import ConcurrencyLimit, Overloaded
+from agent_client import AGENT_NAME, INVOKE_TIMEOUT
+from chat_client import CHAT_CLIENT_JS
+from chat_core import ChatBackend
+from chat_socket import CHAT_SOCKET_JS
+from chat_batch import NDJSON_CONTENT_TYPE, InvalidBatch, ndjson_results, parse_batch, run_batch
+from chat_stream import body_events, sse_event, stream_reply_events
+from coalescing import SingleFlight
+from compression import choose_encoding, compress_body, compress_stream
+from deadlines import (DISCONNECT_POLL, Deadline, RequestCancelled, check_deadline, client_gone, deadline_scope,
+                       remaining_time)
+from history_store import InvalidHistoryRequest, parse_history_request
+from intent_router import passthrough_requested
+from metrics import CONTENT_TYPE, REGISTRY, REQUESTS, RequestTiming, count_error
+from response_cache import bypass_requested
+from sessions import SESSION_HEADER, runtime_session_id
+from static_page import PrerenderedPage
+from virtual_list import VIRTUAL_LIST_JS
+
+WARM_UP = os.environ.get("CHAT_WARM_UP", "on") != "off"
+# Threads running credential checkouts for requests that wait on them
+CHECKOUT_THREADS = 4
+
+
+def create_chat_app(import_name, html_template, warm_up=WARM_UP):
+    """Build the chat backend and a Flask app serving `html_template` and the chat routes"""
+    app = Flask(import_name)
+
+    # The page is static: render it once and serve precompressed variants with an ETag
+    with app.app_context():
+        index_page = PrerenderedPage(render_template_string(html_template, virtual_list_js=VIRTUAL_LIST_JS,
+                                                            chat_socket_js=CHAT_SOCKET_JS,
+                                                            chat_client_js=CHAT_CLIENT_JS))
+    backend = app.extensions["chat_backend"] = ChatBackend(index_page)
+    credential_provider = backend.credential_provider
+    agent_client = backend.agent_client
+    response_cache = backend.response_cache
+    history = backend.history
+    # Identical prompts in flight at the same time share one agent invocation
+    inflight = SingleFlight(scope=AGENT_NAME)
+    # A cap on agent calls in flight across all clients
+    agent_slots = ConcurrencyLimit()
+    # Checkouts run here, so a request can stop waiting for one (threads start on first use)
+    checkouts = ThreadPoolExecutor(max_workers=CHECKOUT_THREADS, thread_name_prefix="credential-checkout")
+
+    @app.route('/')
+    def index():
+        status, body, headers = index_page.select(request.headers.get('Accept-Encoding'),
+                                                  request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
+
+    def admit(payload):
+        """Charge the calling client's token bucket; raises TooManyRequests once it is empty"""
+        backend.admit(payload, request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+    def get_credentials():
+        """Return credentials, only using a thread when a checkout is needed.
+
+        The wait for a checkout ends once the request's deadline fires: its
+        budget ran out or its client went away. The checkout itself finishes
+        on its thread, for the requests after it.
+        """
+        creds = credential_provider.cached()
+        if creds is not None:
+            return creds
+        checkout = checkouts.submit(credential_provider.get, timeout=remaining_time())
+        while not wait([checkout], timeout=DISCONNECT_POLL).done:
+            check_deadline()
+        return checkout.result()
+
+    def rejected(error):
+        """The 429 (rate limited) or 503 (saturated) response for a request that was not admitted"""
+        count_error(error)
+        return (jsonify({"response": str(error), "error": True}), error.status,
+                {'Retry-After': str(error.retry_after)})
+
+    def compressed_json(data):
+        """jsonify(data), gzip/brotli compressed when the client accepts it and the body is large enough"""
+        response = jsonify(data)
+        body, encoding = compress_body(response.get_data(), request.headers.get('Accept-Encoding'))
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding is not None:
+            response.set_data(body)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def streamed(events, mimetype, headers):
+        """A streaming response, compressed and flushed chunk by chunk when the client accepts it"""
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            events = compress_stream(events, encoding)
+        return Response(events, mimetype=mimetype, headers=headers)
+
+    def invoke_chat(user_prompt, timing, session=None, slot_timeout=None):
+        """Invoke the agent for a prompt and return the /chat response body"""
+        # One of the global agent slots is held from credential checkout until
+        # the agent has answered
+        with agent_slots.slot(slot_timeout):
+            # Get AWS credentials (cached until shortly before they expire), within
+            # the request's time budget
+            with timing.stage("credentials"):
+                creds = get_credentials()
+            check_deadline()
+
+            # Invoke agentcore, on the session's runtime session when there is one;
+            # the call is stopped if the client goes away or the budget runs out
+            with timing.stage("invoke") as invoke_stage:
+                response = agent_client.invoke(user_prompt, creds, session_id=runtime_session_id(session))
+        return backend.agent_reply(user_prompt, response, timing, session, invoke_stage.seconds)
+
+    def answer_prompt(user_prompt, timing, session=None, bypass_cache=False, slot_timeout=None, passthrough=False):
+        """Answer a prompt locally, from the cache or by the agent, returning the /chat response body"""
+        local_reply = backend.local_reply(user_prompt, timing, session, bypass_cache, passthrough)
+        if local_reply is not None:
+            return local_reply
+        return inflight.do(user_prompt, partial(invoke_chat, user_prompt, timing, session, slot_timeout),
+                           runtime_session_id(session))
+
+    def chat_reply(timing, session=None):
+        """Build the /chat response body for the current request"""
+        try:
+            invalid = backend.invalid_request(request.json if request.is_json else None)
+            if invalid is not None:
+                return {"response": invalid, "error": True}
+
+            user_prompt = request.json['prompt']
+            bypass_cache = bypass_requested(request.json, request.headers.get('Cache-Control'))
+            return answer_prompt(user_prompt, timing, session, bypass_cache,
+                                 passthrough=passthrough_requested(request.json))
+
+        except Overloaded:
+            raise
+        except Exception as e:
+            count_error(e)
+            return {"response": f"Error: {str(e)}", "error": True}
+
+    @app.route('/chat', methods=['POST'])
+    def chat():
+        REQUESTS.inc('/chat')
+        timing = RequestTiming()
+        payload = request.get_json(silent=True)
+        # One time budget for the whole request, which also ends if the client hangs up
+        deadline = Deadline(gone=partial(client_gone, request.environ))
+        try:
+            admit(payload)
+            session = backend.chat_session(payload)
+            with deadline_scope(deadline):
+                body = chat_reply(timing, session)
+        except Overloaded as e:
+            return rejected(e)
+        if not body.get('error'):
+            backend.remember(session, payload['prompt'], body['response'])
+        # Long product comparisons shrink several times over on slow mobile links
+        response = compressed_json(body)
+        # Per-stage breakdown for the browser's network panel
+        response.headers['Server-Timing'] = timing.finish()
+        if session is not None:
+            # The page sends it back with its next message
+            response.headers[SESSION_HEADER] = session.id
+        return response
+
+
+    @app.route('/chat/stream', methods=['POST'])
+    def chat_stream():
+        REQUESTS.inc('/chat/stream')
+        try:
+            admit(request.get_json(silent=True))
+        except Overloaded as e:
+            return rejected(e)
+        invalid = backend.invalid_request(request.json if request.is_json else None)
+        if invalid is not None:
+            return Response(sse_event({"response": invalid, "error": True}, "error"), mimetype='text/event-stream')
+
+        user_prompt = request.json['prompt']
+        session = backend.chat_session(request.json)
+        headers = {'Cache-Control': 'no-cache'}
+        if session is not None:
+            headers[SESSION_HEADER] = session.id
+        # Stages up to the first event come back as Server-Timing; the rest
+        # finish after the headers are sent and only feed the histograms
+        timing = RequestTiming()
+        # Greetings, thanks and help questions, and cached replies, are answered without the agent
+        local_reply = backend.local_reply(user_prompt, timing, session,
+                                          bypass_requested(request.json, request.headers.get('Cache-Control')),
+                                          passthrough_requested(request.json))
+        if local_reply is not None:
+            backend.remember(session, user_prompt, local_reply['response'])
+            return streamed(body_events(local_reply), 'text/event-stream', headers)
+
+        def generate():
+            def on_reply(agent_reply):
+                backend.streamed_reply(user_prompt, agent_reply, session, timing.elapsed() - invoke_start)
+
+            with agent_slots.slot():
+                timing.mark("queue")
+                try:
+                    with timing.stage("credentials"):
+                        creds = get_credentials()
+                    check_deadline()
+                except Exception as e:
+                    count_error(e)
+                    yield sse_event({"response": f"Error: {str(e)}", "error": True}, "error")
+                    return
+                invoke_start = timing.elapsed()
+                first = True
+                for event in stream_reply_events(agent_client, user_prompt, creds, on_reply, count_error,
+                                                 runtime_session_id(session)):
+                    if first:
+                        timing.record("agent_first_byte", timing.elapsed() - invoke_start)
+                        first = False
+                    yield event
+            timing.mark("stream_total")
+
+        # The budget covers the wait for the first event; a client that hangs up
+        # stops the agent call once no other request shares it
+        with deadline_scope(Deadline(gone=partial(client_gone, request.environ))):
+            events = inflight.stream(user_prompt, generate, runtime_session_id(session))
+        # The shared producer only emits once it holds an agent slot, so a full
+        # server surfaces here, before any headers are sent
+        try:
+            first_event = next(events)
+        except Overloaded as e:
+            return rejected(e)
+        except RequestCancelled as e:
+            count_error(e)
+            return Response(sse_event({"response": f"Error: {str(e)}", "error": True}, "error"),
+                            mimetype='text/event-stream', headers=headers)
+
+        # A request that joined another's stream only has this stage
+        timing.mark("first_event")
+        headers['Server-Timing'] = timing.header()
+        headers['X-Accel-Buffering'] = 'no'
+        return streamed(stream_with_context(chain([first_event], events)), 'text/event-stream', headers)
+
+
+    @app.route('/chat/batch', methods=['POST'])
+    def chat_batch():
+        REQUESTS.inc('/chat/batch')
+        payload = request.get_json(silent=True)
+        try:
+            prompts, parallelism = parse_batch(payload)
+        except InvalidBatch as e:
+            return jsonify({"response": str(e), "error": True}), 400
+
+        # A batch is charged as one request; its parallelism bounds the rest
+        try:
+            admit(payload)
+        except Overloaded as e:
+            return rejected(e)
+
+        # Check credentials out once up front; every item then reuses them
+        try:
+            credential_provider.get()
+        except Exception as e:
+            count_error(e)
+            return jsonify({"response": f"Error: {str(e)}", "error": True}), 503
+
+        bypass_cache = bypass_requested(payload, request.headers.get('Cache-Control'))
+        passthrough = passthrough_requested(payload)
+
+        gone = partial(client_gone, request.environ)
+
+        def answer(user_prompt):
+            # Each item gets the time budget of a single chat, and stops with
+            # the others when the client hangs up
+            with deadline_scope(Deadline(gone=gone)):
+                # Batch items queue for an agent slot rather than fail when the server is busy
+                return answer_prompt(user_prompt, RequestTiming(), bypass_cache=bypass_cache,
+                                     slot_timeout=INVOKE_TIMEOUT, passthrough=passthrough)
+
+        # Each result is sent as soon as it is ready, not in request order
+        return streamed(ndjson_results(run_batch(prompts, answer, parallelism)), NDJSON_CONTENT_TYPE,
+                        {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+    @app.route('/cache', methods=['GET', 'DELETE'])
+    def cache():
+        if response_cache is None:
+            return jsonify({"response": "Response cache is disabled", "error": True}), 404
+        if request.method == 'DELETE':
+            # Drop one prompt's entry, or everything when no prompt is given
+            payload = request.get_json(silent=True) or {}
+            response_cache.invalidate(payload.get('prompt'))
+        return jsonify(response_cache.stats())
+
+
+    @app.route('/history')
+    def chat_history():
+        if history is None:
+            return jsonify({"response": "Chat history is disabled", "error": True}), 404
+        try:
+            session_id, before, limit = parse_history_request(request.args)
+        except InvalidHistoryRequest as e:
+            return jsonify({"response": str(e), "error": True}), 400
+        # One page of messages, oldest first, and the cursor for the page before it
+        return jsonify(history.page(session_id, before, limit))
+
+
+    def collect_stats():
+        return backend.stats(agent_slots.stats(), inflight.stats())
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(collect_stats())
+
+    @app.route('/metrics')
+    def metrics():
+        # Prometheus text format: stage histograms, request/error counters, stats as gauges
+        return Response(REGISTRY.render(collect_stats()), content_type=CONTENT_TYPE)
+
+    if warm_up:
+        backend.warm_up()
+    return app
+
+
+def create_chat_asgi(app):
+    """The ASGI app (async serving with bounded concurrency) for the backend of a create_chat_app() app"""
+    from asgi_app import create_asgi_app
+    from coalescing import AsyncSingleFlight
+
+    return create_asgi_app(app.extensions["chat_backend"], inflight=AsyncSingleFlight(scope=AGENT_NAME))
@@ -0,0 +1,180 @@
+"""Batch chat: many prompts in one request, answered in parallel.
+
+POST /chat/batch takes {"prompts": [...], "parallelism": N} and streams one
+NDJSON line per prompt as soon as it is answered, then a final
+{"done": true, ...} line. A failing prompt produces an error line and the
+rest of the batch carries on.
+
+    python chat_batch.py prompts.txt [--url URL] [--parallelism 8] [--no-cache]
+        Sends a file of prompts (one per line, or a JSON list; - for stdin)
+        to /chat/batch and prints the result lines as they arrive. Exits 1
+        if any prompt failed.
+"""
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import count_error
+
+BATCH_PARALLELISM = int(os.environ.get("CHAT_BATCH_PARALLELISM", "4"))
+BATCH_MAX_PARALLELISM = int(os.environ.get("CHAT_BATCH_MAX_PARALLELISM", "16"))
+BATCH_MAX_ITEMS = int(os.environ.get("CHAT_BATCH_MAX_ITEMS", "500"))
+BATCH_URL = os.environ.get("CHAT_BATCH_URL", "http://127.0.0.1:5000/chat/batch")
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+class InvalidBatch(ValueError):
+    """Raised when a batch request is malformed as a whole"""
+
+
+def parse_batch(payload):
+    """Return (prompts, parallelism) from a /chat/batch request body"""
+    if not isinstance(payload, dict) or not isinstance(payload.get("prompts"), list):
+        raise InvalidBatch('Expected {"prompts": [...]}')
+    prompts = payload["prompts"]
+    if not prompts:
+        raise InvalidBatch("Please provide at least one prompt")
+    if len(prompts) > BATCH_MAX_ITEMS:
+        raise InvalidBatch(f"At most {BATCH_MAX_ITEMS} prompts per batch")
+    parallelism = payload.get("parallelism", BATCH_PARALLELISM)
+    if not isinstance(parallelism, int) or isinstance(parallelism, bool) or parallelism < 1:
+        raise InvalidBatch("parallelism must be a positive integer")
+    return prompts, min(parallelism, BATCH_MAX_PARALLELISM)
+
+
+def _invalid_item(index, prompt):
+    if isinstance(prompt, str) and prompt.strip():
+        return None
+    return {"index": index, "prompt": prompt, "response": "Please provide a valid prompt", "error": True}
+
+
+def _failed_item(index, prompt, error):
+    count_error(error)
+    return {"index": index, "prompt": prompt, "response": f"Error: {str(error)}", "error": True}
+
+
+def answer_item(index, prompt, answer):
+    """Answer one prompt; its failure becomes an error result, not an exception"""
+    invalid = _invalid_item(index, prompt)
+    if invalid is not None:
+        return invalid
+    try:
+        return {"index": index, "prompt": prompt, **answer(prompt)}
+    except Exception as e:
+        return _failed_item(index, prompt, e)
+
+
+def run_batch(prompts, answer, parallelism=BATCH_PARALLELISM):
+    """Yield a result per prompt in completion order, answering at most `parallelism` at once"""
+    executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="chat-batch")
+    try:
+        futures = [executor.submit(answer_item, index, prompt, answer) for index, prompt in enumerate(prompts)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # A client that goes away cancels the prompts not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_batch_async(prompts, answer, parallelism=BATCH_PARALLELISM):
+    """Async counterpart of run_batch; answer is a coroutine function"""
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def answer_item_async(index, prompt):
+        invalid = _invalid_item(index, prompt)
+        if invalid is not None:
+            return invalid
+        async with semaphore:
+            try:
+                return {"index": index, "prompt": prompt, **(await answer(prompt))}
+            except Exception as e:
+                return _failed_item(index, prompt, e)
+
+    tasks = [asyncio.ensure_future(answer_item_async(index, prompt)) for index, prompt in enumerate(prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def ndjson_line(data):
+    return json.dumps(data) + "\n"
+
+
+def ndjson_results(results):
+    """Format batch results as NDJSON lines, ending with the summary line"""
+    items = errors = 0
+    for result in results:
+        items += 1
+        errors += bool(result.get("error"))
+        yield ndjson_line(result)
+    yield ndjson_line({"done": True, "items": items, "errors": errors})
+
+
+async def ndjson_results_async(results):
+    """Async counterpart of ndjson_results"""
+    items = errors = 0
+    async for result in results:
+        items += 1
+        errors += bool(result.get("error"))
+        yield ndjson_line(result)
+    yield ndjson_line({"done": True, "items": items, "errors": errors})
+
+
+def read_prompts(stream):
+    """Prompts from a JSON list, or one per non-blank line"""
+    text = stream.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def main(argv=None):
+    # Only the command line client needs these; the app does not pay for importing them
+    import argparse
+    import urllib.error
+    import urllib.request
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("prompts", help="file of prompts, or - for stdin")
+    parser.add_argument("--url", default=BATCH_URL)
+    parser.add_argument("--parallelism", type=int, default=BATCH_PARALLELISM)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    args = parser.parse_args(argv)
+
+    if args.prompts == "-":
+        prompts = read_prompts(sys.stdin)
+    else:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = read_prompts(f)
+    body = {"prompts": prompts, "parallelism": args.parallelism}
+    if args.no_cache:
+        body["cache"] = False
+    request = urllib.request.Request(args.url, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"Batch rejected with HTTP {e.code}: {e.read().decode('utf-8', 'replace')}") from None
+    summary = None
+    with response:
+        for line in response:
+            result = json.loads(line)
+            if result.get("done"):
+                summary = result
+                break
+            sys.stdout.write(line.decode("utf-8"))
+            sys.stdout.flush()
+    if summary is None:
+        raise SystemExit("Batch ended before all prompts were answered")
+    print(f"{summary['items']} prompts, {summary['errors']} failed", file=sys.stderr)
+    if summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
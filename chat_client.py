@@ -0,0 +1,142 @@
+"""Page-side chat client shared by both chat pages.
+
+Keeps the tab's agent session id in sessionStorage, pages through earlier
+turns from /history, and sends each message over the page's ChatSocket,
+falling back to POST /chat/stream (read as Server-Sent Events) while the
+socket cannot be opened or when it drops before any of the reply arrived.
+Rendering stays with the page.
+
+The pages include CHAT_CLIENT_JS after CHAT_SOCKET_JS and construct
+
+    const chatClient = new ChatClient('/chat/ws')
+
+then call chatClient.readChat(prompt, onDelta, onStatus), which resolves
+once the reply is complete and rejects with an Error whose fromServer is
+set when its message is the server's own explanation, and
+chatClient.loadHistory(onPage), which calls onPage with the next page of
+/history messages (oldest first) unless every earlier turn is loaded.
+"""
+
+CHAT_CLIENT_JS = r"""
+class ChatClient {
+    constructor(socketPath) {
+        // Sent with every message so follow-ups reuse this tab's agent session
+        this.sessionId = sessionStorage.getItem('chatSessionId');
+        this.socket = new ChatSocket(socketPath);
+        // A tab without a session when the page loaded has no earlier turns
+        this.historyCursor = null;
+        this.historyDone = !this.sessionId;
+        this.historyLoading = false;
+    }
+
+    rememberSession(sessionId) {
+        if (sessionId && sessionId !== this.sessionId) {
+            this.sessionId = sessionId;
+            sessionStorage.setItem('chatSessionId', sessionId);
+        }
+    }
+
+    chatRequest(prompt) {
+        const request = { prompt: prompt };
+        if (this.sessionId) {
+            request.session_id = this.sessionId;
+        }
+        return request;
+    }
+
+    // Earlier turns of this tab's conversation, a page per call
+    loadHistory(onPage) {
+        if (!this.sessionId || this.historyDone || this.historyLoading) return;
+        this.historyLoading = true;
+        const params = new URLSearchParams({ session_id: this.sessionId });
+        if (this.historyCursor) {
+            params.set('before', this.historyCursor);
+        }
+        fetch(`/history?${params}`)
+        .then(response => response.ok ? response.json() : { messages: [], before: null })
+        .then(page => {
+            onPage(page.messages);
+            this.historyCursor = page.before;
+            this.historyDone = !page.before;
+        })
+        .catch(error => console.error('History:', error))
+        .finally(() => {
+            this.historyLoading = false;
+        });
+    }
+
+    readChatStream(prompt, onDelta) {
+        return fetch('/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(this.chatRequest(prompt))
+        })
+        .then(response => {
+            if (!response.ok || !response.body) {
+                // Rejections (429 rate limited, 503 saturated) explain themselves in JSON
+                return response.json().catch(() => ({})).then(payload => {
+                    const error = new Error(payload.response || `HTTP ${response.status}`);
+                    error.fromServer = Boolean(payload.response);
+                    throw error;
+                });
+            }
+            this.rememberSession(response.headers.get('X-Chat-Session-Id'));
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            function handleEvent(raw) {
+                let event = 'message';
+                let data = '';
+                for (const line of raw.split('\n')) {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                }
+                const payload = data ? JSON.parse(data) : {};
+                if (event === 'error') {
+                    const error = new Error(payload.response);
+                    error.fromServer = true;
+                    throw error;
+                }
+                if (event === 'done') {
+                    return true;
+                }
+                onDelta(payload.delta);
+                return false;
+            }
+
+            function pump() {
+                return reader.read().then(({ value, done }) => {
+                    if (done) return;
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        const raw = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        if (handleEvent(raw)) return reader.cancel();
+                    }
+                    return pump();
+                });
+            }
+
+            return pump();
+        });
+    }
+
+    readChat(prompt, onDelta, onStatus) {
+        return this.socket.chat(this.chatRequest(prompt), onDelta, onStatus)
+        .then(done => this.rememberSession(done.session_id))
+        .catch(error => {
+            if (error.transport && !error.partial) {
+                return this.readChatStream(prompt, onDelta);
+            }
+            throw error;
+        });
+    }
+}
+"""
@@ -0,0 +1,197 @@
+"""The chat backend shared by the Flask and ASGI apps.
+
+ChatBackend holds the components chats are served with (credentials, agent
+client, intent router, cache, sessions, history, rate limiter) and the
+handling that does not depend on how a request arrived: admission,
+resolving the session, answering locally or from the cache, turning an
+agent response into a reply, recording answered turns, and the /stats
+counters. The apps only add their I/O around it: the Flask app blocks a
+thread on the agent, the ASGI app awaits it.
+"""
+import logging
+import time
+
+from admission import RATE_LIMIT_KEY, client_key, make_rate_limiter
+from agent_client import AGENT_NAME, make_agent_client
+from agent_credentials import CredentialProvider
+from agent_text import clean_agent_text
+from agent_transport import credential_fetcher
+from chat_socket import SOCKETS
+from compression import COMPRESSIONS
+from deadlines import CANCELLATIONS
+from history_store import make_history_store
+from intent_router import make_intent_router
+from metrics import count_error
+from response_cache import make_response_cache
+from response_decoder import decode_agent_output, decode_payload, envelope_counts
+from sessions import is_new_conversation, make_session_registry
+
+logger = logging.getLogger(__name__)
+
+
+class ChatBackend:
+    """The components the Flask and ASGI apps serve chats with, and what they do with them"""
+
+    def __init__(self, index_page):
+        self.index_page = index_page
+        # Session credentials are checked out once and refreshed ahead of expiry
+        # (placeholders when replaying recorded invocations offline)
+        self.credential_provider = CredentialProvider(credential_fetcher())
+        # In-process runtime client when configured, agentcore CLI subprocess otherwise;
+        # AGENTCORE_TRANSPORT=record|replay records invocations or replays them offline
+        self.agent_client = make_agent_client()
+        # Greetings, thanks and help questions answered locally (CHAT_INTENT_ROUTER=off to disable)
+        self.intent_router = make_intent_router()
+        # Optional cache of cleaned replies for repeated prompts (RESPONSE_CACHE=memory|disk)
+        self.response_cache = make_response_cache(scope=AGENT_NAME)
+        # Browser session -> agent runtime session, so follow-ups reach a warm runtime
+        self.sessions = make_session_registry()
+        # Answered turns per browser session, kept across reloads and restarts
+        self.history = make_history_store() if self.sessions is not None else None
+        # Per-client token buckets, checked before any credential or agent work
+        self.rate_limiter = make_rate_limiter()
+        self.rate_limit_key = RATE_LIMIT_KEY
+        self.warm_up_seconds = None
+
+    def warm_up(self):
+        """Check credentials out and ready the agent client before the first chat needs them"""
+        start = time.perf_counter()
+        try:
+            credentials = self.credential_provider.get()
+            if hasattr(self.agent_client, "warm_up"):
+                self.agent_client.warm_up(credentials)
+        except Exception:
+            # Not fatal: the first chat tries again and reports what went wrong
+            logger.warning("Warm-up failed", exc_info=True)
+            return
+        self.warm_up_seconds = time.perf_counter() - start
+
+    def startup_stats(self):
+        return {"warmed_up": int(self.warm_up_seconds is not None), "warm_up_seconds": self.warm_up_seconds}
+
+    def admit(self, payload, remote_addr, forwarded_for=None):
+        """Charge the calling client's token bucket; raises TooManyRequests once it is empty"""
+        if self.rate_limiter is None:
+            return
+        session_id = payload.get('session_id') if isinstance(payload, dict) else None
+        if self.sessions is None or not self.sessions.knows(session_id):
+            # Unknown and made-up session ids are charged to the client's address
+            session_id = None
+        self.rate_limiter.check(client_key(remote_addr, forwarded_for, session_id, self.rate_limit_key))
+
+    def invalid_request(self, payload):
+        """Why a chat request body cannot be answered, or None when it can"""
+        if not isinstance(payload, dict):
+            return "Invalid request format"
+        prompt = payload.get('prompt')
+        if not prompt or not isinstance(prompt, str):
+            return "Please provide a valid prompt"
+        return None
+
+    def chat_session(self, payload):
+        """The chat session named in the request body, or None without session affinity"""
+        if self.sessions is None:
+            return None
+        return self.sessions.resolve(payload.get('session_id') if isinstance(payload, dict) else None)
+
+    def remember(self, session, user_prompt, agent_reply):
+        """Queue an answered turn for the history store; never waits on the disk"""
+        if self.history is not None and session is not None:
+            self.history.record_turn(session.id, user_prompt, agent_reply)
+
+    def cacheable(self, session):
+        # Follow-up answers depend on the conversation, so only first turns are cached. A request
+        # naming a session may be a follow-up this process never saw, so it is never served a
+        # cached reply, nor its reply cached for others
+        return self.response_cache is not None and is_new_conversation(session)
+
+    def local_reply(self, user_prompt, timing, session=None, bypass_cache=False, passthrough=False):
+        """The reply body for a prompt answered without the agent, or None when it needs the agent"""
+        # Greetings, thanks and help questions need neither credentials nor the agent
+        if self.intent_router is not None:
+            with timing.stage("route"):
+                routed_reply = self.intent_router.route(user_prompt, passthrough)
+            if routed_reply is not None:
+                return {"response": routed_reply, "routed": True}
+
+        # A cached answer needs neither credentials nor an agent round trip
+        if self.cacheable(session) and not bypass_cache:
+            with timing.stage("cache"):
+                cached_reply = self.response_cache.get(user_prompt)
+            if cached_reply is not None:
+                if session is not None:
+                    self.sessions.record_turn(session)
+                return {"response": cached_reply, "cached": True}
+        return None
+
+    def agent_reply(self, user_prompt, response, timing, session=None, invoke_seconds=0.0):
+        """Turn an agent response into the /chat response body, caching the reply when it may be"""
+        cacheable = self.cacheable(session)
+        if session is not None:
+            self.sessions.record_turn(session, invoke_seconds)
+
+        with timing.stage("parse"):
+            if self.agent_client.structured:
+                # In-process clients return the agent payload already decoded
+                agent_reply = decode_payload(response).text
+            else:
+                if not response.strip():
+                    count_error(kind="empty_output")
+                    return {"response": "No output from agentcore", "error": True}
+                agent_reply = decode_agent_output(response).text
+
+        if not agent_reply:
+            count_error()
+            return {"response": "Could not parse response", "error": True}
+
+        # Clean up the text formatting
+        with timing.stage("clean"):
+            agent_reply = clean_agent_text(agent_reply)
+        if cacheable:
+            self.response_cache.set(user_prompt, agent_reply)
+        return {"response": agent_reply}
+
+    def streamed_reply(self, user_prompt, agent_reply, session=None, invoke_seconds=0.0):
+        """Record a reply that streamed without errors: session turn, history and cache"""
+        cacheable = self.cacheable(session)
+        if session is not None:
+            self.sessions.record_turn(session, invoke_seconds)
+        self.remember(session, user_prompt, agent_reply)
+        if cacheable:
+            self.response_cache.set(user_prompt, agent_reply)
+
+    def stats(self, admission, coalescing):
+        """Counters from startup, admission, credentials, cancellations, compression, WebSockets, the intent
+        router, the cache, coalescing, sessions, history and the agent"""
+        # calls are agent invocations started, coalesced the ones saved by sharing
+        stats = {
+            "startup": self.startup_stats(),
+            "admission": admission,
+            "credentials": self.credential_provider.stats(),
+            "cancellations": CANCELLATIONS.stats(),
+            "compression": COMPRESSIONS.stats(),
+            "websocket": SOCKETS.stats(),
+            "coalescing": coalescing,
+            "envelopes": {str(envelope): count for envelope, count in envelope_counts.items()},
+        }
+        if self.intent_router is not None:
+            # Messages answered locally, by intent, and the share of all messages they make up
+            stats["intents"] = self.intent_router.stats()
+        if self.response_cache is not None:
+            stats["cache"] = self.response_cache.stats()
+        if self.sessions is not None:
+            stats["sessions"] = self.sessions.stats()
+        if self.history is not None:
+            stats["history"] = self.history.stats()
+        if self.rate_limiter is not None:
+            stats["rate_limit"] = self.rate_limiter.stats()
+        if hasattr(self.agent_client, 'policy_stats'):
+            # Latency percentiles, hedging and circuit breaker state
+            stats["invocation"] = self.agent_client.policy_stats()
+        if hasattr(self.agent_client, 'transport_stats'):
+            # Fixtures recorded, or replayed and unmatched
+            stats["transport"] = self.agent_client.transport_stats()
+        if hasattr(self.agent_client, 'stats'):
+            # Worker pool utilization in pool mode
+            stats["agent_pool"] = self.agent_client.stats()
+        return stats
@@ -0,0 +1,237 @@
+"""WebSocket chat protocol: a whole conversation over one connection.
+
+The page opens /chat/ws once and sends each message on it as a JSON text
+frame, so a message costs one small frame rather than a request with its
+own headers (and, without keep-alive, its own TCP and TLS handshake).
+Every frame is a JSON object with a "type":
+
+client to server
+
+    {"type": "chat", "id": "7", "prompt": "...", "session_id": "...", "cache": false}
+    {"type": "cancel", "id": "7"}
+
+server to client
+
+    {"type": "ready", "heartbeat": 15, "max_chats": 4}   once, after the handshake
+    {"type": "status", "id": "7", "status": "queued", "waiting": 3}
+    {"type": "delta", "id": "7", "delta": "...", "cached": true}
+    {"type": "done", "id": "7", "session_id": "...", "server_timing": "queue;dur=0.4, ..."}
+    {"type": "error", "id": "7", "response": "...", "error": true, "retry_after": 1}
+    {"type": "heartbeat"}
+
+A done frame carries the chat's timed stages in the Server-Timing format,
+since a WebSocket has no headers per chat.
+
+Chats are multiplexed by an id the client picks: up to CHAT_WS_MAX_CHATS
+may be in flight on a connection and their frames interleave. Cancelling a
+chat, or closing the connection, stops its agent call the way a
+disconnecting HTTP client does. A heartbeat every CHAT_WS_HEARTBEAT seconds
+keeps proxies with idle timeouts from cutting a quiet connection and lets
+the page notice one that died; the server finds dead peers through the
+ASGI server's protocol-level pings.
+
+Only the ASGI app serves /chat/ws. The pages include CHAT_SOCKET_JS and
+fall back to POST /chat/stream when the socket cannot be opened, as
+against the Flask app.
+"""
+import json
+import os
+import threading
+
+WEBSOCKET = os.environ.get("CHAT_WEBSOCKET", "on") != "off"
+# Seconds between heartbeats; a page that hears nothing for 2.5 of them reconnects
+HEARTBEAT = float(os.environ.get("CHAT_WS_HEARTBEAT", "15"))
+# Chats one connection may have in flight at a time
+MAX_CHATS = int(os.environ.get("CHAT_WS_MAX_CHATS", "4"))
+
+
+class SocketStats:
+    """Connections, frames and chats served over WebSockets"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.connections = 0
+        self.chats = 0
+        self.cancelled = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.heartbeats = 0
+
+    def opened(self):
+        with self._lock:
+            self.open += 1
+            self.connections += 1
+
+    def closed(self):
+        with self._lock:
+            self.open -= 1
+
+    def received(self, chat=False):
+        with self._lock:
+            self.frames_in += 1
+            self.chats += int(chat)
+
+    def sent(self, heartbeat=False):
+        with self._lock:
+            self.frames_out += 1
+            self.heartbeats += int(heartbeat)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "connections": self.connections,
+                "chats": self.chats,
+                "cancelled": self.cancelled,
+                "frames_in": self.frames_in,
+                "frames_out": self.frames_out,
+                "heartbeats": self.heartbeats,
+            }
+
+
+SOCKETS = SocketStats()
+
+
+def socket_frame(kind, **fields):
+    """The text of one server-to-client frame"""
+    return json.dumps({"type": kind, **fields})
+
+
+def parse_frame(message):
+    """The JSON object in a websocket.receive message, or None when it is not one"""
+    text = message.get("text")
+    if text is None:
+        try:
+            text = (message.get("bytes") or b"").decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    try:
+        frame = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return frame if isinstance(frame, dict) else None
+
+
+CHAT_SOCKET_JS = r"""
+class ChatSocket {
+    constructor(path) {
+        const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.url = `${scheme}//${location.host}${path}`;
+        this.opening = null;
+        this.socket = null;
+        this.chats = new Map();
+        this.nextId = 1;
+        // Set when the first connection never opened: the server has no
+        // WebSocket endpoint, so every chat goes over HTTP
+        this.unavailable = false;
+        this.everOpened = false;
+        this.retryDelay = 1000;
+        this.retryAt = 0;
+        this.watchdog = 0;
+    }
+
+    // Resolves with the open socket; rejects while it cannot be opened
+    connect() {
+        if (this.unavailable || Date.now() < this.retryAt) {
+            return Promise.reject(this.transportError('WebSocket unavailable', false));
+        }
+        if (!this.opening) {
+            this.opening = new Promise((resolve, reject) => {
+                const socket = new WebSocket(this.url);
+                socket.onmessage = event => {
+                    const frame = JSON.parse(event.data);
+                    this.alive(socket, frame.heartbeat);
+                    if (frame.type === 'ready') {
+                        this.socket = socket;
+                        this.everOpened = true;
+                        this.retryDelay = 1000;
+                        resolve(socket);
+                    } else {
+                        this.dispatch(frame);
+                    }
+                };
+                socket.onclose = () => {
+                    // Runs once, whether the socket reported its close or the watchdog gave up on it
+                    socket.onmessage = socket.onclose = null;
+                    clearTimeout(this.watchdog);
+                    this.opening = null;
+                    this.socket = null;
+                    if (!this.everOpened) {
+                        this.unavailable = true;
+                    }
+                    // Reconnect on the next chat, backing off while the server stays away
+                    this.retryAt = Date.now() + this.retryDelay;
+                    this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+                    for (const chat of this.chats.values()) {
+                        chat.reject(this.transportError('Connection lost', chat.received));
+                    }
+                    this.chats.clear();
+                    reject(this.transportError('WebSocket closed', false));
+                };
+            });
+        }
+        return this.opening;
+    }
+
+    transportError(message, partial) {
+        const error = new Error(message);
+        error.transport = true;
+        // Part of the reply already arrived, so it cannot simply be retried
+        error.partial = partial;
+        return error;
+    }
+
+    // Any frame shows the connection is alive; after silence for 2.5 heartbeats
+    // it is dropped without waiting for a dead connection to finish closing
+    alive(socket, heartbeat) {
+        if (heartbeat) {
+            this.heartbeat = heartbeat * 1000;
+        }
+        clearTimeout(this.watchdog);
+        if (this.heartbeat) {
+            this.watchdog = setTimeout(() => {
+                socket.close();
+                if (socket.onclose) socket.onclose();
+            }, this.heartbeat * 2.5);
+        }
+    }
+
+    dispatch(frame) {
+        const chat = this.chats.get(frame.id);
+        if (!chat) return;
+        if (frame.type === 'delta') {
+            chat.received = true;
+            chat.onDelta(frame.delta);
+        } else if (frame.type === 'status') {
+            chat.onStatus(frame);
+        } else if (frame.type === 'done') {
+            this.chats.delete(frame.id);
+            chat.resolve(frame);
+        } else if (frame.type === 'error') {
+            this.chats.delete(frame.id);
+            const error = new Error(frame.response);
+            error.fromServer = true;
+            chat.reject(error);
+        }
+    }
+
+    // Resolves with the done frame (which carries the session id) once the reply is complete
+    chat(request, onDelta, onStatus = () => {}) {
+        return this.connect().then(socket => new Promise((resolve, reject) => {
+            if (socket !== this.socket) {
+                // Closed again before this chat could be sent
+                reject(this.transportError('WebSocket closed', false));
+                return;
+            }
+            const id = String(this.nextId++);
+            this.chats.set(id, { resolve, reject, onDelta, onStatus, received: false });
+            socket.send(JSON.stringify({ ...request, type: 'chat', id }));
+        }));
+    }
+}
+"""
@@ -0,0 +1,95 @@
+import json
+
+from agent_text import StreamingCleaner
+
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event carrying a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def parse_sse_event(event):
+    """Return (event name, payload) of an event formatted by sse_event"""
+    name, data = "message", {}
+    for line in event.splitlines():
+        if line.startswith("event: "):
+            name = line[7:]
+        elif line.startswith("data: "):
+            data = json.loads(line[6:])
+    return name, data
+
+
+def local_reply_events(reply, **fields):
+    """Yield a reply answered without the agent as a single delta followed by done"""
+    yield sse_event({"delta": reply, **fields})
+    yield sse_event({}, "done")
+
+
+def body_events(body):
+    """Yield a /chat response body answered without the agent (routed or cached) as delta and done events"""
+    return local_reply_events(body["response"], **{key: value for key, value in body.items() if key != "response"})
+
+
+def stream_reply_events(agent_client, prompt, credentials, on_reply=None, on_error=None, session_id=None):
+    """Invoke the agent and yield its cleaned reply as SSE delta events.
+
+    on_reply, if given, is called with the complete reply once it has
+    streamed without errors; on_error with the exception when it fails, or
+    with None when the agent produced nothing usable.
+    """
+    cleaner = StreamingCleaner()
+    parts = []
+    try:
+        for chunk in agent_client.invoke_stream(prompt, credentials, session_id):
+            text = cleaner.feed(chunk)
+            if text:
+                parts.append(text)
+                yield sse_event({"delta": text})
+        text = cleaner.finish()
+        if text:
+            parts.append(text)
+            yield sse_event({"delta": text})
+    except Exception as e:
+        if on_error is not None:
+            on_error(e)
+        yield sse_event({"response": f"Error: {str(e)}", "error": True}, "error")
+        return
+    if not parts:
+        if on_error is not None:
+            on_error(None)
+        yield sse_event({"response": "Could not parse response", "error": True}, "error")
+        return
+    if on_reply is not None:
+        on_reply("".join(parts))
+    yield sse_event({}, "done")
+
+
+async def stream_reply_events_async(agent_client, prompt, credentials, on_reply=None, on_error=None,
+                                    session_id=None):
+    """Async counterpart of stream_reply_events for the ASGI app"""
+    cleaner = StreamingCleaner()
+    parts = []
+    try:
+        async for chunk in agent_client.invoke_stream_async(prompt, credentials, session_id):
+            text = cleaner.feed(chunk)
+            if text:
+                parts.append(text)
+                yield sse_event({"delta": text})
+        text = cleaner.finish()
+        if text:
+            parts.append(text)
+            yield sse_event({"delta": text})
+    except Exception as e:
+        if on_error is not None:
+            on_error(e)
+        yield sse_event({"response": f"Error: {str(e)}", "error": True}, "error")
+        return
+    if not parts:
+        if on_error is not None:
+            on_error(None)
+        yield sse_event({"response": "Could not parse response", "error": True}, "error")
+        return
+    if on_reply is not None:
+        on_reply("".join(parts))
+    yield sse_event({}, "done")
@@ -0,0 +1,322 @@
+"""Single-flight coalescing of identical in-flight prompts.
+
+Concurrent requests whose normalized prompt, scope and runtime session match
+share one agent invocation: the first caller runs it and everyone else waits
+for the same result, or the same exception. Streams are fanned out the same
+way, with late joiners replaying the events produced so far. Prompts in
+different runtime sessions carry different conversations, so they are never
+shared.
+
+A shared call runs under a SharedDeadline joined by the deadline of every
+request waiting for it. A request whose deadline fires stops waiting, and
+the call itself is cancelled only once no request is left waiting.
+"""
+import asyncio
+import functools
+import logging
+import threading
+
+from admission import Overloaded
+from deadlines import DISCONNECT_POLL, SharedDeadline, current_deadline, deadline_scope, error_for
+from response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+def _leave(deadline):
+    # A waiter that stops early has given up for good, even once a stream
+    # has started and only disconnects count
+    if deadline is not None:
+        deadline.cancel(deadline.fired() or "disconnect")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.deadline = SharedDeadline()
+        self.result = None
+        self.error = None
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.deadline = SharedDeadline()
+        self.events = []
+        self.finished = False
+        self.error = None
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    def subscribe(self, deadline=None):
+        seen = 0
+        finished = False
+        try:
+            while True:
+                with self.cond:
+                    while len(self.events) <= seen and not self.finished:
+                        if deadline is None:
+                            self.cond.wait()
+                        elif not self.cond.wait(DISCONNECT_POLL):
+                            # The time budget only covers the wait for the first event
+                            deadline.check(budget=not self.events)
+                    events = self.events[seen:]
+                    finished, error = self.finished, self.error
+                yield from events
+                seen += len(events)
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            if not finished:
+                _leave(deadline)
+
+
+class SingleFlight:
+    """Shares one in-flight call among threads asking for the same prompt"""
+
+    def __init__(self, scope=""):
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._streams = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def key(self, prompt, session=None):
+        return f"{self.scope}\x00{session or ''}\x00{normalize_prompt(prompt)}"
+
+    def do(self, prompt, fn, session=None):
+        """Return fn(), or the result of an identical call already in flight"""
+        key = self.key(prompt, session)
+        deadline = current_deadline()
+        with self._lock:
+            flight = self._flights.get(key)
+            # A call everyone has given up on is being cancelled; start afresh
+            leader = flight is None or flight.deadline.fired() is not None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.deadline.join(deadline)
+        if not leader:
+            while not flight.done.wait(None if deadline is None else DISCONNECT_POLL):
+                deadline.check()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            with deadline_scope(flight.deadline):
+                flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stream(self, prompt, produce, session=None):
+        """Yield the events of produce(), run once for identical concurrent prompts.
+
+        The producer runs on its own thread so a subscriber going away does
+        not cut the stream short for the others.
+        """
+        key = self.key(prompt, session)
+        deadline = current_deadline()
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None or flight.deadline.fired() is not None:
+                flight = self._streams[key] = _StreamFlight()
+                self.calls += 1
+                threading.Thread(target=self._pump, args=(key, flight, produce), daemon=True).start()
+            else:
+                self.coalesced += 1
+            flight.deadline.join(deadline)
+        return flight.subscribe(deadline)
+
+    def _pump(self, key, flight, produce):
+        error = None
+        try:
+            with deadline_scope(flight.deadline):
+                for event in produce():
+                    # Once the stream has started only disconnects stop it
+                    flight.deadline.budget = False
+                    flight.publish(event)
+        except Overloaded as e:
+            # Not admitted; every subscriber gets the rejection
+            error = e
+        except Exception as e:
+            error = e
+            self.errors += 1
+            logger.exception("Coalesced stream failed")
+        finally:
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            flight.finish(error)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "errors": self.errors}
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.deadline = SharedDeadline()
+        self.task = None
+
+    def leave(self, deadline):
+        """Stop waiting; the call is cancelled once every waiter has"""
+        _leave(deadline)
+        if self.deadline.fired():
+            self.task.cancel()
+
+
+class _AsyncStreamFlight(_AsyncFlight):
+    def __init__(self):
+        super().__init__()
+        self.cond = asyncio.Condition()
+        self.events = []
+        self.finished = False
+        self.error = None
+
+    async def publish(self, event):
+        async with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    async def finish(self, error=None):
+        async with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    async def subscribe(self, deadline=None):
+        seen = 0
+        finished = False
+        try:
+            while True:
+                async with self.cond:
+                    # The time budget only covers the wait for the first event
+                    timeout = deadline.remaining() if deadline is not None and not self.events else None
+                    try:
+                        await asyncio.wait_for(self.cond.wait_for(lambda: len(self.events) > seen or self.finished),
+                                               timeout)
+                    except asyncio.TimeoutError:
+                        deadline.cancel("deadline")
+                        raise error_for("deadline") from None
+                    events = self.events[seen:]
+                    finished, error = self.finished, self.error
+                for event in events:
+                    yield event
+                seen += len(events)
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            if not finished:
+                self.leave(deadline)
+
+
+class AsyncSingleFlight:
+    """Event-loop counterpart of SingleFlight for the ASGI app"""
+
+    def __init__(self, scope=""):
+        self.scope = scope
+        self._flights = {}
+        self._streams = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def key(self, prompt, session=None):
+        return f"{self.scope}\x00{session or ''}\x00{normalize_prompt(prompt)}"
+
+    async def do(self, prompt, fn, session=None):
+        """Await fn(), or the result of an identical call already in flight.
+
+        The call runs as its own task, so a waiter being cancelled (say, its
+        client disconnecting) does not cancel it for the others; it is
+        cancelled when the last waiter goes.
+        """
+        key = self.key(prompt, session)
+        deadline = current_deadline()
+        flight = self._flights.get(key)
+        if flight is None or flight.deadline.fired() is not None:
+            flight = self._flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(self._run(flight.deadline, fn))
+            flight.task.add_done_callback(functools.partial(self._finish, key, flight))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        flight.deadline.join(deadline)
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task),
+                                          None if deadline is None else deadline.remaining())
+        except asyncio.TimeoutError:
+            if flight.task.done():
+                # The call's own timeout, not this waiter's
+                raise
+            flight.leave(deadline)
+            raise error_for("deadline") from None
+        except asyncio.CancelledError:
+            flight.leave(deadline)
+            raise
+
+    async def _run(self, deadline, fn):
+        with deadline_scope(deadline):
+            return await fn()
+
+    def _finish(self, key, flight, task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stream(self, prompt, produce, session=None):
+        """Async-iterate the events of produce(), run once for identical concurrent prompts"""
+        key = self.key(prompt, session)
+        deadline = current_deadline()
+        flight = self._streams.get(key)
+        if flight is None or flight.deadline.fired() is not None:
+            flight = self._streams[key] = _AsyncStreamFlight()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, produce))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        flight.deadline.join(deadline)
+        return flight.subscribe(deadline)
+
+    async def _pump(self, key, flight, produce):
+        error = None
+        try:
+            with deadline_scope(flight.deadline):
+                async for event in produce():
+                    flight.deadline.budget = False
+                    await flight.publish(event)
+        except Exception as e:
+            error = e
+            self.errors += 1
+        finally:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            await flight.finish(error)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "errors": self.errors}
@@ -0,0 +1,147 @@
+"""Content-negotiated gzip/brotli compression of chat responses.
+
+/chat replies are compressed whole, for clients whose Accept-Encoding allows
+it, once they reach CHAT_COMPRESS_MIN_BYTES; a smaller body already fits in
+one TCP segment, so shrinking it saves no round trip. Streams (SSE and NDJSON) cannot be sized up front, so
+they are always compressed, one chunk at a time: each chunk is flushed as
+soon as it has been compressed, so the browser can decode every event the
+moment it arrives. The compressor keeps its window across chunks, so later
+events that repeat earlier text still compress well.
+
+Brotli is used when the brotli package is installed and the client accepts
+it, gzip otherwise.
+"""
+import os
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from static_page import accepted_encodings
+
+COMPRESSION = os.environ.get("CHAT_COMPRESSION", "on") != "off"
+# Smaller /chat bodies are sent as they are (the default stays under one TCP segment)
+MIN_BYTES = int(os.environ.get("CHAT_COMPRESS_MIN_BYTES", "1024"))
+# Replies are compressed once per request, so favour speed over ratio
+GZIP_LEVEL = int(os.environ.get("CHAT_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("CHAT_BROTLI_QUALITY", "5"))
+
+
+class CompressionStats:
+    """Bytes before and after compression, per content coding"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = {}
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def count(self, encoding):
+        with self._lock:
+            self.responses[encoding] = self.responses.get(encoding, 0) + 1
+
+    def add(self, bytes_in, bytes_out):
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.responses,
+                "skipped": self.skipped,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+            }
+
+
+COMPRESSIONS = CompressionStats()
+
+
+def choose_encoding(accept_encoding, enabled=COMPRESSION):
+    """The content coding to send a response in, or None to send it uncompressed"""
+    if not enabled:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    """Compress a whole response body"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return zlib.compress(body, GZIP_LEVEL, wbits=31)
+
+
+class StreamCompressor:
+    """Compresses a response stream chunk by chunk, flushing after each one"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        COMPRESSIONS.count(encoding)
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits=31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        """Compressed bytes for `chunk`, complete enough to decode everything sent so far"""
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        if self.encoding == "br":
+            block = self._compressor.process(chunk) + self._compressor.flush()
+        else:
+            block = self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        COMPRESSIONS.add(len(chunk), len(block))
+        return block
+
+    def finish(self):
+        """The end of the compressed stream"""
+        if self.encoding == "br":
+            block = self._compressor.finish()
+        else:
+            block = self._compressor.flush(zlib.Z_FINISH)
+        COMPRESSIONS.add(0, len(block))
+        return block
+
+
+def compress_body(body, accept_encoding, min_bytes=MIN_BYTES):
+    """Return (body, encoding) for a whole response; encoding is None when it is sent as it is"""
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    if len(body) < min_bytes:
+        COMPRESSIONS.skip()
+        return body, None
+    compressed = compress(body, encoding)
+    COMPRESSIONS.count(encoding)
+    COMPRESSIONS.add(len(body), len(compressed))
+    return compressed, encoding
+
+
+def compress_stream(chunks, encoding):
+    """Yield the chunks of a text stream compressed, one flushed block per chunk"""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        # The server closes this generator when the client goes away; pass that on
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,250 @@
+"""Request deadlines and cancellation of agent calls nobody is waiting for.
+
+Every /chat and /chat/stream request gets a Deadline. The one time budget,
+CHAT_REQUEST_DEADLINE, covers waiting for credentials and the agent
+invocation; for a stream it covers the wait for the first event. The
+deadline also fires when the client disconnects: the blocking apps poll
+the client's socket, and the ASGI app listens for http.disconnect.
+
+The deadline travels with the request in a context variable, so an agent
+client can stop a call once it fires. The CLI client then kills the
+agentcore process group, and the request's agent slot is released. A call
+shared by coalesced requests runs under a SharedDeadline, so it is only
+cancelled once every request waiting for it has given up.
+
+CANCELLATIONS counts the cancelled calls and estimates how much agent time
+they saved: how much longer calls that ran as long usually took to finish.
+"""
+import contextlib
+import contextvars
+import math
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+# Total seconds for credentials and the agent; defaults to the invoke timeout
+REQUEST_DEADLINE = float(os.environ.get("CHAT_REQUEST_DEADLINE", os.environ.get("AGENTCORE_INVOKE_TIMEOUT", "60")))
+# How often blocking waits check whether the deadline has fired
+DISCONNECT_POLL = float(os.environ.get("CHAT_DISCONNECT_POLL", "0.25"))
+# Completed call durations kept to estimate the time a cancellation saved
+DURATION_WINDOW = 200
+
+
+class RequestCancelled(Exception):
+    """Raised when an agent call is stopped because its request gave up"""
+
+    reason = "cancelled"
+
+
+class DeadlineExceeded(RequestCancelled, TimeoutError):
+    """Raised when a request's time budget runs out"""
+
+    reason = "deadline"
+
+
+class ClientDisconnected(RequestCancelled):
+    """Raised when the client went away before its reply was ready"""
+
+    reason = "disconnect"
+
+
+class Deadline:
+    """A request's time budget, and whether its client is still there.
+
+    gone, if given, is polled (at most every DISCONNECT_POLL seconds) to
+    find out whether the client disconnected; cancel() says so directly.
+    """
+
+    def __init__(self, budget=REQUEST_DEADLINE, gone=None, clock=time.monotonic):
+        self._clock = clock
+        self.expires = clock() + budget
+        self._gone = gone
+        self._polled = -math.inf
+        # Set once the request gives up for good
+        self.reason = None
+
+    def remaining(self):
+        return max(0.0, self.expires - self._clock())
+
+    def expired(self):
+        return self._clock() >= self.expires
+
+    def cancel(self, reason="disconnect"):
+        """Give up on the request: its client went away, or it stopped waiting"""
+        if self.reason is None:
+            self.reason = reason
+
+    def fired(self, budget=True):
+        """Why the request gave up: "disconnect", "deadline" (unless budget is False), or None"""
+        if self.reason is None and self._gone is not None:
+            now = self._clock()
+            if now - self._polled >= DISCONNECT_POLL:
+                self._polled = now
+                if self._gone():
+                    self.reason = "disconnect"
+        if self.reason is not None:
+            return self.reason
+        if budget and self.expired():
+            return "deadline"
+        return None
+
+    def check(self, budget=True):
+        """Raise ClientDisconnected or DeadlineExceeded once the deadline has fired"""
+        reason = self.fired(budget)
+        if reason is not None:
+            raise error_for(reason)
+
+
+class SharedDeadline(Deadline):
+    """The deadline of a call shared by coalesced requests: it fires once all of theirs have"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.deadlines = []
+        # Cleared once a stream has started; from then on only disconnects count
+        self.budget = True
+
+    def join(self, deadline):
+        with self._lock:
+            self.deadlines.append(deadline or Deadline(math.inf))
+
+    def remaining(self):
+        with self._lock:
+            return max((deadline.remaining() for deadline in self.deadlines), default=math.inf)
+
+    def cancel(self, reason="disconnect"):
+        with self._lock:
+            deadlines = list(self.deadlines)
+        for deadline in deadlines:
+            deadline.cancel(reason)
+
+    def fired(self, budget=True):
+        with self._lock:
+            deadlines = list(self.deadlines)
+        reasons = [deadline.fired(budget and self.budget) for deadline in deadlines]
+        if not reasons or None in reasons:
+            return None
+        return "disconnect" if "disconnect" in reasons else "deadline"
+
+
+class CallDeadline(Deadline):
+    """The deadline of one attempt at a call, which its caller may stop on its own.
+
+    Fires when the request's deadline does, or once cancelled: the invocation
+    policy cancels a losing hedge with "hedge" and an attempt that ran past
+    the adaptive timeout with "timeout".
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.reason = None
+
+    def remaining(self):
+        return math.inf if self.parent is None else self.parent.remaining()
+
+    def expired(self):
+        return self.parent is not None and self.parent.expired()
+
+    def fired(self, budget=True):
+        if self.reason is not None:
+            return self.reason
+        return None if self.parent is None else self.parent.fired(budget)
+
+
+def error_for(reason):
+    if reason == "deadline":
+        return DeadlineExceeded("The request ran out of time before the agent answered")
+    if reason == "disconnect":
+        return ClientDisconnected("The client disconnected before the agent answered")
+    error = RequestCancelled(f"The agent call was stopped ({reason})")
+    error.reason = reason
+    return error
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline():
+    """The deadline of the request being served, or None outside one"""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """Make `deadline` the current deadline for the calls made inside the block"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def remaining_time():
+    """Seconds left in the current request's budget, or None outside a request"""
+    deadline = _current.get()
+    remaining = math.inf if deadline is None else deadline.remaining()
+    return None if remaining == math.inf else remaining
+
+
+def check_deadline(budget=True):
+    """Raise if the current request's deadline has fired"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(budget)
+
+
+def client_gone(environ):
+    """Whether the client of a WSGI request has closed its connection"""
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # Readable with nothing to read means the peer closed the connection
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:
+        # TLS sockets cannot peek; keep serving
+        return False
+    except OSError:
+        return True
+
+
+class CancellationStats:
+    """Counts cancelled agent calls and estimates the agent time they saved"""
+
+    def __init__(self, window=DURATION_WINDOW):
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=window)
+        self.cancelled = {"disconnect": 0, "deadline": 0, "hedge": 0, "timeout": 0}
+        self.seconds_used = 0.0
+        self.seconds_saved = 0.0
+
+    def completed(self, seconds):
+        """Record how long a call that ran to the end took"""
+        with self._lock:
+            self._durations.append(seconds)
+
+    def record(self, reason, seconds, limit=math.inf):
+        """Record a call cancelled after `seconds`; it could have run until `limit` at most"""
+        with self._lock:
+            longer = [duration for duration in self._durations if duration > seconds]
+            # Expected time left for a call that has already run this long;
+            # nothing is claimed for calls slower than any seen so far
+            saved = sum(longer) / len(longer) - seconds if longer else 0.0
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            self.seconds_used += seconds
+            self.seconds_saved += min(saved, max(0.0, limit - seconds))
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.cancelled,
+                "agent_seconds_used": round(self.seconds_used, 3),
+                "agent_seconds_saved": round(self.seconds_saved, 3),
+            }
+
+
+CANCELLATIONS = CancellationStats()
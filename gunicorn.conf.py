@@ -0,0 +1,58 @@
+"""Production serving with gunicorn, which reads this file from the working directory.
+
+    gunicorn shopping_agentcore_chat_app:app
+    gunicorn shopping_agent_using_cloudscape:app
+    gunicorn -k uvicorn.workers.UvicornWorker shopping_agentcore_chat_app:asgi_app
+    gunicorn 'shopping_agentcore_chat_app:create_app()'
+
+The app is built and warmed up once in the master and the workers are forked
+from it, so they start warm and share its memory. The workers share one credential
+cache file, so only one of them runs the pybritive checkout. Each worker is
+recycled after a number of requests. A recycled worker stops accepting and
+finishes the chats it is serving, streams included, before it exits. A
+reload (kill -HUP on the master) replaces the workers the same way.
+"""
+import os
+import shutil
+import tempfile
+
+# One credential checkout for all workers, through a file in a private
+# directory that is removed when the server exits. Set before any project
+# import, since modules read their environment when they are imported.
+CREDENTIALS_DIR_PREFIX = "shopping-agent-credentials-"
+if not os.environ.get("CREDENTIALS_CACHE"):
+    os.environ["CREDENTIALS_CACHE"] = os.path.join(tempfile.mkdtemp(prefix=CREDENTIALS_DIR_PREFIX), "credentials.json")
+
+from agent_client import INVOKE_TIMEOUT  # noqa: E402
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 2))
+# Requests mostly wait on the agent, so each worker serves several on threads
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# The warm worker pool's processes belong to the process that started them,
+# so in pool mode each worker imports the app and starts its own
+preload_app = os.environ.get("AGENTCORE_INVOKE_MODE") != "pool"
+
+# Recycle workers, staggered so they do not all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+# A chat can wait up to INVOKE_TIMEOUT for an agent slot and as long again
+# for the agent; a stopping worker gets that long to finish it
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 2 * INVOKE_TIMEOUT + 10))
+timeout = graceful_timeout
+
+
+def post_worker_init(worker):
+    # Connections the master opened while warming up are not inherited, so a
+    # preloaded worker warms up again; its credentials are already cached
+    backend = getattr(worker.wsgi, "extensions", {}).get("chat_backend")
+    if worker.cfg.preload_app and backend is not None:
+        backend.warm_up()
+
+
+def on_exit(server):
+    directory = os.path.dirname(os.environ["CREDENTIALS_CACHE"])
+    if os.path.basename(directory).startswith(CREDENTIALS_DIR_PREFIX):
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,245 @@
+"""Persistent chat history in a local SQLite database.
+
+Every answered turn is queued by the request that produced it and written by
+a background thread, one transaction per batch of whatever has queued up
+meanwhile, so chat requests never wait on the disk. The database runs in WAL
+mode, so reading a page does not wait for the writer either.
+
+Pages are read newest first through the (conversation, created) index with
+a keyset cursor rather than an offset, so the latest page, and every page
+after it, costs the same with a handful of messages stored as with millions.
+
+    GET /history?session_id=...[&before=CURSOR][&limit=20]
+        {"messages": [...oldest to newest...], "before": CURSOR or null}
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+
+from sessions import is_session_id
+
+logger = logging.getLogger(__name__)
+
+# off disables the store; history also needs session affinity to name conversations
+HISTORY = os.environ.get("CHAT_HISTORY", "on") != "off"
+HISTORY_PATH = os.environ.get("CHAT_HISTORY_PATH", "chat_history.sqlite3")
+HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = 100
+# Most messages written in one transaction
+WRITE_BATCH = 500
+# Messages waiting to be written beyond this are dropped rather than block a request
+MAX_PENDING = 10000
+# Longest a read of the latest page waits for queued writes
+SYNC_TIMEOUT = 1.0
+
+
+class InvalidHistoryRequest(ValueError):
+    """Raised when a /history request is malformed"""
+
+
+def encode_cursor(created, message_id):
+    return f"{created!r}:{message_id}"
+
+
+def decode_cursor(cursor):
+    """Return (created, id) from a page cursor"""
+    try:
+        created, message_id = cursor.split(":")
+        return float(created), int(message_id)
+    except (AttributeError, ValueError):
+        raise InvalidHistoryRequest("Invalid history cursor") from None
+
+
+def parse_history_request(args):
+    """Return (session_id, before, limit) from /history query arguments"""
+    session_id = args.get("session_id")
+    if not is_session_id(session_id):
+        raise InvalidHistoryRequest("Please provide a valid session_id")
+    before = args.get("before") or None
+    if before is not None:
+        decode_cursor(before)
+    try:
+        limit = int(args.get("limit", HISTORY_PAGE_SIZE))
+    except ValueError:
+        raise InvalidHistoryRequest("limit must be an integer") from None
+    return session_id, before, max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+
+# Connections and the writer thread do not survive a fork, e.g. into the
+# workers of a preloading server; each child reopens its live stores
+_STORES = weakref.WeakSet()
+
+
+def _after_fork():
+    for store in list(_STORES):
+        store._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class HistoryStore:
+    """Chat messages per conversation, written in batches off the request path"""
+
+    def __init__(self, path=HISTORY_PATH, batch_size=WRITE_BATCH, max_pending=MAX_PENDING, clock=time.time):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._clock = clock
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        db = sqlite3.connect(path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY, conversation TEXT NOT NULL, role TEXT NOT NULL,"
+            " content TEXT NOT NULL, error INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        # The rowid is implicitly the last index column, so (created, id) keysets use it too
+        db.execute("CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation, created)")
+        db.close()
+        self._open()
+        _STORES.add(self)
+
+    def _open(self):
+        self._writer = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # WAL makes NORMAL safe against corruption; a power cut can only lose the last batches
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._reader = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue(self.max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self._thread = threading.Thread(target=self._write_loop, name="chat-history", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        if not self._closed:
+            self._open()
+
+    def record(self, conversation, role, content, error=False):
+        """Queue a message to be written; never blocks"""
+        with self._lock:
+            try:
+                self._queue.put_nowait((conversation, role, content, int(error), self._clock()))
+            except queue.Full:
+                self.dropped += 1
+                return
+            self.pending += 1
+
+    def record_turn(self, conversation, prompt, reply):
+        self.record(conversation, "user", prompt)
+        self.record(conversation, "agent", reply)
+
+    def _write_loop(self):
+        while True:
+            batch, waiters, closing = [], [], False
+            item = self._queue.get()
+            while True:
+                if item is None:
+                    closing = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                # Whatever queued up while the last batch was written goes in this one
+                if closing or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if closing:
+                return
+
+    def _write(self, batch):
+        try:
+            self._writer.execute("BEGIN")
+            self._writer.executemany(
+                "INSERT INTO messages (conversation, role, content, error, created) VALUES (?, ?, ?, ?, ?)", batch)
+            self._writer.execute("COMMIT")
+        except sqlite3.Error:
+            logger.exception("Writing %d history messages failed", len(batch))
+            if self._writer.in_transaction:
+                self._writer.execute("ROLLBACK")
+            with self._lock:
+                self.failed += len(batch)
+                self.pending -= len(batch)
+            return
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.pending -= len(batch)
+
+    def sync(self, timeout=SYNC_TIMEOUT):
+        """Wait until messages queued so far are written, or the timeout passes"""
+        if not self.pending:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def page(self, conversation, before=None, limit=HISTORY_PAGE_SIZE):
+        """Return up to `limit` messages older than the `before` cursor, and the cursor for the next page"""
+        if before is None:
+            # The latest page is what a reloaded tab shows, so include the last reply
+            self.sync()
+            sql = ("SELECT id, role, content, error, created FROM messages WHERE conversation = ?"
+                   " ORDER BY created DESC, id DESC LIMIT ?")
+            params = (conversation, limit + 1)
+        else:
+            created, message_id = decode_cursor(before)
+            sql = ("SELECT id, role, content, error, created FROM messages"
+                   " WHERE conversation = ? AND (created, id) < (?, ?)"
+                   " ORDER BY created DESC, id DESC LIMIT ?")
+            params = (conversation, created, message_id, limit + 1)
+        with self._read_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "messages": [{"id": row[0], "role": row[1], "content": row[2], "error": bool(row[3]), "created": row[4]}
+                         for row in reversed(rows)],
+            "before": encode_cursor(rows[-1][4], rows[-1][0]) if more else None,
+        }
+
+    def close(self):
+        """Write whatever is still queued and stop the writer"""
+        if self._closed or not self._thread.is_alive():
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self.pending, "written": self.written, "batches": self.batches,
+                    "dropped": self.dropped, "failed": self.failed}
+
+
+def make_history_store():
+    """Build the history store, or None when CHAT_HISTORY is off"""
+    if not HISTORY:
+        return None
+    store = HistoryStore()
+    # Messages still queued at shutdown are written before the process exits
+    atexit.register(store.close)
+    return store
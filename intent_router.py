@@ -0,0 +1,136 @@
+"""Local fast path for chat messages the agent is not needed for.
+
+Greetings, thanks, goodbyes and questions about what the assistant can do
+are a noticeable share of traffic, and each would otherwise cost a
+credential checkout and a full agent invocation. The router classifies a
+message with keyword rules, compiled into one pattern at import time, and
+answers the intents it recognises from a response table; everything else
+goes to the agent. A rule only matches a message that consists of nothing
+but, say, a greeting, so "hi, any earbuds under $100?" still reaches the
+agent.
+
+CHAT_INTENT_ROUTER=off sends every message to the agent, and so does
+"route": false in a request. CHAT_INTENT_RESPONSES names a JSON file
+({"greeting": "...", ...}) whose replies replace the default ones; an
+intent mapped to null is always passed through.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from response_cache import normalize_prompt
+
+INTENT_ROUTER = os.environ.get("CHAT_INTENT_ROUTER", "on") != "off"
+RESPONSES_PATH = os.environ.get("CHAT_INTENT_RESPONSES", "")
+# Longer messages always carry a question for the agent
+MAX_CHARS = 80
+
+# Matched against the whole normalized message (casefolded, punctuation folded away)
+_INTENT = re.compile(r"""
+    (?:(?:ok|okay|oh|well|hey|hi|hello)\ )?
+    (?:
+        (?P<greeting>
+            (?:hi|hello|hey|hiya|howdy|greetings|yo|good\ (?:morning|afternoon|evening|day))
+            (?:\ (?:there|all|everyone|assistant|bot|agent))?
+          | hey\ hey | hello\ hello
+        )
+      | (?P<thanks>
+            (?:(?:great|perfect|awesome|cool|nice|got\ it|that\ helps)\ )?
+            (?:thanks?|thank\ you|thankyou|thx|ty|cheers|much\ appreciated)
+            (?:\ (?:so\ much|a\ lot|very\ much|a\ bunch|again|for\ (?:the|your)\ help))?
+        )
+      | (?P<goodbye>
+            (?:bye|goodbye|bye\ bye|see\ you|see\ ya|good\ night|later|take\ care)
+            (?:\ (?:for\ now|then|later|soon))?
+        )
+      | (?P<help>
+            help(?:\ me)?
+          | (?:what|how)\ can\ you\ (?:do|help(?:\ me)?(?:\ with)?)
+          | what\ do\ you\ do | who\ are\ you | what\ are\ you
+          | how\ does\ this\ work | how\ do\ (?:i|you)\ use\ this
+          | what\ can\ i\ ask(?:\ you)?
+        )
+    )
+    (?:\ (?:please|pls|again))?
+""", re.VERBOSE)
+
+DEFAULT_RESPONSES = {
+    "greeting": "Hello! I'm your Amazon shopping assistant. Tell me what you're looking for and I'll find and "
+                "compare products for you.",
+    "thanks": "You're welcome! Let me know if there's anything else you'd like me to find.",
+    "goodbye": "Goodbye, and happy shopping!",
+    "help": "I can search for products, compare prices, features and reviews, and recommend options that fit "
+            "your budget. Try something like \"best wireless earbuds under $100\" or \"compare the Kindle "
+            "Paperwhite and the Kobo Clara\".",
+}
+
+
+def passthrough_requested(payload):
+    """True when a request asks for the agent even for a message the router would answer ("route": false)"""
+    return isinstance(payload, dict) and payload.get("route") is False
+
+
+def classify(prompt):
+    """The intent a whole message expresses, or None when it is for the agent"""
+    if not isinstance(prompt, str) or len(prompt) > MAX_CHARS:
+        return None
+    match = _INTENT.fullmatch(normalize_prompt(prompt))
+    return match.lastgroup if match else None
+
+
+class IntentRouter:
+    """Answers recognised intents from a response table and passes everything else through"""
+
+    def __init__(self, responses=None):
+        unknown = set(responses or ()) - set(DEFAULT_RESPONSES)
+        if unknown:
+            raise ValueError(f"Unknown intents in the response table: {', '.join(sorted(unknown))}")
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self._lock = threading.Lock()
+        self.answered = dict.fromkeys(DEFAULT_RESPONSES, 0)
+        self.passed = 0
+        self.bypassed = 0
+        self.seconds = 0.0
+
+    def route(self, prompt, passthrough=False):
+        """The local reply to a message, or None when it goes to the agent"""
+        if passthrough:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        start = time.perf_counter()
+        intent = classify(prompt)
+        reply = self.responses.get(intent) if intent is not None else None
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.seconds += seconds
+            if reply is None:
+                self.passed += 1
+            else:
+                self.answered[intent] += 1
+        return reply
+
+    def stats(self):
+        with self._lock:
+            answered = sum(self.answered.values())
+            routed = answered + self.passed
+            return {
+                **self.answered,
+                "passed": self.passed,
+                "bypassed": self.bypassed,
+                "hit_rate": answered / routed if routed else 0.0,
+                "mean_microseconds": self.seconds / routed * 1e6 if routed else 0.0,
+            }
+
+
+def make_intent_router(enabled=INTENT_ROUTER, responses_path=RESPONSES_PATH):
+    """Build the intent router with the configured response table, or None when it is off"""
+    if not enabled:
+        return None
+    responses = None
+    if responses_path:
+        with open(responses_path, encoding="utf-8") as f:
+            responses = json.load(f)
+    return IntentRouter(responses)
@@ -0,0 +1,462 @@
+"""Hedged requests, adaptive timeouts and a circuit breaker around an agent client.
+
+PolicyAgentClient keeps a window of recent invocation latencies. Once it
+has enough samples:
+
+- a call still running after the AGENTCORE_HEDGE_PERCENTILE latency gets a
+  second, hedged invocation; the first to succeed wins and the other is
+  stopped through its CallDeadline (see deadlines.py), which kills a CLI
+  subprocess, or, in async mode, by cancelling it, which also drops an HTTP
+  connection. SDK and blocking HTTP calls cannot be interrupted and finish
+  on their own thread. At most AGENTCORE_HEDGE_MAX_RATE of calls are hedged.
+- calls time out after AGENTCORE_TIMEOUT_FACTOR x the p99 latency, but never
+  sooner than AGENTCORE_MIN_TIMEOUT or later than AGENTCORE_INVOKE_TIMEOUT.
+  A timed-out call is stopped the same way as a losing hedge.
+
+Streams get both up to their first chunk, against a separate window of
+first-chunk latencies; once a chunk is on its way to the browser the
+stream is left alone.
+
+Only calls without a runtime session are hedged. A second invocation on a
+session would add the turn to its conversation twice, and a hedge sent to a
+session of its own would answer without the conversation's context.
+
+After AGENTCORE_BREAKER_FAILURES consecutive failures the breaker opens and
+calls fail fast for AGENTCORE_BREAKER_RESET seconds. Then one trial call is
+let through, and the breaker closes again if it succeeds.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from agent_client import INVOKE_TIMEOUT, AgentInvocationError
+from deadlines import CallDeadline, RequestCancelled, current_deadline, deadline_scope
+from metrics import error_type
+
+HEDGE_PERCENTILE = float(os.environ.get("AGENTCORE_HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_RATE = float(os.environ.get("AGENTCORE_HEDGE_MAX_RATE", "0.1"))
+# Never hedge sooner than this, however fast the agent usually is
+HEDGE_MIN_DELAY = float(os.environ.get("AGENTCORE_HEDGE_MIN_DELAY", "0.5"))
+TIMEOUT_FACTOR = float(os.environ.get("AGENTCORE_TIMEOUT_FACTOR", "3"))
+MIN_TIMEOUT = float(os.environ.get("AGENTCORE_MIN_TIMEOUT", "15"))
+BREAKER_FAILURES = int(os.environ.get("AGENTCORE_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("AGENTCORE_BREAKER_RESET", "30"))
+LATENCY_WINDOW = 200
+# Percentiles of fewer samples than this are not trusted
+MIN_SAMPLES = 20
+HEDGE_THREADS = 128
+
+# A stream that ended before its first chunk
+_END = object()
+
+
+class CircuitOpen(AgentInvocationError):
+    """Raised instead of invoking while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Agent is not responding, try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """Percentiles over the most recent successful invocation latencies"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._sorted = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        """Latency below which q percent of recent calls finished, or None"""
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            samples = self._sorted
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class CircuitBreaker:
+    """Fails fast after consecutive failures, probing again after a cool-down"""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET, clock=time.monotonic):
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go ahead now"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = self._clock()
+            waited = now - self.opened_at
+            if waited >= self.reset_after:
+                # Let one trial call through; another follows a cool-down
+                # later if that one never reports back
+                self.state = "half_open"
+                self.opened_at = now
+                return
+            self.rejected += 1
+            raise CircuitOpen(max(1.0, self.reset_after - waited))
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = self._clock()
+                self.opened += 1
+
+
+def _attempt(deadline, call, *args):
+    with deadline_scope(deadline):
+        return call(*args)
+
+
+async def _attempt_async(deadline, call, *args):
+    with deadline_scope(deadline):
+        return await call(*args)
+
+
+class PolicyAgentClient:
+    """Wraps an agent client with hedging, adaptive timeouts and a circuit breaker"""
+
+    def __init__(self, inner, hedge_percentile=HEDGE_PERCENTILE, hedge_max_rate=HEDGE_MAX_RATE,
+                 hedge_min_delay=HEDGE_MIN_DELAY, timeout_factor=TIMEOUT_FACTOR, min_timeout=MIN_TIMEOUT,
+                 max_timeout=INVOKE_TIMEOUT, breaker=None):
+        self.inner = inner
+        self.structured = inner.structured
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_rate = hedge_max_rate
+        self.hedge_min_delay = hedge_min_delay
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyWindow()
+        self.first_chunk_latency = LatencyWindow()
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="agent-hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def __getattr__(self, name):
+        # stats(), close() and the like come from the wrapped client
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def timeout(self, window=None):
+        """Current adaptive timeout in seconds"""
+        p99 = (window or self.latency).percentile(99)
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, window=None):
+        """Seconds to wait before hedging a call, or None to never hedge it"""
+        if not self.hedge_max_rate:
+            return None
+        threshold = (window or self.latency).percentile(self.hedge_percentile)
+        return None if threshold is None else max(self.hedge_min_delay, threshold)
+
+    def _plan(self, session_id, window):
+        """Return (timeout, hedge delay or None)"""
+        if session_id is not None:
+            # Any turn of a session, first or not, is invoked once: this
+            # process cannot tell whether another one already started it
+            return self.timeout(window), None
+        return self.timeout(window), self.hedge_delay(window)
+
+    def _start(self):
+        self.breaker.before_call()
+        with self._lock:
+            self.calls += 1
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedges >= self.calls * self.hedge_max_rate:
+                return False
+            self.hedges += 1
+            return True
+
+    def _finish(self, window, seconds, hedge_won):
+        # Timed from the primary's start even when the hedge won, so the
+        # window keeps seeing how slow the primary was at least
+        window.record(seconds)
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def _fail(self, error):
+        if isinstance(error, RequestCancelled):
+            # The request gave up; that says nothing about the agent
+            return
+        if error_type(error) == "timeout":
+            with self._lock:
+                self.timeouts += 1
+        self.breaker.record_failure()
+
+    def invoke(self, prompt, credentials, session_id=None):
+        self._start()
+        timeout, delay = self._plan(session_id, self.latency)
+        start = time.perf_counter()
+        try:
+            if delay is None and timeout >= self.max_timeout:
+                # Nothing to race against; the client's own timeout applies
+                result, hedge_won = self.inner.invoke(prompt, credentials, session_id), False
+            else:
+                call = functools.partial(self.inner.invoke, prompt, credentials)
+                result, hedge_won = self._race(call, session_id, timeout, delay)
+        except Exception as e:
+            self._fail(e)
+            raise
+        self._finish(self.latency, time.perf_counter() - start, hedge_won)
+        self.breaker.record_success()
+        return result
+
+    def _race(self, call, session_id, timeout, delay, discard=None):
+        """Run call(session_id), hedged with a second call after `delay`; return (result, hedge won).
+
+        discard, if given, is handed the result of a call that lost.
+        """
+        parent = current_deadline()
+        deadline = time.monotonic() + timeout
+        hedge_at = None if delay is None else time.monotonic() + delay
+        attempts = {}
+
+        def launch(session):
+            # Each call runs in the request's context, under a deadline of its own
+            attempt = CallDeadline(parent)
+            future = self._executor.submit(contextvars.copy_context().run, _attempt, attempt, call, session)
+            attempts[future] = attempt
+            return future
+
+        primary = launch(session_id)
+        pending = {primary}
+        winner = error = reason = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    reason = "timeout"
+                    break
+                wait_until = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = wait(pending, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        winner, reason = future, "hedge"
+                        return future.result(), future is not primary
+                    error = error or future.exception()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    # A hedge is for a slow call, not a retry of a failed one
+                    if pending and self._take_hedge():
+                        pending.add(launch(session_id))
+            if error is not None and not pending:
+                raise error
+            raise TimeoutError(f"Agent did not answer within {timeout:.1f}s")
+        finally:
+            # Stop the losers: a CLI call notices within DISCONNECT_POLL and
+            # kills its process group, so it does not outlive the request's slot.
+            # Without a reason of their own they already stop with the request.
+            for future, attempt in attempts.items():
+                if future is winner:
+                    continue
+                if reason is not None:
+                    attempt.cancel(reason)
+                if discard is not None:
+                    future.add_done_callback(
+                        lambda f: discard(f.result()) if not f.cancelled() and f.exception() is None else None)
+
+    async def invoke_async(self, prompt, credentials, session_id=None):
+        self._start()
+        timeout, delay = self._plan(session_id, self.latency)
+        start = time.perf_counter()
+        try:
+            call = functools.partial(self.inner.invoke_async, prompt, credentials)
+            result, hedge_won = await self._race_async(call, session_id, timeout, delay)
+        except Exception as e:
+            self._fail(e)
+            raise
+        self._finish(self.latency, time.perf_counter() - start, hedge_won)
+        self.breaker.record_success()
+        return result
+
+    async def _race_async(self, call, session_id, timeout, delay, discard=None):
+        """Async counterpart of _race; discard is awaited"""
+        loop = asyncio.get_running_loop()
+        parent = current_deadline()
+        deadline = loop.time() + timeout
+        hedge_at = None if delay is None else loop.time() + delay
+        attempts = {}
+
+        def launch(session):
+            attempt = CallDeadline(parent)
+            task = asyncio.ensure_future(_attempt_async(attempt, call, session))
+            attempts[task] = attempt
+            return task
+
+        primary = launch(session_id)
+        pending = {primary}
+        winner = error = reason = None
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    reason = "timeout"
+                    break
+                wait_until = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=wait_until - now,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner, reason = task, "hedge"
+                        return task.result(), task is not primary
+                    error = error or task.exception()
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if pending and self._take_hedge():
+                        pending.add(launch(session_id))
+            if error is not None and not pending:
+                raise error
+            raise TimeoutError(f"Agent did not answer within {timeout:.1f}s")
+        finally:
+            # Cancelling kills the loser's subprocess or drops its connection
+            losers = [task for task in attempts if task is not winner]
+            for task in losers:
+                if reason is not None:
+                    attempts[task].cancel(reason)
+                task.cancel()
+            if discard is not None and losers:
+                for result in await asyncio.gather(*losers, return_exceptions=True):
+                    if not isinstance(result, BaseException):
+                        await discard(result)
+
+    def _open_stream(self, prompt, credentials, session_id):
+        """Start a stream and wait for its first chunk; return (chunks, first chunk or _END)"""
+        chunks = self.inner.invoke_stream(prompt, credentials, session_id)
+        try:
+            return chunks, next(chunks, _END)
+        except BaseException:
+            chunks.close()
+            raise
+
+    async def _open_stream_async(self, prompt, credentials, session_id):
+        chunks = self.inner.invoke_stream_async(prompt, credentials, session_id)
+        try:
+            return chunks, await anext(chunks, _END)
+        except BaseException:
+            await chunks.aclose()
+            raise
+
+    def invoke_stream(self, prompt, credentials, session_id=None):
+        self._start()
+        timeout, delay = self._plan(session_id, self.first_chunk_latency)
+        start = time.perf_counter()
+        try:
+            if delay is None and timeout >= self.max_timeout:
+                (chunks, first), hedge_won = self._open_stream(prompt, credentials, session_id), False
+            else:
+                call = functools.partial(self._open_stream, prompt, credentials)
+                (chunks, first), hedge_won = self._race(call, session_id, timeout, delay,
+                                                        discard=lambda opened: opened[0].close())
+        except Exception as e:
+            self._fail(e)
+            raise
+        # From here on the reply is on its way to the browser, so it is neither hedged nor timed out
+        self._finish(self.first_chunk_latency, time.perf_counter() - start, hedge_won)
+        try:
+            if first is not _END:
+                yield first
+                yield from chunks
+        except Exception as e:
+            self._fail(e)
+            raise
+        finally:
+            chunks.close()
+        self.breaker.record_success()
+
+    async def invoke_stream_async(self, prompt, credentials, session_id=None):
+        self._start()
+        timeout, delay = self._plan(session_id, self.first_chunk_latency)
+        start = time.perf_counter()
+        try:
+            call = functools.partial(self._open_stream_async, prompt, credentials)
+            (chunks, first), hedge_won = await self._race_async(call, session_id, timeout, delay,
+                                                                discard=lambda opened: opened[0].aclose())
+        except Exception as e:
+            self._fail(e)
+            raise
+        self._finish(self.first_chunk_latency, time.perf_counter() - start, hedge_won)
+        try:
+            if first is not _END:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+        except Exception as e:
+            self._fail(e)
+            raise
+        finally:
+            await chunks.aclose()
+        self.breaker.record_success()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if hasattr(self.inner, "close"):
+            self.inner.close()
+
+    def policy_stats(self):
+        with self._lock:
+            calls, hedges, hedge_wins, timeouts = self.calls, self.hedges, self.hedge_wins, self.timeouts
+        p50, p95, p99 = (self.latency.percentile(q) for q in (50, 95, 99))
+        first_p50, first_p95, first_p99 = (self.first_chunk_latency.percentile(q) for q in (50, 95, 99))
+        return {
+            "calls": calls,
+            "hedges": hedges,
+            "hedge_rate": hedges / calls if calls else 0.0,
+            "hedge_wins": hedge_wins,
+            "timeouts": timeouts,
+            "timeout_seconds": self.timeout(),
+            "stream_timeout_seconds": self.timeout(self.first_chunk_latency),
+            "latency_samples": len(self.latency),
+            "latency_p50": p50,
+            "latency_p95": p95,
+            "latency_p99": p99,
+            "first_chunk_samples": len(self.first_chunk_latency),
+            "first_chunk_p50": first_p50,
+            "first_chunk_p95": first_p95,
+            "first_chunk_p99": first_p99,
+            "breaker_state": self.breaker.state,
+            "breaker_open": int(self.breaker.state != "closed"),
+            "breaker_opened": self.breaker.opened,
+            "breaker_rejected": self.breaker.rejected,
+        }
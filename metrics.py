@@ -0,0 +1,204 @@
+"""Per-stage latency histograms and error counters, exported in the
+Prometheus text format, plus Server-Timing headers for single requests."""
+import asyncio
+import re
+import subprocess
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Agent calls run from milliseconds (stub, cache) to a minute or more
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_CAMEL_BOUNDARY = re.compile(r"(?<!^)(?=[A-Z])")
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A counter family with a single label"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value):
+        return self._values.get(label_value, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_value, value in values:
+            yield f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format_value(value)}'
+
+
+class Histogram:
+    """A histogram family with a single label and fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label value -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, label_value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, label_value):
+        series = self._series.get(label_value)
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((label_value, list(counts), total) for label_value, (counts, total) in self._series.items())
+        for label_value, counts, total in series:
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{label}}} {total!r}"
+            yield f"{self.name}_count{{{label}}} {cumulative}"
+
+
+class Registry:
+    """Holds metric families and renders them for a /metrics scrape"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, label):
+        return self._register(Counter(name, help, label))
+
+    def histogram(self, name, help, label, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, label, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, stats=None):
+        """Render every family, plus numeric entries of a /stats dict as gauges"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for group, values in (stats or {}).items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = _INVALID_NAME_CHARS.sub("_", f"shopping_chat_{group}_{key}")
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "shopping_chat_stage_seconds", "Time spent in each stage of a chat request", "stage")
+REQUESTS = REGISTRY.counter("shopping_chat_requests_total", "Chat requests received, by route", "route")
+ERRORS = REGISTRY.counter("shopping_chat_errors_total", "Failed chat requests, by error type", "type")
+
+
+def error_type(error):
+    """Bucket an exception into a low-cardinality error type label"""
+    if isinstance(error, (subprocess.TimeoutExpired, TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, subprocess.CalledProcessError):
+        return "called_process_error"
+    name = type(error).__name__
+    # e.g. botocore's ReadTimeoutError / ConnectTimeoutError
+    if "Timeout" in name:
+        return "timeout"
+    return _CAMEL_BOUNDARY.sub("_", name).lower()
+
+
+def count_error(error=None, kind=None):
+    """Count a failed request; error is None for replies that could not be parsed"""
+    if kind is None:
+        kind = "parse_failure" if error is None else error_type(error)
+    ERRORS.inc(kind)
+
+
+class _Stage:
+    __slots__ = ("timing", "name", "start", "seconds")
+
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = perf_counter() - self.start
+        self.timing.record(self.name, self.seconds)
+
+
+class RequestTiming:
+    """Times the stages of one request into STAGE_SECONDS.
+
+        with timing.stage("invoke"):
+            ...
+        response.headers["Server-Timing"] = timing.finish()
+    """
+
+    __slots__ = ("stages", "start")
+
+    def __init__(self):
+        self.stages = []
+        self.start = perf_counter()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+        STAGE_SECONDS.observe(seconds, name)
+
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def mark(self, name):
+        """Record the time from the start of the request to now"""
+        self.record(name, self.elapsed())
+
+    def header(self):
+        """The Server-Timing header value for the stages recorded so far"""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages)
+
+    def finish(self):
+        """Record the total and return the Server-Timing header value"""
+        self.mark("total")
+        return self.header()
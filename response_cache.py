@@ -0,0 +1,219 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# memory | disk; the cache is off when unset
+CACHE_BACKEND = os.environ.get("RESPONSE_CACHE", "")
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+
+# Punctuation is folded away, but currency and percent signs carry meaning
+_PUNCTUATION = re.compile(r"[^\w\s$€£¥%]+")
+
+
+def normalize_prompt(prompt):
+    """Fold case, punctuation and whitespace so near-identical prompts share a key"""
+    return " ".join(_PUNCTUATION.sub(" ", prompt.casefold()).split())
+
+
+def bypass_requested(payload, cache_control=None):
+    """True when a request asks for a fresh answer ("cache": false or Cache-Control: no-cache)"""
+    return payload.get("cache") is False or "no-cache" in (cache_control or "")
+
+
+class MemoryCacheBackend:
+    """In-process LRU bounded by entry count and total reply bytes"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if self._clock() >= expires:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, self._clock() + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# A connection must not be used across a fork; a preloading server's workers
+# each reconnect their live backends, and share the entries through the file
+_DISK_BACKENDS = weakref.WeakSet()
+
+
+def _after_fork():
+    for backend in list(_DISK_BACKENDS):
+        backend._connect()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class DiskCacheBackend:
+    """Local SQLite-backed LRU, so cached replies survive restarts"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self._clock = clock
+        self._connect()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.evictions = 0
+        self.expirations = 0
+        _DISK_BACKENDS.add(self)
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = self._clock()
+            if now >= row[1]:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expirations += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = self._clock()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now),
+            )
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            while count > self.max_entries or total > self.max_bytes:
+                oldest = self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed LIMIT 1").fetchone()
+                self._db.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                count -= 1
+                total -= oldest[1]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """Caches cleaned agent replies keyed on the normalized prompt"""
+
+    def __init__(self, backend, ttl=CACHE_TTL, scope=""):
+        self.backend = backend
+        self.ttl = ttl
+        self.scope = scope
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, prompt):
+        return f"{self.scope}\x00{normalize_prompt(prompt)}"
+
+    def get(self, prompt):
+        """Return the cached reply for a prompt, or None"""
+        reply = self.backend.get(self.key(prompt))
+        if reply is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return reply
+
+    def set(self, prompt, reply, ttl=None):
+        self.backend.set(self.key(prompt), reply, self.ttl if ttl is None else ttl)
+
+    def invalidate(self, prompt=None):
+        """Drop the entry for one prompt, or every entry when no prompt is given"""
+        if prompt is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(self.key(prompt))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "expirations": self.backend.expirations,
+            "entries": len(self.backend),
+        }
+
+
+def make_response_cache(backend=CACHE_BACKEND, scope=""):
+    """Build the configured response cache, or None when caching is off"""
+    if not backend:
+        return None
+    if backend == "memory":
+        return ResponseCache(MemoryCacheBackend(), scope=scope)
+    if backend == "disk":
+        return ResponseCache(DiskCacheBackend(), scope=scope)
+    raise ValueError(f"Unknown response cache backend: {backend}")
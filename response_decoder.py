@@ -0,0 +1,106 @@
+import codecs
+import json
+import re
+from collections import Counter, namedtuple
+
+DecodedReply = namedtuple("DecodedReply", "text envelope")
+
+# How often each envelope format was matched, to measure the fallback paths
+envelope_counts = Counter()
+
+_RESPONSE_ARRAY = re.compile(r'"response"\s*:\s*\[')
+_TEXT_FIELD = re.compile(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_STRUCTURAL_CHARS = re.compile(r'[{}\[\]"]')
+_json_decoder = json.JSONDecoder()
+
+
+def payload_text(data):
+    """Return the text of a decoded agent payload, joining result.content[*].text"""
+    if not isinstance(data, dict):
+        return None
+    if "text" in data:
+        return data["text"]
+    result = data.get("result")
+    if isinstance(result, dict) and isinstance(result.get("content"), list):
+        texts = [item["text"] for item in result["content"]
+                 if isinstance(item, dict) and isinstance(item.get("text"), str)]
+        if texts:
+            return "".join(texts)
+    return None
+
+
+def is_bytes_literal(item):
+    return isinstance(item, str) and len(item) >= 3 and item[0] == "b" and item[1] in "'\"" and item[-1] == item[1]
+
+
+def decode_bytes_literal(item):
+    """Turn the repr of a bytes body (b'...') back into its bytes in one pass"""
+    return codecs.escape_decode(item[2:-1].encode("utf-8"))[0]
+
+
+def _decode_response_items(items, envelope):
+    if not items:
+        return DecodedReply(None, None)
+    item = items[0]
+    if isinstance(item, dict):
+        return DecodedReply(payload_text(item), envelope)
+    if not is_bytes_literal(item):
+        return DecodedReply(None, None)
+    body = decode_bytes_literal(item)
+    try:
+        return DecodedReply(payload_text(json.loads(body)), envelope)
+    except ValueError:
+        # Truncated or otherwise broken body: salvage the first text field
+        match = _TEXT_FIELD.search(body.decode("utf-8", "replace"))
+        if match:
+            try:
+                return DecodedReply(json.loads(f'"{match.group(1)}"'), "text_field")
+            except ValueError:
+                return DecodedReply(match.group(1), "text_field")
+    return DecodedReply(None, None)
+
+
+def _decode_payload(data):
+    if isinstance(data, dict) and isinstance(data.get("response"), list):
+        reply = _decode_response_items(data["response"], "bytes_literal")
+        if reply.text:
+            return reply
+    text = payload_text(data)
+    return DecodedReply(text, "result" if text else None)
+
+
+def decode_payload(data):
+    """Decode an agent payload already parsed from JSON, e.g. from an in-process client"""
+    reply = _decode_payload(data)
+    envelope_counts[reply.envelope] += 1
+    return reply
+
+
+def decode_agent_output(output):
+    """Decode agentcore output and report which envelope format matched.
+
+    Handles a bare agent payload, the CLI {"response": ["b'...'"]} envelope
+    (whether the whole output is JSON or it is embedded in other text) and
+    short plain-text replies. Each layer is unescaped exactly once.
+    """
+    reply = DecodedReply(None, None)
+    try:
+        data = json.loads(output)
+    except ValueError:
+        match = _RESPONSE_ARRAY.search(output)
+        if match:
+            try:
+                items, _ = _json_decoder.raw_decode(output, match.end() - 1)
+            except ValueError:
+                items = None
+            if isinstance(items, list):
+                reply = _decode_response_items(items, "embedded_bytes_literal")
+    else:
+        reply = _decode_payload(data)
+
+    if not reply.text and len(output) < 500 and not _STRUCTURAL_CHARS.search(output) and output.strip():
+        reply = DecodedReply(output.strip(), "plain_text")
+
+    envelope_counts[reply.envelope if reply.text else None] += 1
+    return reply if reply.text else DecodedReply(None, None)
+
@@ -0,0 +1,172 @@
+"""Affinity between browser chat sessions and agent runtime sessions.
+
+Each browser tab sends the session id it was handed on its first message;
+the registry maps it to a runtime session id that is passed on every
+invocation, so follow-up questions reach a runtime that already holds the
+conversation instead of a cold one. Sessions idle for longer than
+CHAT_SESSION_IDLE_TIMEOUT are forgotten, and once CHAT_SESSION_MAX are live
+the least recently used one is dropped.
+"""
+import hashlib
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# off disables affinity: every message then goes to a fresh runtime session
+SESSION_AFFINITY = os.environ.get("CHAT_SESSION_AFFINITY", "on") != "off"
+# AgentCore stops an idle runtime session after 15 minutes by default
+SESSION_IDLE_TIMEOUT = float(os.environ.get("CHAT_SESSION_IDLE_TIMEOUT", "900"))
+SESSION_MAX = int(os.environ.get("CHAT_SESSION_MAX", "1000"))
+SESSION_HEADER = "X-Chat-Session-Id"
+
+TURN_SECONDS = REGISTRY.histogram(
+    "shopping_chat_session_turn_seconds",
+    "Time for the agent to answer a chat turn, on a new (cold) or established (warm) runtime session", "turn")
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def is_session_id(session_id):
+    """Whether a browser-supplied session id is well-formed"""
+    return isinstance(session_id, str) and _SESSION_ID.match(session_id) is not None
+
+
+def derive_runtime_session_id(session_id):
+    # Derived rather than random, so every worker process of the server (and
+    # one that replaced a recycled worker) routes a browser session to the
+    # same runtime session. AgentCore requires at least 33 characters.
+    return hashlib.sha256(f"runtime-session:{session_id}".encode("utf-8")).hexdigest()[:40]
+
+
+def runtime_session_id(session):
+    """The runtime session id to invoke with, or None without affinity"""
+    return None if session is None else session.runtime_session_id
+
+
+def is_warm(session):
+    return session is not None and session.turns > 0
+
+
+def is_new_conversation(session):
+    """Whether a request starts a conversation: no affinity, or a session just issued to it.
+
+    A request naming a session id may be a follow-up even when this process
+    has not seen a turn on it: another worker, or this one before a restart,
+    may have answered the earlier turns.
+    """
+    return session is None or session.new
+
+
+class ChatSession:
+    __slots__ = ("id", "runtime_session_id", "turns", "last_used", "issued", "new")
+
+    def __init__(self, session_id, runtime_session_id, now, issued=False):
+        self.id = session_id
+        self.runtime_session_id = runtime_session_id
+        self.turns = 0
+        self.last_used = now
+        # The server made the id up, rather than taking one a client sent
+        self.issued = issued
+        # Issued to the request being served, until a request names it
+        self.new = issued
+
+
+class SessionRegistry:
+    """Maps browser session ids to runtime sessions, with idle expiry and a cap"""
+
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=SESSION_MAX, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Least recently used first
+        self._sessions = OrderedDict()
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.warm_turns = 0
+        self.cold_turns = 0
+
+    def resolve(self, session_id):
+        """Return the live session for a browser session id.
+
+        Malformed ids are replaced by a new one. A well-formed id is kept so
+        the browser does not have to switch, and one this process does not
+        know (yet, or any more) maps to the runtime session derived from it.
+        """
+        now = self._clock()
+        if not is_session_id(session_id):
+            session_id = None
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                issued = not session_id
+                session_id = session_id or secrets.token_urlsafe(24)
+                session = ChatSession(session_id, derive_runtime_session_id(session_id), now, issued)
+                self._sessions[session.id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._sessions.move_to_end(session_id)
+                session.last_used = now
+                session.new = False
+                self.resumed += 1
+            return session
+
+    def knows(self, session_id):
+        """Whether session_id names a live session this server issued, not one a client chose"""
+        if not is_session_id(session_id):
+            return False
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session is not None and session.issued and self._clock() - session.last_used < self.idle_timeout
+
+    def _expire(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used < self.idle_timeout:
+                return
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def record_turn(self, session, seconds=None):
+        """Count an answered turn; the session is warm from then on.
+
+        seconds is the agent's time, or None for a turn answered from the cache.
+        """
+        turn = "warm" if session.turns else "cold"
+        if seconds is not None:
+            TURN_SECONDS.observe(seconds, turn)
+        with self._lock:
+            if session.turns:
+                self.warm_turns += 1
+            else:
+                self.cold_turns += 1
+            session.turns += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live": len(self._sessions),
+                "max": self.max_sessions,
+                "created": self.created,
+                "resumed": self.resumed,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "warm_turns": self.warm_turns,
+                "cold_turns": self.cold_turns,
+            }
+
+
+def make_session_registry():
+    """Build the session registry, or None when CHAT_SESSION_AFFINITY is off"""
+    return SessionRegistry() if SESSION_AFFINITY else None
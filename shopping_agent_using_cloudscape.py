@@ -1,10 +1,6 @@
-from flask import Flask, request, jsonify, render_template_string
-import subprocess
-import json
-import os
-import re
+import sys
 
-app = Flask(__name__)
+from chat_app import WARM_UP, create_chat_app, create_chat_asgi
 
 # HTML template with AWS Cloudscape Design System
 HTML_TEMPLATE = """
@@ -75,6 +71,10 @@ HTML_TEMPLATE = """
         
         .message {
             margin-bottom: var(--awsui-space-m);
+        }
+
+        /* Rows of the message list are marked fresh only when first rendered */
+        .fresh {
             animation: messageSlideIn 0.3s ease-out;
         }
         
@@ -316,6 +316,9 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <script>{{ virtual_list_js|safe }}</script>
+    <script>{{ chat_socket_js|safe }}</script>
+    <script>{{ chat_client_js|safe }}</script>
     <script>
         let isProcessing = false;
         
@@ -345,8 +348,7 @@ HTML_TEMPLATE = """
             return div.innerHTML;
         }
 
-        function addMessage(content, type = 'agent') {
-            const messagesContainer = document.getElementById('chatMessages');
+        function createMessage(content, type = 'agent') {
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${type}`;
             
@@ -360,15 +362,36 @@ HTML_TEMPLATE = """
             
             messageDiv.appendChild(labelDiv);
             messageDiv.appendChild(contentDiv);
-            
-            messagesContainer.appendChild(messageDiv);
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            return messageDiv;
         }
-        
+
+        // Keeps this tab's agent session and sends its messages, over the
+        // WebSocket or, while that cannot be used, POST /chat/stream
+        const chatClient = new ChatClient('/chat/ws');
+
+        // Only the messages near the viewport are in the DOM; the list keeps
+        // itself scrolled to the bottom unless the user has scrolled up
+        const messageList = new VirtualMessageList(
+            document.getElementById('chatMessages'),
+            message => createMessage(message.content, message.type),
+            { estimate: 100, onTop: loadHistory }
+        );
+
+        // Returns the message's index, for messageList.update()
+        function addMessage(content, type = 'agent') {
+            return messageList.append({ content, type });
+        }
+
+        // Earlier turns of this tab's conversation, fetched a page at a time
+        // whenever the list is scrolled to its top (including on load)
+        function loadHistory() {
+            chatClient.loadHistory(messages => messageList.prepend(messages.map(message => ({
+                content: message.content, type: message.error ? 'error' : message.role
+            }))));
+        }
+
         function showTypingIndicator() {
             document.getElementById('typingIndicator').classList.add('show');
-            const messagesContainer = document.getElementById('chatMessages');
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
         }
         
         function hideTypingIndicator() {
@@ -395,26 +418,31 @@ HTML_TEMPLATE = """
             
             showTypingIndicator();
 
-            fetch('/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ prompt: userMessage })
-            })
-            .then(response => response.json())
-            .then(data => {
-                hideTypingIndicator();
-                if (data.error) {
-                    addMessage(data.response, 'error');
-                    updateStatus('active', 'Error occurred - Ready to retry');
-                } else {
-                    addMessage(data.response, 'agent');
-                    updateStatus('active', 'Ready to chat');
+            // Render the agent reply progressively as chunks arrive; the list
+            // applies however many arrive in a frame as one update
+            let agentIndex = null;
+            let agentText = '';
+            chatClient.readChat(userMessage, delta => {
+                if (agentIndex === null) {
+                    hideTypingIndicator();
+                    updateStatus('processing', 'Receiving response...');
+                    agentIndex = addMessage('', 'agent');
                 }
+                agentText += delta;
+                messageList.update(agentIndex, { content: agentText });
+            }, status => {
+                updateStatus('processing', `Waiting for a free agent (${status.waiting} in line)...`);
+            })
+            .then(() => {
+                updateStatus('active', 'Ready to chat');
             })
             .catch(error => {
                 hideTypingIndicator();
+                if (error.fromServer) {
+                    addMessage(error.message, 'error');
+                    updateStatus('active', 'Error occurred - Ready to retry');
+                    return;
+                }
                 console.error('Error:', error);
                 addMessage(`Failed to get response: ${error.message}`, 'error');
                 updateStatus('active', 'Connection error - Ready to retry');
@@ -439,163 +467,37 @@ HTML_TEMPLATE = """
         // Focus input on load
         window.onload = function() {
             document.getElementById('userInput').focus();
-            addMessage('Hello! I\'m your Amazon shopping assistant. How can I help you today?', 'agent');
+            if (!chatClient.sessionId) {
+                // A reloaded tab gets its conversation back instead
+                addMessage('Hello! I\\'m your Amazon shopping assistant. How can I help you today?', 'agent');
+            }
         };
     </script>
 </body>
 </html>
 """
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-@app.route('/chat', methods=['POST'])
-def chat():
-    try:
-        if not request.is_json:
-            return jsonify({"response": "Invalid request format", "error": True})
 
-        user_prompt = request.json.get('prompt')
-        if not user_prompt:
-            return jsonify({"response": "Please provide a valid prompt", "error": True})
-
-        # Get AWS credentials
-        creds_json = subprocess.check_output([
-            "pybritive", "checkout",
-            "aws_standalone_app_513826297540/513826297540 (aws_standalone_app_513826297540_environment)/AWS Admin Full Access",
-            "-t", "agentic-ai"
-        ], text=True, timeout=30)
-        creds = json.loads(creds_json)
-
-        # Set credentials
-        os.environ['AWS_ACCESS_KEY_ID'] = creds['AccessKeyId']
-        os.environ['AWS_SECRET_ACCESS_KEY'] = creds['SecretAccessKey']
-        os.environ['AWS_SESSION_TOKEN'] = creds['SessionToken']
-
-        # Invoke agentcore
-        prompt_payload = json.dumps({"prompt": user_prompt})
-        result = subprocess.run([
-            "agentcore", "invoke",
-            "--agent", "async_shopping_strands",
-            prompt_payload
-        ], capture_output=True, text=True, check=True, timeout=60)
-
-        output = result.stdout
-        if not output.strip():
-            return jsonify({"response": "No output from agentcore", "error": True})
-
-        # Parse response
-        agent_reply = None
-        
-        # Try direct JSON parse
-        try:
-            response_data = json.loads(output)
-            agent_reply = extract_text_from_response(response_data)
-        except json.JSONDecodeError:
-            pass
-
-        # Try regex extraction
-        if not agent_reply:
-            response_match = re.search(r'"response":\s*\[\s*"(b\'.*?\')"\s*\]', output, re.DOTALL)
-            if response_match:
-                response_item = response_match.group(1)
-                if response_item.startswith("b'") and response_item.endswith("'"):
-                    inner_json_str = response_item[2:-1]
-                    inner_json_str = inner_json_str.replace('\\"', '"').replace("\\'", "'")
-                    inner_json_str = inner_json_str.replace('\\\\n', '\n').replace('\\n', '\n')
-                    inner_json_str = inner_json_str.replace('\\\\', '\\')
-                    
-                    try:
-                        inner_data = json.loads(inner_json_str)
-                        if "result" in inner_data and "content" in inner_data["result"]:
-                            content = inner_data["result"]["content"]
-                            if isinstance(content, list) and len(content) > 0 and "text" in content[0]:
-                                agent_reply = content[0]["text"]
-                    except json.JSONDecodeError:
-                        text_match = re.search(r'"text":\s*"([^"]*(?:\\.[^"]*)*)"', inner_json_str)
-                        if text_match:
-                            agent_reply = text_match.group(1)
-
-        # Fallback to plain text
-        if not agent_reply and len(output) < 500 and not any(char in output for char in ['{', '}', '[', ']', '"']):
-            agent_reply = output.strip()
-
-        if not agent_reply:
-            return jsonify({"response": "Could not parse response", "error": True})
-
-        # Clean up the text formatting
-        agent_reply = clean_agent_text(agent_reply)
-
-        return jsonify({"response": agent_reply})
-
-    except Exception as e:
-        return jsonify({"response": f"Error: {str(e)}", "error": True})
-
-
-def clean_agent_text(text):
-    """Clean up escape sequences and formatting in agent responses"""
-    
-    # Handle backslash-space patterns that should be line breaks
-    # Replace "\ \ " with double line breaks (paragraph breaks)
-    text = text.replace('\\ \\ ', '\n\n')
-    
-    # Handle numbered lists - backslash before number
-    text = re.sub(r'\\\s+(\d+\.)', r'\n\1', text)
-    
-    # Handle colon followed by backslash (typically before lists)
-    text = text.replace(':\\\\', ':\n')
-    text = text.replace(':\\ ', ':\n')
-    
-    # Handle single backslash-space (general line break)
-    text = text.replace('\\ ', '\n')
-    
-    # Clean up escape sequences
-    text = text.replace('\\n\\n', '\n\n')  # Double newlines
-    text = text.replace('\\n', '\n')       # Single newlines
-    text = text.replace("\\'", "'")        # Escaped single quotes
-    text = text.replace('\\"', '"')        # Escaped double quotes
-    text = text.replace('\\t', '\t')       # Tabs
-    
-    # Handle any remaining double backslashes
-    text = text.replace('\\\\', '\\')
-    
-    # Remove trailing backslash if present
-    if text.endswith('\\'):
-        text = text[:-1]
-    
-    return text
+def create_app(warm_up=WARM_UP):
+    """App factory, e.g. gunicorn 'shopping_agent_using_cloudscape:create_app()'"""
+    return create_chat_app(__name__, HTML_TEMPLATE, warm_up)
 
 
-def extract_text_from_response(data):
-    """Extract text from various response formats"""
-    if isinstance(data, dict):
-        if "text" in data:
-            return data["text"]
-        if "result" in data and isinstance(data["result"], dict):
-            result = data["result"]
-            if "content" in result and isinstance(result["content"], list):
-                content = result["content"]
-                if len(content) > 0 and isinstance(content[0], dict) and "text" in content[0]:
-                    return content[0]["text"]
-        if "response" in data and isinstance(data["response"], list):
-            if len(data["response"]) > 0:
-                response_item = data["response"][0]
-                if isinstance(response_item, str) and response_item.startswith("b'"):
-                    # Handle byte string format
-                    inner_json_str = response_item[2:]
-                    if inner_json_str.endswith("'"):
-                        inner_json_str = inner_json_str[:-1]
-                    inner_json_str = inner_json_str.replace('\\"', '"').replace("\\'", "'")
-                    inner_json_str = inner_json_str.replace('\\\\n', '\n').replace('\\n', '\n')
-                    inner_json_str = inner_json_str.replace('\\\\', '\\')
-                    try:
-                        inner_data = json.loads(inner_json_str)
-                        return extract_text_from_response(inner_data)
-                    except:
-                        return response_item
-    return None
+def __getattr__(name):
+    # app and asgi_app are built on first use, so importing the module builds no backend
+    if name not in ("app", "asgi_app"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if "app" not in globals():
+        globals()["app"] = create_app()
+    if name == "asgi_app":
+        # Async serving mode with bounded concurrency: uvicorn <module>:asgi_app
+        globals()["asgi_app"] = create_chat_asgi(globals()["app"])
+    return globals()[name]
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    if '--asgi' in sys.argv:
+        import uvicorn
+        uvicorn.run(create_chat_asgi(create_app()))
+    else:
+        create_app().run(debug=True)
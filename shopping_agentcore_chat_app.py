@@ -1,10 +1,6 @@
-from flask import Flask, request, jsonify, render_template_string
-import subprocess
-import json
-import os
-import re
+import sys
 
-app = Flask(__name__)
+from chat_app import WARM_UP, create_chat_app, create_chat_asgi
 
 # HTML template for single-page chat UI
 HTML_TEMPLATE = """
@@ -96,6 +92,9 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <script>{{ virtual_list_js|safe }}</script>
+    <script>{{ chat_socket_js|safe }}</script>
+    <script>{{ chat_client_js|safe }}</script>
     <script>
         function escapeHtml(text) {
             const div = document.createElement('div');
@@ -103,17 +102,39 @@ HTML_TEMPLATE = """
             return div.innerHTML;
         }
 
-        function addMessage(content, isUser, isError = false) {
-            const chatbox = document.getElementById('chatbox');
+        function createMessage(content, isUser, isError = false) {
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${isUser ? 'user' : 'agent'} ${isError ? 'error' : ''}`;
 
             const label = isUser ? 'You' : (isError ? 'Error' : 'Agent');
             const escapedContent = escapeHtml(content);
-            messageDiv.innerHTML = `<b>${label}:</b> ${escapedContent}`;
+            messageDiv.innerHTML = `<b>${label}:</b> <span class="content">${escapedContent}</span>`;
+            return messageDiv;
+        }
+
+        // Keeps this tab's agent session and sends its messages, over the
+        // WebSocket or, while that cannot be used, POST /chat/stream
+        const chatClient = new ChatClient('/chat/ws');
+
+        // Only the messages near the viewport are in the DOM; the list keeps
+        // itself scrolled to the bottom unless the user has scrolled up
+        const messageList = new VirtualMessageList(
+            document.getElementById('chatbox'),
+            message => createMessage(message.content, message.isUser, message.isError),
+            { onTop: loadHistory }
+        );
+
+        // Returns the message's index, for messageList.update()
+        function addMessage(content, isUser, isError = false) {
+            return messageList.append({ content, isUser, isError });
+        }
 
-            chatbox.appendChild(messageDiv);
-            chatbox.scrollTop = chatbox.scrollHeight;
+        // Earlier turns of this tab's conversation, fetched a page at a time
+        // whenever the list is scrolled to its top (including on load)
+        function loadHistory() {
+            chatClient.loadHistory(messages => messageList.prepend(messages.map(message => ({
+                content: message.content, isUser: message.role === 'user', isError: message.error
+            }))));
         }
 
         function sendMessage() {
@@ -130,22 +151,26 @@ HTML_TEMPLATE = """
             addMessage(userMessage, true);
             input.value = '';
 
-            fetch('/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ prompt: userMessage })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    addMessage(data.response, false, true);
-                } else {
-                    addMessage(data.response, false);
+            // Render the agent reply progressively as chunks arrive; the list
+            // applies however many arrive in a frame as one update
+            let agentIndex = null;
+            let agentText = '';
+            chatClient.readChat(userMessage, delta => {
+                if (agentIndex === null) {
+                    agentIndex = addMessage('', false);
+                }
+                agentText += delta;
+                messageList.update(agentIndex, { content: agentText });
+            }, status => {
+                if (agentIndex === null) {
+                    agentIndex = addMessage(`Waiting for a free agent (${status.waiting} in line)...`, false);
                 }
             })
             .catch(error => {
+                if (error.fromServer) {
+                    addMessage(error.message, false, true);
+                    return;
+                }
                 console.error('Error:', error);
                 addMessage(`Failed to get response: ${error.message}`, false, true);
             })
@@ -172,156 +197,27 @@ HTML_TEMPLATE = """
 </html>
 """
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-@app.route('/chat', methods=['POST'])
-def chat():
-    try:
-        if not request.is_json:
-            return jsonify({"response": "Invalid request format", "error": True})
-
-        user_prompt = request.json.get('prompt')
-        if not user_prompt:
-            return jsonify({"response": "Please provide a valid prompt", "error": True})
-
-        # Get AWS credentials
-        creds_json = subprocess.check_output([
-            "pybritive", "checkout",
-            "aws_standalone_app_513826297540/513826297540 (aws_standalone_app_513826297540_environment)/AWS Admin Full Access",
-            "-t", "agentic-ai"
-        ], text=True, timeout=30)
-        creds = json.loads(creds_json)
-
-        # Set credentials
-        os.environ['AWS_ACCESS_KEY_ID'] = creds['AccessKeyId']
-        os.environ['AWS_SECRET_ACCESS_KEY'] = creds['SecretAccessKey']
-        os.environ['AWS_SESSION_TOKEN'] = creds['SessionToken']
-
-        # Invoke agentcore
-        prompt_payload = json.dumps({"prompt": user_prompt})
-        result = subprocess.run([
-            "agentcore", "invoke",
-            "--agent", "async_shopping_strands",
-            prompt_payload
-        ], capture_output=True, text=True, check=True, timeout=60)
-
-        output = result.stdout
-        if not output.strip():
-            return jsonify({"response": "No output from agentcore", "error": True})
-
-        # Parse response
-        agent_reply = None
-        
-        # Try direct JSON parse
-        try:
-            response_data = json.loads(output)
-            agent_reply = extract_text_from_response(response_data)
-        except json.JSONDecodeError:
-            pass
-
-        # Try regex extraction
-        if not agent_reply:
-            response_match = re.search(r'"response":\s*\[\s*"(b\'.*?\')"\s*\]', output, re.DOTALL)
-            if response_match:
-                response_item = response_match.group(1)
-                if response_item.startswith("b'") and response_item.endswith("'"):
-                    inner_json_str = response_item[2:-1]
-                    inner_json_str = inner_json_str.replace('\\"', '"').replace("\\'", "'")
-                    inner_json_str = inner_json_str.replace('\\\\n', '\n').replace('\\n', '\n')
-                    inner_json_str = inner_json_str.replace('\\\\', '\\')
-                    
-                    try:
-                        inner_data = json.loads(inner_json_str)
-                        if "result" in inner_data and "content" in inner_data["result"]:
-                            content = inner_data["result"]["content"]
-                            if isinstance(content, list) and len(content) > 0 and "text" in content[0]:
-                                agent_reply = content[0]["text"]
-                    except json.JSONDecodeError:
-                        text_match = re.search(r'"text":\s*"([^"]*(?:\\.[^"]*)*)"', inner_json_str)
-                        if text_match:
-                            agent_reply = text_match.group(1)
-
-        # Fallback to plain text
-        if not agent_reply and len(output) < 500 and not any(char in output for char in ['{', '}', '[', ']', '"']):
-            agent_reply = output.strip()
-
-        if not agent_reply:
-            return jsonify({"response": "Could not parse response", "error": True})
-
-        # Clean up the text formatting
-        agent_reply = clean_agent_text(agent_reply)
-
-        return jsonify({"response": agent_reply})
-
-    except Exception as e:
-        return jsonify({"response": f"Error: {str(e)}", "error": True})
-
 
-def clean_agent_text(text):
-    """Clean up escape sequences and formatting in agent responses"""
-    
-    # Handle backslash-space patterns that should be line breaks
-    # Replace "\ \ " with double line breaks (paragraph breaks)
-    text = text.replace('\\ \\ ', '\n\n')
-    
-    # Handle numbered lists - backslash before number
-    text = re.sub(r'\\\s+(\d+\.)', r'\n\1', text)
-    
-    # Handle colon followed by backslash (typically before lists)
-    text = text.replace(':\\\\', ':\n')
-    text = text.replace(':\\ ', ':\n')
-    
-    # Handle single backslash-space (general line break)
-    text = text.replace('\\ ', '\n')
-    
-    # Clean up escape sequences
-    text = text.replace('\\n\\n', '\n\n')  # Double newlines
-    text = text.replace('\\n', '\n')       # Single newlines
-    text = text.replace("\\'", "'")        # Escaped single quotes
-    text = text.replace('\\"', '"')        # Escaped double quotes
-    text = text.replace('\\t', '\t')       # Tabs
-    
-    # Handle any remaining double backslashes
-    text = text.replace('\\\\', '\\')
-    
-    # Remove trailing backslash if present
-    if text.endswith('\\'):
-        text = text[:-1]
-    
-    return text
+def create_app(warm_up=WARM_UP):
+    """App factory, e.g. gunicorn 'shopping_agentcore_chat_app:create_app()'"""
+    return create_chat_app(__name__, HTML_TEMPLATE, warm_up)
 
 
-def extract_text_from_response(data):
-    """Extract text from various response formats"""
-    if isinstance(data, dict):
-        if "text" in data:
-            return data["text"]
-        if "result" in data and isinstance(data["result"], dict):
-            result = data["result"]
-            if "content" in result and isinstance(result["content"], list):
-                content = result["content"]
-                if len(content) > 0 and isinstance(content[0], dict) and "text" in content[0]:
-                    return content[0]["text"]
-        if "response" in data and isinstance(data["response"], list):
-            if len(data["response"]) > 0:
-                response_item = data["response"][0]
-                if isinstance(response_item, str) and response_item.startswith("b'"):
-                    # Handle byte string format
-                    inner_json_str = response_item[2:]
-                    if inner_json_str.endswith("'"):
-                        inner_json_str = inner_json_str[:-1]
-                    inner_json_str = inner_json_str.replace('\\"', '"').replace("\\'", "'")
-                    inner_json_str = inner_json_str.replace('\\\\n', '\n').replace('\\n', '\n')
-                    inner_json_str = inner_json_str.replace('\\\\', '\\')
-                    try:
-                        inner_data = json.loads(inner_json_str)
-                        return extract_text_from_response(inner_data)
-                    except:
-                        return response_item
-    return None
+def __getattr__(name):
+    # app and asgi_app are built on first use, so importing the module builds no backend
+    if name not in ("app", "asgi_app"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if "app" not in globals():
+        globals()["app"] = create_app()
+    if name == "asgi_app":
+        # Async serving mode with bounded concurrency: uvicorn <module>:asgi_app
+        globals()["asgi_app"] = create_chat_asgi(globals()["app"])
+    return globals()[name]
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    if '--asgi' in sys.argv:
+        import uvicorn
+        uvicorn.run(create_chat_asgi(create_app()))
+    else:
+        create_app().run(debug=True)
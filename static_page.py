@@ -0,0 +1,81 @@
+"""Pre-rendered, precompressed index page with ETag revalidation."""
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The URL is not versioned, so browsers keep the page briefly and then
+# revalidate against the content-hash ETag, which costs a 304
+INDEX_MAX_AGE = int(os.environ.get("INDEX_MAX_AGE", "300"))
+
+# Preferred first when the client accepts several
+_ENCODINGS = ("br", "gzip", "identity")
+
+
+def accepted_encodings(accept_encoding):
+    """Return which of the supported content codings an Accept-Encoding header allows"""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        params = params.strip()
+        try:
+            weights[coding] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weights[coding] = 0.0
+    # "*" covers codings not listed explicitly; identity is acceptable unless refused
+    wildcard = weights.get("*")
+    accepted = set()
+    for coding in _ENCODINGS:
+        default = 1.0 if coding == "identity" else 0.0
+        q = weights.get(coding, default if wildcard is None else wildcard)
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class PrerenderedPage:
+    """A static page rendered once and kept in every supported encoding"""
+
+    def __init__(self, html, content_type="text/html; charset=utf-8", max_age=INDEX_MAX_AGE):
+        body = html.encode("utf-8") if isinstance(html, str) else html
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.content_type = content_type
+        self.cache_control = f"public, max-age={max_age}"
+        self.variants = {"identity": (body, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+    def select(self, accept_encoding=None, if_none_match=None):
+        """Pick the variant for a request; returns (status, body, headers)"""
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next(e for e in _ENCODINGS if e in self.variants and (e in accepted or e == "identity"))
+        body, etag = self.variants[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(if_none_match, etag):
+            return 304, b"", headers
+        headers["Content-Type"] = self.content_type
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, body, headers
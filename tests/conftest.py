@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Read when the modules are imported; keeps the tests' history out of the working directory
+os.environ.setdefault("CHAT_HISTORY_PATH", os.path.join(tempfile.mkdtemp(prefix="chat-tests-"), "history.sqlite3"))
@@ -0,0 +1,38 @@
+import pytest
+
+from admission import RateLimiter, TooManyRequests
+from chat_core import ChatBackend
+from sessions import SessionRegistry
+
+
+def backend_keyed_on_sessions():
+    backend = ChatBackend("<html></html>")
+    backend.rate_limiter = RateLimiter(per_minute=1, burst=2)
+    backend.rate_limit_key = "session"
+    backend.sessions = SessionRegistry()
+    return backend
+
+
+def test_rotating_session_ids_does_not_escape_the_limit():
+    backend = backend_keyed_on_sessions()
+    for n in range(2):
+        payload = {"prompt": "hi", "session_id": f"made-up-session-{n:08d}"}
+        backend.admit(payload, "203.0.113.7")
+        # Even once this process has seen the id, the client chose it
+        backend.chat_session(payload)
+    with pytest.raises(TooManyRequests):
+        backend.admit({"prompt": "hi", "session_id": "made-up-session-00000000"}, "203.0.113.7")
+    with pytest.raises(TooManyRequests):
+        backend.admit({"prompt": "hi", "session_id": "made-up-session-00000099"}, "203.0.113.7")
+
+
+def test_issued_sessions_are_charged_separately():
+    backend = backend_keyed_on_sessions()
+    sessions = [backend.chat_session({"prompt": "hi"}) for _ in range(2)]
+    for session in sessions:
+        for _ in range(2):
+            backend.admit({"prompt": "hi", "session_id": session.id}, "203.0.113.7")
+    with pytest.raises(TooManyRequests):
+        backend.admit({"prompt": "hi", "session_id": sessions[0].id}, "203.0.113.7")
+    # The address still has its own allowance for requests without a session
+    backend.admit({"prompt": "hi"}, "203.0.113.7")
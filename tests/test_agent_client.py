@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from agent_client import HttpAgentClient
+
+
+def test_connection_is_closed_when_the_runtime_stalls_sending_headers():
+    async def scenario():
+        closed = asyncio.Event()
+
+        async def stall_in_headers(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n")
+            await writer.drain()
+            # Never finishes the headers; returns once the client hangs up
+            await reader.read()
+            closed.set()
+            writer.close()
+
+        server = await asyncio.start_server(stall_in_headers, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = HttpAgentClient(f"http://127.0.0.1:{port}/invocations", timeout=0.2)
+        # Holds on to the connection, so only an explicit close ends it
+        opened = []
+        acquire = client._acquire_async
+
+        async def acquire_and_keep(port):
+            connection = await acquire(port)
+            opened.append(connection)
+            return connection
+
+        client._acquire_async = acquire_and_keep
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.invoke_async("hi", None)
+            await asyncio.wait_for(closed.wait(), 1)
+        finally:
+            server.close()
+            await server.wait_closed()
+        assert opened[0][1].is_closing()
+        assert client._async_pool == []
+
+    asyncio.run(scenario())
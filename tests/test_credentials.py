@@ -0,0 +1,67 @@
+import threading
+
+from agent_credentials import AwsCredentials, CredentialProvider
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingCheckout:
+    """Hands out credentials expiring in 100 seconds, then fails once `failing` is set"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = 0
+        self.failing = False
+
+    def __call__(self):
+        self.calls += 1
+        if self.failing:
+            raise RuntimeError("checkout failed")
+        return AwsCredentials("key", "secret", "token", self.clock() + 100)
+
+
+def refresh_ahead(provider):
+    """Call get() and wait for the background refresh it starts, if any"""
+    creds = provider.get()
+    refreshes = [thread for thread in threading.enumerate() if thread.name.endswith("(_background_refresh)")]
+    for thread in refreshes:
+        thread.join(1)
+    return creds
+
+
+def test_failed_refresh_ahead_backs_off_and_keeps_serving_credentials():
+    clock = Clock()
+    checkout = FailingCheckout(clock)
+    provider = CredentialProvider(checkout, refresh_margin=50, clock=clock, backoff=5, max_backoff=8)
+    creds = provider.get()
+    checkout.failing = True
+
+    # Inside the refresh margin: the refresh fails, the credentials are still served
+    clock.now += 60
+    assert refresh_ahead(provider) is creds
+    assert checkout.calls == 2
+
+    # No new attempt until the backoff has passed
+    clock.now += 4
+    assert refresh_ahead(provider) is creds
+    assert checkout.calls == 2
+    clock.now += 1
+    assert refresh_ahead(provider) is creds
+    assert checkout.calls == 3
+
+    # The second failure doubles the wait, up to the maximum
+    clock.now += 7
+    assert refresh_ahead(provider) is creds
+    assert checkout.calls == 3
+    clock.now += 1
+    checkout.failing = False
+    assert refresh_ahead(provider) is creds
+    assert checkout.calls == 4
+    assert provider.get() is not creds
+    assert provider.stats() == {"refreshes": 2, "refresh_failures": 2}
@@ -0,0 +1,31 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+
+pytest.importorskip("flask")
+
+import chat_app  # noqa: E402
+import deadlines  # noqa: E402
+
+
+def test_chat_stops_waiting_for_a_checkout_that_outlasts_its_budget(monkeypatch):
+    monkeypatch.setattr(chat_app, "Deadline", partial(deadlines.Deadline, 0.3))
+    app = chat_app.create_chat_app(__name__, "<html></html>", warm_up=False)
+    released = threading.Event()
+
+    def stalled_checkout():
+        released.wait(5)
+        raise RuntimeError("checkout stalled")
+
+    app.extensions["chat_backend"].credential_provider._fetch = stalled_checkout
+    try:
+        start = time.monotonic()
+        response = app.test_client().post("/chat", json={"prompt": "best wireless earbuds under $100"})
+        elapsed = time.monotonic() - start
+    finally:
+        released.set()
+    assert elapsed < 2
+    assert response.get_json() == {"response": "Error: The request ran out of time before the agent answered",
+                                   "error": True}
@@ -0,0 +1,33 @@
+import pytest
+
+from intent_router import IntentRouter, classify
+
+
+@pytest.mark.parametrize("prompt", ["hi", "Thank you so much!", "What can you do?"])
+def test_answers_messages_that_are_only_an_intent(prompt):
+    assert IntentRouter().route(prompt) is not None
+
+
+@pytest.mark.parametrize("prompt", ["hi, any earbuds under $100?", "thank you cards"])
+def test_passes_questions_for_the_agent_through(prompt):
+    assert IntentRouter().route(prompt) is None
+
+
+@pytest.mark.parametrize("prompt", [None, 5, 1.5, ["hi"], {"text": "hi"}])
+def test_passes_non_string_prompts_through(prompt):
+    assert classify(prompt) is None
+    assert IntentRouter().route(prompt) is None
+
+
+@pytest.mark.parametrize("prompt", [5, ["hi"], None, {"text": "hi"}])
+def test_chat_routes_reject_non_string_prompts(prompt):
+    pytest.importorskip("flask")
+    from chat_app import create_chat_app
+
+    client = create_chat_app(__name__, "<html></html>", warm_up=False).test_client()
+    response = client.post("/chat", json={"prompt": prompt})
+    assert response.status_code == 200
+    assert response.get_json() == {"response": "Please provide a valid prompt", "error": True}
+    response = client.post("/chat/stream", json={"prompt": prompt})
+    assert response.status_code == 200
+    assert b"Please provide a valid prompt" in response.get_data()
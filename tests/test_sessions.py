@@ -0,0 +1,35 @@
+from chat_core import ChatBackend
+from metrics import RequestTiming
+from response_cache import make_response_cache
+from sessions import SessionRegistry
+
+PROMPT = "best wireless earbuds under $100"
+
+
+def backend_with_cache():
+    backend = ChatBackend("<html></html>")
+    backend.response_cache = make_response_cache("memory")
+    backend.sessions = SessionRegistry()
+    backend.history = None
+    return backend
+
+
+def test_only_requests_without_a_session_id_use_the_cache():
+    backend = backend_with_cache()
+    first = backend.chat_session({"prompt": PROMPT})
+    assert backend.local_reply(PROMPT, RequestTiming(), first) is None
+    backend.streamed_reply(PROMPT, "first answer", first, 1.0)
+
+    # A follow-up naming a session this process never saw, e.g. one another worker answered
+    follow_up = backend.chat_session({"prompt": PROMPT, "session_id": "s" * 24})
+    assert backend.local_reply(PROMPT, RequestTiming(), follow_up) is None
+    backend.streamed_reply(PROMPT, "answer in context", follow_up, 1.0)
+
+    # ... and one on the session issued above
+    again = backend.chat_session({"prompt": PROMPT, "session_id": first.id})
+    assert again is first
+    assert backend.local_reply(PROMPT, RequestTiming(), again) is None
+
+    other_tab = backend.chat_session({"prompt": PROMPT})
+    assert backend.local_reply(PROMPT, RequestTiming(), other_tab) == {"response": "first answer", "cached": True}
+    assert other_tab.turns == 1
@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("flask")
+
+from chat_app import create_chat_app, create_chat_asgi  # noqa: E402
+
+
+def asgi_get(app, path):
+    """Status and body of a GET against an ASGI app"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [], "query_string": b""}
+    asyncio.run(app(scope, receive, send))
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def schema(stats):
+    """Each /stats group and the counters it reports"""
+    return {group: sorted(values) for group, values in stats.items()}
+
+
+def test_flask_and_asgi_report_the_same_stats():
+    app = create_chat_app(__name__, "<html></html>", warm_up=False)
+    flask_stats = app.test_client().get("/stats").get_json()
+    status, body = asgi_get(create_chat_asgi(app), "/stats")
+    assert status == 200
+    asgi_stats = json.loads(body)
+    assert schema(flask_stats) == schema(asgi_stats)
+    assert {"startup", "admission", "credentials", "cancellations", "compression", "websocket",
+            "coalescing"} <= set(flask_stats)
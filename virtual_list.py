@@ -0,0 +1,212 @@
+"""Windowed message list shared by both chat pages.
+
+Only the messages in and near the viewport are in the DOM; the rest are
+represented by two spacers whose heights come from measured (or, until a
+message has been on screen, estimated) message heights. Appends, streamed
+updates and prepended history pages are applied together in one animation
+frame. Heights are measured with a ResizeObserver and the scroll position is
+computed from that model, so nothing reads layout after writing to the DOM:
+the frame's only layout-dependent write, the scroll position, comes last.
+
+The pages include VIRTUAL_LIST_JS in a script tag and construct
+
+    new VirtualMessageList(container, render, {onTop})
+
+where render(message) returns the element for one message. New messages
+get the `fresh` class on their row the first time they are rendered, so
+entry animations play once rather than each time a message scrolls back in.
+"""
+
+VIRTUAL_LIST_JS = r"""
+class VirtualMessageList {
+    constructor(container, render, options = {}) {
+        this.container = container;
+        this.render = render;
+        // Height assumed for a message until it has been rendered and measured
+        this.estimate = options.estimate || 80;
+        // Pixels rendered beyond each edge of the viewport
+        this.overscan = options.overscan || 800;
+        this.onTop = options.onTop || null;
+        this.items = [];
+        this.rows = new Map();
+        this.total = 0;
+        this.offsetsStale = false;
+        this.pinned = true;
+        this.anchorShift = 0;
+        this.scrollTop = 0;
+        this.viewportHeight = container.clientHeight;
+        this.frame = 0;
+
+        this.topSpacer = document.createElement('div');
+        this.body = document.createElement('div');
+        this.bottomSpacer = document.createElement('div');
+        // Scroll anchoring is done here, against the model
+        container.style.overflowAnchor = 'none';
+        container.append(this.topSpacer, this.body, this.bottomSpacer);
+
+        this.rowObserver = new ResizeObserver(entries => this.measured(entries));
+        new ResizeObserver(entries => {
+            this.viewportHeight = entries[0].contentRect.height;
+            this.schedule();
+        }).observe(container);
+        container.addEventListener('scroll', () => {
+            // Scroll events run before the frame's callbacks, when layout is
+            // still clean, so these reads cost nothing
+            const scrollTop = container.scrollTop;
+            const atBottom = scrollTop + container.clientHeight >= container.scrollHeight - 40;
+            // Scrolling up unpins and reaching the bottom pins again. The
+            // list's own writes never move up, so messages that grew since
+            // it scrolled to the bottom do not unpin it.
+            if (atBottom || scrollTop < this.scrollTop) {
+                this.pinned = atBottom;
+            }
+            this.scrollTop = scrollTop;
+            this.schedule();
+        }, { passive: true });
+    }
+
+    get length() {
+        return this.items.length;
+    }
+
+    // Add a message at the bottom; returns its index for update()
+    append(message, fresh = true) {
+        this.items.push({ message, height: this.estimate, top: this.total, index: this.items.length, fresh });
+        this.total += this.estimate;
+        this.schedule();
+        return this.items.length - 1;
+    }
+
+    // Add older messages above the first one, keeping the view where it is
+    prepend(messages) {
+        if (!messages.length) return;
+        const added = messages.map(message => ({ message, height: this.estimate, top: 0, index: 0, fresh: false }));
+        this.items = added.concat(this.items);
+        this.total += added.length * this.estimate;
+        this.anchorShift += added.length * this.estimate;
+        this.offsetsStale = true;
+        this.schedule();
+    }
+
+    // Change fields of a message, e.g. the text of a reply that is streaming in
+    update(index, changes) {
+        const item = this.items[index];
+        Object.assign(item.message, changes);
+        item.stale = true;
+        this.schedule();
+    }
+
+    schedule() {
+        if (!this.frame) {
+            this.frame = requestAnimationFrame(() => this.flush());
+        }
+    }
+
+    layoutOffsets() {
+        let top = 0;
+        for (let i = 0; i < this.items.length; i++) {
+            const item = this.items[i];
+            item.index = i;
+            item.top = top;
+            top += item.height;
+        }
+        this.total = top;
+        this.offsetsStale = false;
+    }
+
+    // Index of the message at vertical position y
+    find(y) {
+        let low = 0;
+        let high = this.items.length - 1;
+        while (low < high) {
+            const mid = (low + high + 1) >> 1;
+            if (this.items[mid].top <= y) {
+                low = mid;
+            } else {
+                high = mid - 1;
+            }
+        }
+        return low;
+    }
+
+    measured(entries) {
+        // Called after layout, so sizes are read without forcing one
+        for (const entry of entries) {
+            const item = entry.target.item;
+            const height = entry.contentRect.height;
+            if (!item || height === item.height) continue;
+            // A message above the viewport that changes height would push
+            // the visible ones around; shift the scroll position to match
+            if (!this.pinned && item.top < this.scrollTop) {
+                this.anchorShift += height - item.height;
+            }
+            item.height = height;
+            this.offsetsStale = true;
+        }
+        if (this.offsetsStale) {
+            this.schedule();
+        }
+    }
+
+    flush() {
+        this.frame = 0;
+        if (this.offsetsStale) {
+            this.layoutOffsets();
+        }
+        const scrollTop = this.pinned
+            ? Math.max(0, this.total - this.viewportHeight)
+            : Math.max(0, this.scrollTop + this.anchorShift);
+        this.anchorShift = 0;
+
+        const items = this.items;
+        const first = items.length ? this.find(scrollTop - this.overscan) : 0;
+        const last = items.length ? this.find(scrollTop + this.viewportHeight + this.overscan) : -1;
+
+        for (const [item, row] of this.rows) {
+            if (item.index < first || item.index > last || items[item.index] !== item) {
+                this.rowObserver.unobserve(row);
+                row.remove();
+                this.rows.delete(item);
+            }
+        }
+        // Rows still rendered stay in order, so new ones go in around them
+        // without moving existing nodes (and restarting their animations)
+        let next = this.body.firstChild;
+        for (let i = first; i <= last; i++) {
+            const item = items[i];
+            let row = this.rows.get(item);
+            if (row) {
+                if (item.stale) {
+                    row.replaceChildren(this.render(item.message));
+                }
+                next = row.nextSibling;
+            } else {
+                row = document.createElement('div');
+                // flow-root keeps the message's margins inside the measured row
+                row.style.display = 'flow-root';
+                if (item.fresh) {
+                    row.className = 'fresh';
+                }
+                row.item = item;
+                row.append(this.render(item.message));
+                this.body.insertBefore(row, next);
+                this.rows.set(item, row);
+                this.rowObserver.observe(row);
+            }
+            item.fresh = false;
+            item.stale = false;
+        }
+
+        const end = last >= 0 ? items[last].top + items[last].height : 0;
+        this.topSpacer.style.height = `${first < items.length ? items[first].top : 0}px`;
+        this.bottomSpacer.style.height = `${this.total - end}px`;
+        if (scrollTop !== this.scrollTop) {
+            this.scrollTop = scrollTop;
+            this.container.scrollTop = scrollTop;
+        }
+        if (this.onTop && scrollTop < 50) {
+            this.onTop();
+        }
+    }
+}
+"""